@@ -10,7 +10,7 @@ from Config import Config
 from llm.ChatCore import chat_with_history
 from llm.RagCore import get_answer
 from llm.RetrieverCore import get_expr
-from uicomponent.StComponent import side_bar_links, score_text
+from uicomponent.StComponent import side_bar_links, score_text, highlight_text
 from uicomponent.StatusBus import get_config, update_config
 
 
@@ -165,10 +165,7 @@ with col_doc:
                     unsafe_allow_html=True
                 )
 
-                main_content: str = str(ref.page_content)
-
-                for _sentence in ref.metadata['refer_sentence']:
-                    main_content = main_content.replace(_sentence, f' :orange[{_sentence}]')
+                main_content = highlight_text(str(ref.page_content), ref.metadata.get('refer_span', []))
 
                 st.markdown(main_content)
                 st.divider()
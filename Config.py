@@ -1,7 +1,9 @@
+import copy
 import json
 import os
 import shutil
-from dataclasses import dataclass, field, asdict
+import threading
+from dataclasses import dataclass, field, asdict, replace
 from enum import IntEnum
 from typing import Any
 
@@ -13,7 +15,7 @@ def get_work_path():
     return os.path.dirname(os.path.abspath(__file__))
 
 
-@dataclass
+@dataclass(frozen=True)
 class Collection:
     collection_name: str
     language: str
@@ -27,6 +29,15 @@ class Collection:
         return cls(**data)
 
 
+def load_collections(config_path: str) -> tuple[Collection, ...]:
+    if not os.path.exists(config_path):
+        logger.error(f'no collection config file find at {config_path}')
+        exit()
+
+    with open(config_path, mode='r', encoding='utf-8') as file:
+        return tuple(Collection.from_dict(col) for col in json.load(file)['collections'])
+
+
 @dataclass
 class MilvusConfig:
     data_root: str
@@ -34,6 +45,10 @@ class MilvusConfig:
     milvus_port: int
     using_remote: bool
     remote_database: dict[str, Any]
+    # 全部知识库，由共享的配置快照读取一次，各会话共用
+    catalog: tuple[Collection, ...] = None
+    # 会话状态：是否显示对访客隐藏的知识库
+    visible: bool = False
 
     collections: list[Collection] = field(default_factory=list, init=False)
     config_path: str = field(init=False)
@@ -42,33 +57,33 @@ class MilvusConfig:
     def __post_init__(self):
         self.config_path = os.path.join(get_work_path(), self.data_root, 'collections.json')
 
-        if not os.path.exists(self.config_path):
-            logger.error(f'no collection config file find at {self.config_path}')
-            exit()
-
-        with open(self.config_path, mode='r', encoding='utf-8') as file:
-            json_data = json.load(file)['collections']
-            for col in json_data:
-                collection = Collection.from_dict(col)
-                if collection.visitor_visible:
-                    self.collections.append(collection)
-            self.default_collection = 0
+        if self.catalog is None:
+            self.catalog = load_collections(self.config_path)
+        self.__filter()
+        self.default_collection = 0
 
     @classmethod
     def from_dict(cls, data_root: str, data: dict[str, any]):
         return cls(data_root, **data)
 
-    def set_group_visibility(self, visible: bool) -> None:
-        self.collections.clear()
-
-        with open(self.config_path, mode='r', encoding='utf-8') as file:
-            json_data = json.load(file)['collections']
-
-        for col in json_data:
-            collection = Collection.from_dict(col)
-            if visible or collection.visitor_visible:
-                self.collections.append(collection)
+    def __filter(self) -> None:
+        self.collections = [
+            collection
+            for collection in self.catalog
+            if self.visible or collection.visitor_visible
+        ]
+
+    def overlay(self) -> 'MilvusConfig':
+        """
+        创建会话级的副本，共用知识库列表，只复制可见性和当前选择的知识库，不读取文件。
+        """
+        milvus_config = replace(self)
+        milvus_config.default_collection = self.default_collection
+        return milvus_config
 
+    def set_group_visibility(self, visible: bool) -> None:
+        self.visible = visible
+        self.__filter()
         self.default_collection = 0
 
     def get_collection(self) -> Collection:
@@ -92,40 +107,43 @@ class MilvusConfig:
                 'uri': f'http://{self.milvus_host}:{self.milvus_port}'
             }
 
-    def add_collection(self, collection: Collection) -> None:
-        self.collections.append(collection)
-        json.dump(
-            {"collections": [asdict(c) for c in self.collections]},
-            open(self.config_path, 'w', encoding='utf-8')
-        )
+    def __save_catalog(self, catalog: list[Collection]) -> None:
+        """
+        写入collections.json并使共享的配置快照失效。先写临时文件再替换，读取方不会读到写了一半的文件。
+        index为当前会话可见列表中的序号，对访客隐藏的知识库会原样保留。
+        """
+        tmp_path = f'{self.config_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as file:
+            json.dump({"collections": [asdict(c) for c in catalog]}, file)
+        os.replace(tmp_path, self.config_path)
+
+        self.catalog = tuple(catalog)
+        self.__filter()
+        invalidate_config()
         logger.info('update collection index file')
 
+    def __replace_collection(self, index: int, **changes: Any) -> None:
+        target = self.collections[index]
+        self.__save_catalog([
+            replace(c, **changes) if c.collection_name == target.collection_name else c
+            for c in self.catalog
+        ])
+
+    def add_collection(self, collection: Collection) -> None:
+        self.__save_catalog([*self.catalog, collection])
+
     def remove_collection(self, index: int) -> None:
-        del self.collections[index]
-        json.dump(
-            {"collections": [asdict(c) for c in self.collections]},
-            open(self.config_path, 'w', encoding='utf-8')
-        )
-        logger.info('update collection index file')
+        target = self.collections[index]
+        self.__save_catalog([c for c in self.catalog if c.collection_name != target.collection_name])
 
     def rename_collection(self, index: int, new_name: str) -> None:
-        self.collections[index].title = new_name
-        json.dump(
-            {"collections": [asdict(c) for c in self.collections]},
-            open(self.config_path, 'w', encoding='utf-8')
-        )
-        logger.info('update collection index file')
+        self.__replace_collection(index, title=new_name)
 
     def set_collection_visibility(self, index: int, visible: bool) -> None:
-        self.collections[index].visitor_visible = visible
-        json.dump(
-            {"collections": [asdict(c) for c in self.collections]},
-            open(self.config_path, 'w', encoding='utf-8')
-        )
-        logger.info('update collection index file')
+        self.__replace_collection(index, visitor_visible=visible)
 
 
-@dataclass
+@dataclass(frozen=True)
 class EmbeddingConfig:
     model: str
     save_local: bool
@@ -135,15 +153,15 @@ class EmbeddingConfig:
     local_path: str = field(init=False)
 
     def __post_init__(self):
-        self.local_path = os.path.join(get_work_path(), 'data/model', self.model)
-        os.makedirs(self.local_path, exist_ok=True)
+        # 目录在保存模型时创建，读取配置时不访问文件系统
+        object.__setattr__(self, 'local_path', os.path.join(get_work_path(), 'data/model', self.model))
 
     @classmethod
     def from_dict(cls, data: dict[str, any]):
         return cls(**data)
 
 
-@dataclass
+@dataclass(frozen=True)
 class OpenaiConfig:
     use_proxy: bool
     api_key: str
@@ -153,7 +171,7 @@ class OpenaiConfig:
         return cls(**data)
 
 
-@dataclass
+@dataclass(frozen=True)
 class ZhipuConfig:
     api_key: str
     model: str
@@ -163,17 +181,20 @@ class ZhipuConfig:
         return cls(**data)
 
 
-@dataclass
+@dataclass(frozen=True)
 class PubmedConfig:
     use_proxy: bool
     api_key: str
+    # 0 表示按照NCBI的限额：有API key时每秒10次，否则每秒3次
+    requests_per_second: float = 0
+    batch_size: int = 200
 
     @classmethod
     def from_dict(cls, data: dict[str, any]):
         return cls(**data)
 
 
-@dataclass
+@dataclass(frozen=True)
 class SerperConfig:
     use_proxy: bool
     api_key: str
@@ -183,7 +204,7 @@ class SerperConfig:
         return cls(**data)
 
 
-@dataclass
+@dataclass(frozen=True)
 class GrobidConfig:
     grobid_server: str
     service: str
@@ -192,15 +213,64 @@ class GrobidConfig:
     timeout: int
     coordinates: list[str]
     multi_process: int
+    # 自适应并发：multi_process为并发上限，遇到503或延迟超过target_latency(秒，0表示timeout的一半)时减半
+    min_concurrency: int = 1
+    target_latency: float = 0
+    max_retries: int = 5
+
+    @classmethod
+    def from_dict(cls, data: dict[str, any]):
+        return cls(**data)
+
+
+@dataclass(frozen=True)
+class ChatHistoryConfig:
+    page_size: int = 20
+    window_tokens: int = 6000
+
+    @classmethod
+    def from_dict(cls, data: dict[str, any]):
+        return cls(**data)
+
+
+@dataclass(frozen=True)
+class BulkImportConfig:
+    minio_endpoint: str = '127.0.0.1:9000'
+    access_key: str = 'minioadmin'
+    secret_key: str = 'minioadmin'
+    bucket: str = 'a-bucket'
+    secure: bool = False
+    file_type: str = 'parquet'
 
     @classmethod
     def from_dict(cls, data: dict[str, any]):
         return cls(**data)
 
 
+@dataclass(frozen=True)
+class HttpConfig:
+    # 每个 (代理, 服务类别) 连接池的大小
+    max_connections: int = 100
+    max_keepalive: int = 20
+    keepalive_expiry: float = 30
+    connect_timeout: float = 10
+    read_timeout: float = 60
+    retries: int = 3
+    # 安装了h2时httpx客户端使用HTTP/2
+    http2: bool = True
+
+    @classmethod
+    def from_dict(cls, data: dict[str, any]):
+        return cls(**data)
+
+
+def get_yml_path() -> str:
+    return os.path.join(get_work_path(), 'config.yml')
+
+
 class Config:
     def __init__(self):
-        yml_path = os.path.join(get_work_path(), 'config.yml')
+        yml_path = get_yml_path()
         if not os.path.exists(yml_path):
             logger.info('config dose not exits')
             shutil.copy(os.path.join(get_work_path(), 'config.example.yml'), yml_path)
@@ -212,6 +282,9 @@ class Config:
                 self.yml['paper_directory']['data_root'],
                 self.yml['retrieve']['milvus']
             )
+            self.bulk_import_config: BulkImportConfig = BulkImportConfig.from_dict(
+                self.yml['retrieve'].get('bulk_import', {})
+            )
             self.embedding_config: EmbeddingConfig = EmbeddingConfig.from_dict(self.yml['retrieve']['embedding'])
             self.reranker_config: EmbeddingConfig = EmbeddingConfig.from_dict(self.yml['retrieve']['reranker'])
             self.openai_config: OpenaiConfig = OpenaiConfig.from_dict(self.yml['llm']['openai'])
@@ -219,6 +292,22 @@ class Config:
             self.pubmed_config: PubmedConfig = PubmedConfig.from_dict(self.yml['tools']['pubmed'])
             self.serper_config: SerperConfig = SerperConfig.from_dict(self.yml['tools']['serper'])
             self.grobid_config: GrobidConfig = GrobidConfig.from_dict(self.yml['tools']['grobid'])
+            self.http_config: HttpConfig = HttpConfig.from_dict(self.yml.get('http', {}))
+            self.chat_history_config: ChatHistoryConfig = ChatHistoryConfig.from_dict(
+                self.yml['user_login_config'].get('chat_history', {})
+            )
+
+        self.mtimes = config_mtimes(self.milvus_config.config_path)
+
+    def overlay(self) -> 'Config':
+        """
+        基于当前配置创建会话级配置。各子配置共用且不可修改，只有知识库的选择和可见性是会话自己的。
+
+        :return: 会话级配置
+        """
+        config = copy.copy(self)
+        config.milvus_config = self.milvus_config.overlay()
+        return config
 
     def set_collection(self, collection: int) -> None:
         if collection >= len(self.milvus_config.collections):
@@ -261,6 +350,22 @@ class Config:
         os.makedirs(os.path.dirname(sqlite_path), exist_ok=True)
         return sqlite_path
 
+    def get_segment_path(self, collection_name: str) -> str | bytes:
+        sqlite_path = self.get_sqlite_path(collection_name)
+        return os.path.join(os.path.dirname(sqlite_path), 'document.seg')
+
+    def get_manifest_path(self, collection_name: str) -> str | bytes:
+        sqlite_path = self.get_sqlite_path(collection_name)
+        return os.path.join(os.path.dirname(sqlite_path), 'manifest.db')
+
+    def get_job_path(self, collection_name: str) -> str | bytes:
+        sqlite_path = self.get_sqlite_path(collection_name)
+        return os.path.join(os.path.dirname(sqlite_path), 'jobs.db')
+
+    def get_bulk_path(self, collection_name: str) -> str | bytes:
+        sqlite_path = self.get_sqlite_path(collection_name)
+        return os.path.join(os.path.dirname(sqlite_path), 'bulk')
+
     def get_reference_path(self):
         data_root = self.yml['paper_directory']['data_root']
         reference_path = os.path.join(get_work_path(), data_root, 'reference.db')
@@ -268,6 +373,20 @@ class Config:
         os.makedirs(os.path.dirname(reference_path), exist_ok=True)
         return reference_path
 
+    def get_tei_cache_path(self):
+        data_root = self.yml['paper_directory']['data_root']
+        cache_path = os.path.join(get_work_path(), data_root, 'tei_cache.db')
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        return cache_path
+
+    def get_http_cache_path(self):
+        data_root = self.yml['paper_directory']['data_root']
+        cache_path = os.path.join(get_work_path(), data_root, 'http_cache.db')
+
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        return cache_path
+
     def get_user_path(self):
         user_root = self.yml['user_login_config']['user_root']
 
@@ -285,3 +404,41 @@ class Config:
         proxy_port = self.yml['proxy']['port']
 
         return f'{proxy_type}://{proxy_host}:{proxy_port}'
+
+
+def config_mtimes(collection_path: str) -> tuple[float, float]:
+    return tuple(
+        os.stat(path).st_mtime_ns if os.path.exists(path) else 0
+        for path in (get_yml_path(), collection_path)
+    )
+
+
+_SNAPSHOT: Config | None = None
+_SNAPSHOT_LOCK = threading.Lock()
+
+
+def load_config() -> Config:
+    """
+    获取进程内共享的配置快照，config.yml或collections.json修改后重新加载。
+    快照被所有会话共用，不要修改；需要切换知识库时使用overlay()得到会话级配置。
+
+    :return: 配置快照
+    """
+    global _SNAPSHOT
+
+    with _SNAPSHOT_LOCK:
+        if _SNAPSHOT is None or _SNAPSHOT.mtimes != config_mtimes(_SNAPSHOT.milvus_config.config_path):
+            _SNAPSHOT = Config()
+            logger.info('load config')
+
+        return _SNAPSHOT
+
+
+def invalidate_config() -> None:
+    """
+    使共享的配置快照失效，下次load_config时重新读取。
+    """
+    global _SNAPSHOT
+
+    with _SNAPSHOT_LOCK:
+        _SNAPSHOT = None
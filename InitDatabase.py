@@ -6,14 +6,15 @@ from datetime import datetime
 
 import yaml
 from langchain.retrievers import ParentDocumentRetriever
-from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
 from langchain_milvus import Milvus
 from loguru import logger
 from tqdm import tqdm
 
 from llm.EmbeddingCore import BgeM3Embeddings
+from llm.SplitterCore import get_splitters
 from utils.Decorator import timer
+from utils.entities.Ingest import IngestRecord
 from utils.entities.UserProfile import User, UserGroup
 
 logger.remove()
@@ -54,7 +55,7 @@ def init_retriever() -> ParentDocumentRetriever:
         collection_name=collection_name,
         connection_args=milvus_cfg.get_conn_args(),
         index_params=milvus_cfg.get_collection().index_param,
-        drop_old=True,
+        drop_old=args.drop_old,
         auto_id=True,
         enable_dynamic_field=True,
     )
@@ -72,30 +73,12 @@ def init_retriever() -> ParentDocumentRetriever:
     vector_db.delete(init_ids)
     logger.info('done')
 
-    parent_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=450,
-        chunk_overlap=0,
-        separators=['\n\n', '\n'],
-        keep_separator=False
+    parent_splitter, child_splitter = get_splitters(
+        milvus_cfg.get_collection().language,
+        embed_cfg.model,
+        embed_cfg.local_path if embed_cfg.save_local else ''
     )
 
-    if milvus_cfg.get_collection().language == 'en':
-        child_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=100,
-            chunk_overlap=0,
-            separators=['.', '\n\n', '\n'],
-            keep_separator=False
-        )
-    elif milvus_cfg.get_collection().language == 'zh':
-        child_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=100,
-            chunk_overlap=0,
-            separators=['。', '？', '\n\n', '\n'],
-            keep_separator=False
-        )
-    else:
-        raise Exception(f'error language {milvus_cfg.get_collection().language}')
-
     retriever = ParentDocumentRetriever(
         vectorstore=vector_db,
         docstore=doc_store,
@@ -106,10 +89,28 @@ def init_retriever() -> ParentDocumentRetriever:
     return retriever
 
 
+def delete_stale(retriever: ParentDocumentRetriever, records: list[IngestRecord], batch_size: int = 1000) -> None:
+    """
+    删除已修改、已移除或上次中断的文件在Milvus和文档库中的旧数据。
+
+    :param retriever: 检索器
+    :param records: 需要清理的清单记录
+    :param batch_size: 每次删除的父文档数量
+    :return: 无返回值
+    """
+    parent_ids = [_id for record in records for _id in record.parent_ids]
+    for i in range(0, len(parent_ids), batch_size):
+        batch = parent_ids[i:i + batch_size]
+        retriever.vectorstore.delete(expr=f'{retriever.id_key} in {json.dumps(batch)}')
+        retriever.docstore.mdelete(batch)
+
+    logger.info(f'delete {len(parent_ids)} stale chunks of {len(records)} files')
+
+
 @timer
 def load_md(base_path: str) -> None:
     """
-    加载markdown文件到检索器中。
+    增量加载markdown文件到检索器中，未修改的文件会被跳过。
 
     :param base_path: 基础路径，包含年份子目录，每个子目录下包含markdown和xml文件。
     :return: 无返回值
@@ -118,35 +119,96 @@ def load_md(base_path: str) -> None:
 
     retriever = init_retriever()
     now_collection = config.milvus_config.get_collection().collection_name
+    language = config.milvus_config.get_collection().language
     logger.info('start loading file...')
 
-    # 遍历基础路径下的所有文件和子目录
-    for root, dirs, files in os.walk(base_path):
-        # 跳过空目录
-        if len(files) == 0:
-            continue
-
-        # 提取年份信息
-        year = os.path.basename(root)
-        for _file in tqdm(files, total=len(files), desc=f'load file in ({year})'):
-            # 加载并处理markdown文件
-            file_path = os.path.join(config.get_md_path(now_collection), year, _file)
-
-            # 分割markdown文本为多个文档
-            md_docs, reference_data = load_from_md(file_path)
-
-            # 尝试将分割得到的文档添加到检索器
-            try:
-                retriever.add_documents(md_docs)
-                with ReferenceStore(config.get_reference_path()) as ref_store:
-                    ref_store.add_reference(reference_data)
-            except Exception as e:
-                logger.error(f'loading <{_file}> ({year}) fail')
-                logger.error(e)
+    # 引用信息复用同一个连接，按批次在事务中提交
+    with (
+        ReferenceStore(config.get_reference_path(), batch_size=args.ref_batch_size) as ref_store,
+        IngestManifest(config.get_manifest_path(now_collection)) as manifest
+    ):
+        if args.drop_old:
+            manifest.clear()
+
+        # 遍历基础路径下的所有文件和子目录，子目录名为年份
+        all_files = []
+        for root, dirs, _files in os.walk(base_path):
+            year = os.path.basename(root)
+            for _file in _files:
+                all_files.append((f'{now_collection}/{year}/{_file}', os.path.join(root, _file)))
+
+        # 与清单比对，只处理新增、修改和上次未完成的文件
+        files, stale = manifest.plan(all_files)
+        logger.info(f'{len(files)} of {len(all_files)} files need to be ingested')
+        if stale:
+            delete_stale(retriever, stale)
+
+        # 上次中断且内容未变化的文件，如果引用已经提交则不再重复写入；修改过的文件需要重新写入引用信息
+        loaded_sources = ref_store.loaded_sources() & manifest.resumed_sources()
+
+        bulk_writer = None
+        if args.bulk_import:
+            bulk_writer = BulkImportWriter(
+                now_collection,
+                config.get_bulk_path(now_collection),
+                config.bulk_import_config.file_type,
+                using=retriever.vectorstore.alias
+            )
+
+        pipeline = IngestPipeline(
+            retriever.vectorstore,
+            retriever.docstore,
+            language,
+            ref_store,
+            parse_workers=args.parse_workers,
+            embed_workers=args.embed_workers,
+            write_workers=args.write_workers,
+            embed_batch_size=args.embed_batch_size,
+            skip_reference=loaded_sources,
+            manifest=manifest,
+            bulk_writer=bulk_writer,
+            dedup_filter=None if args.no_dedup else NearDuplicateFilter(
+                args.dedup_threshold if args.drop_near_duplicates else None
+            ),
+        )
+        pipeline.run(files, total=len(files))
+
+        if bulk_writer is not None:
+            bulk_cfg = config.bulk_import_config
+            object_store = MinioObjectStore(
+                bulk_cfg.minio_endpoint,
+                bulk_cfg.access_key,
+                bulk_cfg.secret_key,
+                bulk_cfg.bucket,
+                bulk_cfg.secure
+            )
+            row_count = bulk_import(
+                now_collection,
+                bulk_writer.commit(),
+                object_store,
+                config.milvus_config.get_collection().index_param,
+                vector_field=retriever.vectorstore._vector_field,
+                using=retriever.vectorstore.alias
+            )
+            logger.info(f'bulk import {row_count} child chunks into {now_collection}')
 
     logger.info(f'done')
 
 
+def export_collection_segment(force: bool = False) -> None:
+    """
+    将当前知识库的document.db导出为只读的segment文件，供问答服务通过内存映射读取。
+    已经导出过segment时总是重新导出，避免问答服务读取到过期的文档。
+
+    :param force: 没有segment文件时是否导出
+    :return: 无返回值
+    """
+    collection_name = config.milvus_config.get_collection().collection_name
+    segment_path = config.get_segment_path(collection_name)
+    if force or os.path.exists(segment_path):
+        export_segment(config.get_sqlite_path(collection_name), segment_path)
+
+
 def create_userdb():
     connect_str = config.get_user_db()
     os.makedirs(os.path.dirname(connect_str), exist_ok=True)
@@ -194,7 +256,70 @@ if __name__ == '__main__':
         '--drop_old',
         '-D',
         action='store_true',
-        help='Whether to delete the original reference database'
+        help='Drop the existing vectors, documents and reference database and rebuild from scratch, '
+             'otherwise only new and modified files are ingested'
+    )
+    parser.add_argument(
+        '--parse_workers',
+        type=int,
+        default=4,
+        help='Number of processes parsing and splitting markdown files'
+    )
+    parser.add_argument(
+        '--embed_workers',
+        type=int,
+        default=1,
+        help='Number of threads computing embeddings'
+    )
+    parser.add_argument(
+        '--write_workers',
+        type=int,
+        default=1,
+        help='Number of threads writing to Milvus and the document store'
+    )
+    parser.add_argument(
+        '--embed_batch_size',
+        type=int,
+        default=256,
+        help='Number of child chunks embedded and inserted together, collected across files'
+    )
+    parser.add_argument(
+        '--ref_batch_size',
+        type=int,
+        default=200,
+        help='Maximum number of files whose references are committed in one transaction, '
+             'references are also committed with every written batch before it is marked done'
+    )
+    parser.add_argument(
+        '--dedup_threshold',
+        type=float,
+        default=0.85,
+        help='Similarity threshold of --drop_near_duplicates'
+    )
+    parser.add_argument(
+        '--drop_near_duplicates',
+        action='store_true',
+        help='Drop child chunks whose estimated Jaccard similarity to an already ingested chunk reaches '
+             '--dedup_threshold. Lossy: the parents of a dropped chunk can no longer be retrieved through it'
+    )
+    parser.add_argument(
+        '--no_dedup',
+        action='store_true',
+        help='Disable boilerplate and near-duplicate chunk elimination'
+    )
+    parser.add_argument(
+        '--bulk_import',
+        '-B',
+        action='store_true',
+        help='Offline initial build: write child vectors to local columnar files, '
+             'bulk import them into Milvus and build the index afterwards. Requires --drop_old'
+    )
+    parser.add_argument(
+        '--export_segment',
+        '-S',
+        action='store_true',
+        help='Export the document store of the initialized collections into a read-only memory-mapped segment for serving. '
+             'Collections that already have a segment are always re-exported'
     )
     parser.add_argument(
         '--user',
@@ -205,6 +330,9 @@ if __name__ == '__main__':
     )
     args = parser.parse_args()
 
+    if args.bulk_import and not args.drop_old:
+        parser.error('--bulk_import is only for initial builds, use it together with --drop_old')
+
     if args.auto_create:
         yml_path = 'config.yml'
         if not os.path.exists(yml_path):
@@ -244,8 +372,11 @@ if __name__ == '__main__':
 
     config = Config()
 
-    from storage.SqliteStore import SqliteDocStore, ReferenceStore, ProfileStore
-    from utils.MarkdownPraser import load_from_md
+    from storage.SqliteStore import SqliteDocStore, ReferenceStore, ProfileStore, IngestManifest
+    from storage.SegmentStore import export_segment
+    from storage.MilvusBulkImport import BulkImportWriter, MinioObjectStore, bulk_import
+    from llm.IngestCore import IngestPipeline
+    from utils.DedupUtil import NearDuplicateFilter
 
     if args.drop_old:
         with ReferenceStore(config.get_reference_path()) as _store:
@@ -258,6 +389,7 @@ if __name__ == '__main__':
                 logger.info(f'Start init collection {i}')
                 config.set_collection(i)
                 load_md(config.get_md_path(config.milvus_config.get_collection().collection_name))
+                export_collection_segment(args.export_segment)
         else:
             if args.collection >= len(config.milvus_config.collections) or args.collection < -1:
                 logger.error(f'collection index {args.collection} out of range')
@@ -266,6 +398,7 @@ if __name__ == '__main__':
                 config.set_collection(args.collection)
                 logger.info(f'Only init collection {args.collection}')
                 load_md(config.get_md_path(config.milvus_config.get_collection().collection_name))
+                export_collection_segment(args.export_segment)
 
     if args.user:
         logger.info('Create admin profile...')
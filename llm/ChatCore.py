@@ -1,5 +1,5 @@
 from langchain_core.chat_history import BaseChatMessageHistory
-from langchain_core.messages import HumanMessage, ToolMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage, ToolMessage, SystemMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
@@ -39,7 +39,7 @@ def chat_with_history(_chat_history: BaseChatMessageHistory, question: str):
 
 
 def write_paper(
-        _chat_history: BaseChatMessageHistory
+        _messages: list[BaseMessage]
 ):
     prompt = ChatPromptTemplate.from_messages(
         [
@@ -59,7 +59,7 @@ def write_paper(
 
     history_chain = prompt | llm_with_tools
 
-    messages = _chat_history.messages.copy()
+    messages = list(_messages)
 
     with st.spinner('正在分析您的需求...'):
         ai_msg = history_chain.invoke({'chat_history': messages})
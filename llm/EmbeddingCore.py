@@ -139,6 +139,43 @@ class BgeM3Embeddings(BaseModel, Embeddings):
 
         return all_dense_embeddings
 
+    @torch.no_grad()
+    def encode_ids(
+            self,
+            input_ids: list[list[int]],
+            normalize_embeddings: bool = True,
+            batch_size: int = 12,
+            **kwargs: Any,
+    ) -> np.ndarray:
+        """
+        使用已经分好词的token id计算向量，跳过分词步骤。
+        """
+        all_dense_embeddings = []
+        for start_index in tqdm(
+                range(0, len(input_ids), batch_size),
+                desc="Inference Embeddings",
+                disable=len(input_ids) < 256
+        ):
+            batch_data = self.tokenizer.pad(
+                {'input_ids': input_ids[start_index:start_index + batch_size]},
+                padding=True,
+                return_tensors='pt',
+            ).to(self.device)
+
+            last_hidden_state = self.model(**batch_data, return_dict=True).last_hidden_state
+            dense_vecs = self.dense_embedding(last_hidden_state, batch_data['attention_mask'])
+
+            if normalize_embeddings:
+                dense_vecs = torch.nn.functional.normalize(dense_vecs, dim=-1)
+            all_dense_embeddings.append(dense_vecs.cpu().numpy())
+
+        return np.concatenate(all_dense_embeddings, axis=0)
+
+    def embed_token_ids(self, token_ids: list[list[int]]) -> list[list[float]]:
+        embeddings = self.encode_ids(token_ids, **self.encode_kwargs)
+
+        return embeddings.tolist()
+
     def embed_query(self, text: str) -> list[float]:
         text = text.replace("\n", " ")
         embedding = self.encode(text, **self.encode_kwargs)
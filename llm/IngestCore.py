@@ -0,0 +1,331 @@
+import json
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Iterable, Optional
+
+from langchain_core.documents import Document
+from langchain_core.stores import BaseStore
+from langchain_milvus import Milvus
+import numpy as np
+from loguru import logger
+from tqdm import tqdm
+
+from llm.SplitterCore import get_splitters, get_token_ids
+from storage.MilvusBulkImport import BulkImportWriter
+from storage.SqliteStore import ReferenceStore, IngestManifest
+from utils.ChunkUtil import split_with_ids
+from utils.DedupUtil import NearDuplicateFilter, get_minhasher
+from utils.MarkdownPraser import load_from_md
+from utils.entities.Paper import Reference
+
+_SENTINEL = object()
+
+
+@dataclass
+class StageCounter:
+    """吞吐量统计"""
+    name: str
+    items: int = 0
+    docs: int = 0
+    seconds: float = 0.
+    errors: int = 0
+
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def add(self, items: int, docs: int, seconds: float) -> None:
+        with self._lock:
+            self.items += items
+            self.docs += docs
+            self.seconds += seconds
+
+    def fail(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+    def __str__(self) -> str:
+        rate = self.docs / self.seconds if self.seconds > 0 else 0.
+        return f'[{self.name}] items: {self.items}, docs: {self.docs}, errors: {self.errors}, ' \
+               f'busy: {self.seconds:.2f}s, {rate:.1f} docs/s'
+
+
+@dataclass
+class ParsedFile:
+    source: str
+    parents: list[tuple[str, Document]]
+    children: list[Document]
+    reference: Reference
+    signatures: Optional[np.ndarray] = None
+    token_ids: Optional[list[list[int]]] = None
+
+
+@dataclass
+class IngestBatch:
+    files: list[ParsedFile] = field(default_factory=list)
+    embeddings: Optional[list[list[float]]] = None
+
+    @property
+    def children(self) -> list[Document]:
+        return [child for parsed in self.files for child in parsed.children]
+
+    @property
+    def token_ids(self) -> Optional[list[list[int]]]:
+        if any(parsed.token_ids is None for parsed in self.files):
+            return None
+        return [ids for parsed in self.files for ids in parsed.token_ids]
+
+    @property
+    def size(self) -> int:
+        return sum(len(parsed.children) for parsed in self.files)
+
+
+@dataclass(frozen=True)
+class ParseOptions:
+    language: str
+    model_name: str
+    local_path: str = ''
+    id_key: str = 'doc_id'
+    num_perm: int = 0
+
+
+def parse_file(source: str, file_path: str, options: ParseOptions) -> ParsedFile:
+    """
+    读取一个markdown文件并切分为父文档和子文档，切分器与其他入库路径共用，见SplitterCore.get_splitters。
+    父文档与子文档的id由内容确定，重复入库不会产生重复数据。子文档同时完成分词，向量化时不再重复分词。
+    该函数在子进程中运行。
+
+    :param source: 文件标识
+    :param file_path: markdown文件路径
+    :param options: 切分参数，num_perm大于0时同时计算子文档的MinHash签名，用于去重
+    :return: 切分结果
+    """
+    parent_splitter, child_splitter = get_splitters(options.language, options.model_name, options.local_path)
+
+    md_docs, reference_data = load_from_md(file_path)
+    parents, children = split_with_ids(md_docs, parent_splitter, child_splitter, options.id_key)
+
+    texts = [child.page_content for child in children]
+    signatures = None
+    if options.num_perm > 0:
+        signatures = get_minhasher(options.num_perm).signatures(texts)
+    token_ids = get_token_ids(texts, options.model_name, options.local_path)
+
+    return ParsedFile(source, parents, children, reference_data, signatures, token_ids)
+
+
+def _parse_task(args: tuple[str, str, ParseOptions]) -> ParsedFile | tuple[str, str]:
+    source, file_path, options = args
+    try:
+        return parse_file(source, file_path, options)
+    except Exception as e:
+        return source, str(e)
+
+
+class IngestPipeline:
+    """
+    分阶段的并行入库流程::
+
+        解析(进程池) -> 跨文件合并批次 -> 向量化(线程) -> 写入Milvus与文档库(线程)
+
+    各阶段之间使用有界队列连接，下游处理不过来时上游会阻塞等待。
+    指定bulk_writer时向量写入本地列式文件而不是直接插入Milvus，由bulk_import统一导入。
+    """
+
+    def __init__(
+            self,
+            vector_db: Milvus,
+            doc_store: BaseStore[str, Document],
+            language: str,
+            ref_store: Optional[ReferenceStore] = None,
+            *,
+            parse_workers: int = 4,
+            embed_workers: int = 1,
+            write_workers: int = 1,
+            embed_batch_size: int = 256,
+            queue_size: int = 4,
+            skip_reference: Optional[set[str]] = None,
+            manifest: Optional[IngestManifest] = None,
+            id_key: str = 'doc_id',
+            bulk_writer: Optional[BulkImportWriter] = None,
+            dedup_filter: Optional[NearDuplicateFilter] = None,
+    ) -> None:
+        self.vector_db = vector_db
+        self.doc_store = doc_store
+        self.language = language
+        self.ref_store = ref_store
+        self.skip_reference = skip_reference or set()
+        self.manifest = manifest
+        self.id_key = id_key
+        self.bulk_writer = bulk_writer
+        self.dedup_filter = dedup_filter
+
+        self.parse_workers = parse_workers
+        self.embed_workers = embed_workers
+        self.write_workers = write_workers
+        self.embed_batch_size = embed_batch_size
+
+        self._embed_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._write_queue: queue.Queue = queue.Queue(maxsize=queue_size)
+        self._ref_lock = threading.Lock()
+
+        self.counters = {
+            'parse': StageCounter('parse'),
+            'embed': StageCounter('embed'),
+            'write': StageCounter('write'),
+        }
+        self.failed: list[tuple[str, str]] = []
+
+    def __embed_worker(self) -> None:
+        counter = self.counters['embed']
+        while (batch := self._embed_queue.get()) is not _SENTINEL:
+            start = time.perf_counter()
+            try:
+                texts = [child.page_content for child in batch.children]
+                token_ids = batch.token_ids
+                embedding_func = self.vector_db.embedding_func
+                if not texts:
+                    batch.embeddings = []
+                elif token_ids is not None and hasattr(embedding_func, 'embed_token_ids'):
+                    # 复用解析阶段得到的token id
+                    batch.embeddings = embedding_func.embed_token_ids(token_ids)
+                else:
+                    batch.embeddings = embedding_func.embed_documents(texts)
+                counter.add(len(batch.files), len(texts), time.perf_counter() - start)
+                self._write_queue.put(batch)
+            except Exception as e:
+                counter.fail()
+                logger.error(f'embedding batch fail: {e}')
+                self.__record_failure(batch.files, str(e))
+
+    def __record_failure(self, files: list[ParsedFile], error: str) -> None:
+        self.failed.extend((parsed.source, error) for parsed in files)
+        if self.manifest is not None:
+            self.manifest.fail({parsed.source: [_id for _id, _ in parsed.parents] for parsed in files})
+
+    def __write_worker(self) -> None:
+        counter = self.counters['write']
+        text_field = self.vector_db._text_field
+        vector_field = self.vector_db._vector_field
+        while (batch := self._write_queue.get()) is not _SENTINEL:
+            start = time.perf_counter()
+            parent_ids = {parsed.source: [_id for _id, _ in parsed.parents] for parsed in batch.files}
+            try:
+                # 先记录将要写入的父文档id，中断后可据此清理写了一半的文件
+                if self.manifest is not None:
+                    self.manifest.begin(parent_ids)
+
+                rows = [
+                    {text_field: child.page_content, vector_field: vector, **child.metadata}
+                    for child, vector in zip(batch.children, batch.embeddings)
+                ]
+                if self.bulk_writer is not None:
+                    # 离线构建时先写入本地列式文件，全部完成后统一导入
+                    self.bulk_writer.append(rows)
+                else:
+                    # 父文档id由内容确定，先删除这些父文档已有的子文档，使重复写入等价于覆盖
+                    self.vector_db.delete(expr=f'{self.id_key} in {json.dumps(sum(parent_ids.values(), []))}')
+                    # 子文档可能全部被去重
+                    if len(rows) > 0:
+                        self.vector_db.col.insert(rows)
+                self.doc_store.mset([pair for parsed in batch.files for pair in parsed.parents])
+
+                if self.ref_store is not None:
+                    with self._ref_lock:
+                        for parsed in batch.files:
+                            if parsed.source not in self.skip_reference:
+                                self.ref_store.buffer_reference(parsed.reference, parsed.source)
+                        # 清单标记完成前先提交引用，否则中断后这些文件会被跳过而引用丢失
+                        if self.manifest is not None:
+                            self.ref_store.flush()
+
+                if self.manifest is not None:
+                    self.manifest.commit(parent_ids)
+
+                counter.add(len(batch.files), len(rows), time.perf_counter() - start)
+            except Exception as e:
+                counter.fail()
+                logger.error(f'writing batch fail: {e}')
+                self.__record_failure(batch.files, str(e))
+
+    def run(self, files: Iterable[tuple[str, str]], total: int = None) -> dict[str, StageCounter]:
+        """
+        执行入库流程。
+
+        :param files: (文件标识, markdown路径) 列表
+        :param total: 文件总数，用于显示进度条
+        :return: 各阶段的吞吐量统计
+        """
+        embed_threads = [
+            threading.Thread(target=self.__embed_worker, name=f'ingest-embed-{i}', daemon=True)
+            for i in range(self.embed_workers)
+        ]
+        write_threads = [
+            threading.Thread(target=self.__write_worker, name=f'ingest-write-{i}', daemon=True)
+            for i in range(self.write_workers)
+        ]
+        for thread in embed_threads + write_threads:
+            thread.start()
+
+        counter = self.counters['parse']
+        batch = IngestBatch()
+        embedding_func = self.vector_db.embedding_func
+        options = ParseOptions(
+            language=self.language,
+            model_name=embedding_func.model_name,
+            local_path=embedding_func.local_path if embedding_func.local_load else '',
+            id_key=self.id_key,
+            num_perm=self.dedup_filter.num_perm if self.dedup_filter is not None else 0,
+        )
+        tasks = ((source, file_path, options) for source, file_path in files)
+        try:
+            with ProcessPoolExecutor(max_workers=self.parse_workers) as executor:
+                start = time.perf_counter()
+                for result in tqdm(executor.map(_parse_task, tasks, chunksize=8), total=total, desc='ingest'):
+                    if isinstance(result, tuple):
+                        counter.fail()
+                        logger.error(f'loading <{result[0]}> fail')
+                        logger.error(result[1])
+                        self.failed.append(result)
+                        if self.manifest is not None:
+                            self.manifest.fail({result[0]: []})
+                        continue
+
+                    # 去重在主进程中进行，保证跨文件只保留第一次出现的文本
+                    if self.dedup_filter is not None:
+                        kept = self.dedup_filter.filter(result.children, result.signatures)
+                        kept_ids = {id(child) for child in kept}
+                        if result.token_ids is not None:
+                            result.token_ids = [
+                                ids for child, ids in zip(result.children, result.token_ids) if id(child) in kept_ids
+                            ]
+                        result.children = kept
+                        result.signatures = None
+
+                    counter.add(1, len(result.parents), time.perf_counter() - start)
+                    batch.files.append(result)
+                    if batch.size >= self.embed_batch_size:
+                        self._embed_queue.put(batch)
+                        batch = IngestBatch()
+                    start = time.perf_counter()
+
+            if batch.files:
+                self._embed_queue.put(batch)
+        finally:
+            for _ in embed_threads:
+                self._embed_queue.put(_SENTINEL)
+            for thread in embed_threads:
+                thread.join()
+
+            for _ in write_threads:
+                self._write_queue.put(_SENTINEL)
+            for thread in write_threads:
+                thread.join()
+
+        for stage_counter in self.counters.values():
+            logger.info(stage_counter)
+        if self.dedup_filter is not None:
+            logger.info(self.dedup_filter)
+
+        return self.counters
@@ -1,14 +1,11 @@
-import httpx
 import streamlit as st
 from langchain_openai import ChatOpenAI
 
-from Config import Config
+from Config import load_config
 from llm.EmbeddingCore import BgeM3Embeddings, BgeReranker
-from uicomponent.StatusBus import get_config
+from utils.HttpUtil import HostClass, get_client
 
-config = get_config()
-if config is None:
-    config = Config()
+config = load_config()
 
 milvus_cfg = config.milvus_config
 embd_cfg = config.embedding_config
@@ -50,7 +47,7 @@ def load_reranker() -> BgeReranker:
 @st.cache_resource(show_spinner='Loading GPT4o...')
 def load_gpt4o() -> ChatOpenAI:
     if config.openai_config.use_proxy:
-        http_client = httpx.Client(proxies=config.get_proxy())
+        http_client = get_client(HostClass.MODEL, config.get_proxy(), http_config=config.http_config)
         llm = ChatOpenAI(model_name="gpt-4o",
                          http_client=http_client,
                          temperature=0.4,
@@ -65,7 +62,7 @@ def load_gpt4o() -> ChatOpenAI:
 @st.cache_resource(show_spinner='Loading GPT4o mini...')
 def load_gpt4o_mini() -> ChatOpenAI:
     if config.openai_config.use_proxy:
-        http_client = httpx.Client(proxies=config.get_proxy())
+        http_client = get_client(HostClass.MODEL, config.get_proxy(), http_config=config.http_config)
         llm = ChatOpenAI(model_name="gpt-4o-mini",
                          http_client=http_client,
                          temperature=0.4,
@@ -80,7 +77,7 @@ def load_gpt4o_mini() -> ChatOpenAI:
 @st.cache_resource(show_spinner='Loading GPT4...')
 def load_gpt4() -> ChatOpenAI:
     if config.openai_config.use_proxy:
-        http_client = httpx.Client(proxies=config.get_proxy())
+        http_client = get_client(HostClass.MODEL, config.get_proxy(), http_config=config.http_config)
         llm = ChatOpenAI(model_name="gpt-4-turbo-2024-04-09",
                          http_client=http_client,
                          # openai_proxy=config.get_proxy(),
@@ -1,3 +1,4 @@
+import os
 from operator import itemgetter
 
 from langchain_milvus.vectorstores import milvus
@@ -7,15 +8,17 @@ from langchain_core.prompts import ChatPromptTemplate
 from pydantic import BaseModel, Field
 
 from langchain_core.runnables import RunnableLambda, RunnableParallel, RunnablePassthrough
+
+from Config import load_config
 from llm.AgentCore import translate_sentence
 from llm.EmbeddingCore import BgeM3Embeddings
 from llm.ModelCore import load_gpt4o, load_embedding, load_gpt4, load_reranker
 from llm.RetrieverCore import *
 from llm.Template import *
+from storage.SegmentStore import SegmentDocStore
 from storage.SqliteStore import SqliteDocStore
-from uicomponent.StatusBus import get_config
 
-config = get_config()
+config = load_config()
 
 
 class CitedAnswerEN(BaseModel):
@@ -97,6 +100,21 @@ def load_doc_store(db_path: str | bytes) -> SqliteDocStore:
     return doc_store
 
 
+@st.cache_resource(show_spinner='Loading Document Store...')
+def load_serving_doc_store(collection_name: str) -> SegmentDocStore | SqliteDocStore:
+    """
+    加载用于问答的只读文档库，如果存在导出的segment文件则使用内存映射读取，否则回退到sqlite。
+
+    :param collection_name: 知识库名称
+    :return: 文档库
+    """
+    segment_path = config.get_segment_path(collection_name)
+    if os.path.exists(segment_path):
+        return SegmentDocStore(segment_path)
+
+    return load_doc_store(config.get_sqlite_path(collection_name))
+
+
 @st.cache_data(show_spinner='Asking from LLM chain...')
 def get_answer(
         collection_name: str,
@@ -110,7 +128,7 @@ def get_answer(
     reranker = load_reranker()
 
     vec_store = load_vectorstore(collection_name, embedding)
-    doc_store = load_doc_store(config.get_sqlite_path(collection_name))
+    doc_store = load_serving_doc_store(collection_name)
 
     if llm_name == 'gpt4o':
         llm = load_gpt4o()
@@ -1,3 +1,5 @@
+import asyncio
+import json
 from typing import List, Dict, Any, Tuple, Optional
 
 from langchain.chains.query_constructor.schema import AttributeInfo
@@ -12,13 +14,14 @@ from langchain_core.runnables import Runnable
 from langchain_core.stores import BaseStore
 from langchain_core.vectorstores import VectorStore
 from langchain_milvus import Milvus
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from loguru import logger
 
 from llm.EmbeddingCore import BgeReranker
 from llm.ModelCore import load_gpt4o_mini, load_glm4_flash
+from llm.SplitterCore import get_splitters
 from llm.Template import GENERATE_QUESTION_EN, GENERATE_QUESTION_ZH
 from storage.SqliteStore import SqliteBaseStore
+from utils.ChunkUtil import split_with_ids
 
 import streamlit as st
 
@@ -49,6 +52,63 @@ def get_parent_id(docs: List[Document], id_key: str) -> Tuple[List, Dict]:
     return ids, id_map
 
 
+def group_by_parent(docs: List[Document], id_key: str) -> Dict[str, List[Document]]:
+    groups = {}
+    for sentence in docs:
+        if id_key in sentence.metadata:
+            groups.setdefault(sentence.metadata[id_key], []).append(sentence)
+
+    return groups
+
+
+def get_refer_span(content: str, children: List[Document]) -> List[Tuple[int, int]]:
+    """
+    获取子文档在父文档中的字符区间，按起始位置排序并合并重叠部分。
+    优先使用入库时记录的start_index/end_index，没有记录或与原文不符时在父文档中查找。
+
+    :param content: 父文档内容
+    :param children: 命中的子文档
+    :return: (start, end) 列表
+    """
+    spans = []
+    for child in children:
+        start = child.metadata.get('start_index', -1)
+        end = child.metadata.get('end_index', -1)
+        if not (0 <= start < end <= len(content)) or content[start:end] != child.page_content:
+            start = content.find(child.page_content)
+            if start < 0:
+                continue
+            end = start + len(child.page_content)
+        spans.append((start, end))
+
+    merged = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+
+    return merged
+
+
+def set_refer(docs: List[Document], children: List[Document], id_key: str) -> List[Document]:
+    """
+    在父文档的metadata中记录命中的子文档内容(refer_sentence)及其在父文档中的字符区间(refer_span)。
+
+    :param docs: 父文档
+    :param children: 检索到的子文档
+    :param id_key: 子文档中记录父文档id的字段
+    :return: 父文档
+    """
+    child_map = group_by_parent(children, id_key)
+    for doc in docs:
+        hit = child_map.get(doc.metadata[id_key], [])
+        doc.metadata['refer_sentence'] = [child.page_content for child in hit]
+        doc.metadata['refer_span'] = get_refer_span(doc.page_content, hit)
+
+    return docs
+
+
 class ScoreRetriever(MultiVectorRetriever):
     reranker: BgeReranker
 
@@ -93,7 +153,7 @@ class ScoreRetriever(MultiVectorRetriever):
             else:
                 short_doc: List[Document] = self.vectorstore.max_marginal_relevance_search(query, **self.search_kwargs)
 
-        ids, id_map = get_parent_id(short_doc, self.id_key)
+        ids, _ = get_parent_id(short_doc, self.id_key)
 
         docs = self.docstore.mget(ids)
         logger.info(f'retrieve {len(docs)} documents, reranking...')
@@ -101,11 +161,7 @@ class ScoreRetriever(MultiVectorRetriever):
         try:
             rerank_docs = self.reranker.compress_documents(docs, query)[:self.top_k]
 
-            for i in range(len(rerank_docs)):
-                context_id = rerank_docs[i].metadata[self.id_key]
-                rerank_docs[i].metadata['refer_sentence'] = id_map.get(context_id) if context_id in id_map else []
-
-            return rerank_docs
+            return set_refer(rerank_docs, short_doc, self.id_key)
         except Exception as e:
             logger.error(f'catch exception {e} while check {ids}')
 
@@ -118,6 +174,45 @@ class ScoreRetriever(MultiVectorRetriever):
 
         return response
 
+    async def aretrieve_documents(
+            self, queries: List[str], run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.search_type == SearchType.similarity:
+            results = await asyncio.gather(*[
+                self.vectorstore.asimilarity_search(query, **self.search_kwargs)
+                for query in queries
+            ])
+        else:
+            results = await asyncio.gather(*[
+                self.vectorstore.amax_marginal_relevance_search(query, **self.search_kwargs)
+                for query in queries
+            ])
+
+        return [doc for short_doc in results for doc in short_doc]
+
+    async def _aget_relevant_documents(
+            self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        if self.multi_query:
+            queries = await self.agenerate_queries(query, run_manager)
+            queries.append(query)
+            short_doc = await self.aretrieve_documents(queries, run_manager)
+            short_doc = unique_doc(short_doc)
+        else:
+            short_doc = await self.aretrieve_documents([query], run_manager)
+
+        ids, _ = get_parent_id(short_doc, self.id_key)
+
+        docs = await self.docstore.amget(ids)
+        logger.info(f'retrieve {len(docs)} documents, reranking...')
+
+        try:
+            rerank_docs = list(await self.reranker.acompress_documents(docs, query))[:self.top_k]
+
+            return set_refer(rerank_docs, short_doc, self.id_key)
+        except Exception as e:
+            logger.error(f'catch exception {e} while check {ids}')
+
 
 class ReferenceRetriever(MultiVectorRetriever):
 
@@ -164,7 +259,7 @@ class ExprRetriever(MultiVectorRetriever):
                 **self.search_kwargs
             )
 
-        ids, id_map = get_parent_id(short_doc, self.id_key)
+        ids, _ = get_parent_id(short_doc, self.id_key)
 
         docs = self.docstore.mget(ids)
         logger.info(f'retrieve {len(docs)} documents, reranking...')
@@ -172,11 +267,7 @@ class ExprRetriever(MultiVectorRetriever):
         try:
             rerank_docs = self.reranker.compress_documents(docs, query)[:self.top_k]
 
-            for i in range(len(rerank_docs)):
-                context_id = rerank_docs[i].metadata[self.id_key]
-                rerank_docs[i].metadata['refer_sentence'] = id_map.get(context_id)
-
-            return rerank_docs
+            return set_refer(rerank_docs, short_doc, self.id_key)
         except Exception as e:
             logger.error(f'catch exception {e} while check {ids}')
 
@@ -199,7 +290,7 @@ class MultiVectorSelfQueryRetriever(SelfQueryRetriever):
         search_kwargs['fetch_k'] = 10
         short_doc = self._get_docs_with_query(new_query, search_kwargs)
 
-        ids, id_map = get_parent_id(short_doc, self.id_key)
+        ids, _ = get_parent_id(short_doc, self.id_key)
 
         docs = self.docstore.mget(ids)
         logger.info(f'retrieve {len(docs)} documents, reranking...')
@@ -207,11 +298,7 @@ class MultiVectorSelfQueryRetriever(SelfQueryRetriever):
         try:
             rerank_docs = self.reranker.compress_documents(docs, query)[:self.top_k]
 
-            for i in range(len(rerank_docs)):
-                context_id = rerank_docs[i].metadata[self.id_key]
-                rerank_docs[i].metadata['refer_sentence'] = id_map.get(context_id)
-
-            return rerank_docs
+            return set_refer(rerank_docs, short_doc, self.id_key)
         except Exception as e:
             logger.error(f'catch exception {e} while check {ids}')
 
@@ -222,32 +309,42 @@ class MultiVectorSelfQueryRetriever(SelfQueryRetriever):
         return docs
 
 
+class UpsertParentRetriever(ParentDocumentRetriever):
+    """
+    使用由内容确定的父文档和子文档id，重复添加同一篇文献时覆盖已有的数据而不是追加。
+    """
+
+    def add_documents(
+            self,
+            documents: List[Document],
+            ids: Optional[List[str]] = None,
+            add_to_docstore: bool = True,
+            **kwargs: Any,
+    ) -> None:
+        if ids is not None:
+            logger.warning('UpsertParentRetriever generates ids from content, given ids are ignored')
+
+        parents, children = split_with_ids(documents, self.parent_splitter, self.child_splitter, self.id_key)
+        if len(parents) == 0:
+            return
+
+        # 先删除这些父文档已有的子文档，再写入新的子文档
+        parent_ids = [_id for _id, _ in parents]
+        self.vectorstore.delete(expr=f'{self.id_key} in {json.dumps(parent_ids)}')
+        self.vectorstore.add_documents(children, **kwargs)
+        if add_to_docstore:
+            self.docstore.mset(parents)
+
+
 def insert_retriever(_vector_store: VectorStore, _doc_store: SqliteBaseStore, language: str = 'en') -> ParentDocumentRetriever:
-    parent_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=450,
-        chunk_overlap=0,
-        separators=['\n\n', '\n'],
-        keep_separator=False
+    embedding = _vector_store.embeddings
+    parent_splitter, child_splitter = get_splitters(
+        language,
+        embedding.model_name,
+        embedding.local_path if embedding.local_load else ''
     )
 
-    if language == 'en':
-        child_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=100,
-            chunk_overlap=0,
-            separators=['.', '\n\n', '\n'],
-            keep_separator=False
-        )
-    elif language == 'zh':
-        child_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=100,
-            chunk_overlap=0,
-            separators=['.', '。', '？', '\n\n', '\n'],
-            keep_separator=False
-        )
-    else:
-        raise Exception(f'wrong language type "{language}"')
-
-    retriever = ParentDocumentRetriever(
+    retriever = UpsertParentRetriever(
         vectorstore=_vector_store,
         docstore=_doc_store,
         child_splitter=child_splitter,
@@ -0,0 +1,95 @@
+import os
+from functools import lru_cache
+from typing import Any
+
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from loguru import logger
+
+# 以BGE-M3的token数衡量分块大小
+PARENT_CHUNK_TOKENS = 256
+CHILD_CHUNK_TOKENS = 48
+
+# (父文档分隔符, 子文档分隔符)
+SEPARATORS = {
+    'en': (['\n\n', '\n'], ['.', '\n\n', '\n']),
+    'zh': (['\n\n', '\n'], ['。', '？', '\n\n', '\n']),
+}
+
+
+@lru_cache(maxsize=4)
+def load_tokenizer(model_name: str, local_path: str = '') -> Any:
+    """
+    加载嵌入模型的分词器，每个进程只加载一次。
+
+    :param model_name: huggingface模型名
+    :param local_path: 本地模型目录，为空或不存在时从huggingface加载
+    :return: 分词器
+    """
+    from transformers import AutoTokenizer
+
+    if local_path and os.path.exists(os.path.join(local_path, 'tokenizer_config.json')):
+        return AutoTokenizer.from_pretrained(local_path)
+
+    logger.info(f'load tokenizer of {model_name} from huggingface')
+    return AutoTokenizer.from_pretrained(model_name)
+
+
+@lru_cache(maxsize=8)
+def get_splitters(
+        language: str,
+        model_name: str,
+        local_path: str = ''
+) -> tuple[RecursiveCharacterTextSplitter, RecursiveCharacterTextSplitter]:
+    """
+    获取父文档和子文档切分器。所有入库路径共用同一份配置，切分长度按嵌入模型的token数计算。
+
+    :param language: 知识库语言，en 或 zh
+    :param model_name: 嵌入模型名
+    :param local_path: 本地模型目录
+    :return: (父文档切分器, 子文档切分器)
+    """
+    if language not in SEPARATORS:
+        raise Exception(f'error language {language}')
+
+    parent_separators, child_separators = SEPARATORS[language]
+    tokenizer = load_tokenizer(model_name, local_path)
+
+    parent_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        chunk_size=PARENT_CHUNK_TOKENS,
+        chunk_overlap=0,
+        separators=parent_separators,
+        keep_separator=False
+    )
+    child_splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        chunk_size=CHILD_CHUNK_TOKENS,
+        chunk_overlap=0,
+        separators=child_separators,
+        keep_separator=False
+    )
+
+    return parent_splitter, child_splitter
+
+
+def get_token_ids(texts: list[str], model_name: str, local_path: str = '', max_length: int = 8192) -> list[list[int]]:
+    """
+    按照BgeM3Embeddings.embed_documents的预处理方式对文本分词，结果可以直接交给embed_token_ids。
+
+    :param texts: 文本列表
+    :param model_name: 嵌入模型名
+    :param local_path: 本地模型目录
+    :param max_length: 最大token数
+    :return: 每个文本的token id
+    """
+    if len(texts) == 0:
+        return []
+
+    tokenizer = load_tokenizer(model_name, local_path)
+    encoded = tokenizer(
+        [text.replace('\n', ' ') for text in texts],
+        truncation=True,
+        max_length=max_length,
+    )
+
+    return encoded['input_ids']
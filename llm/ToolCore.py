@@ -2,7 +2,6 @@ import json
 import re
 from typing import Type, Optional, Any
 
-import requests
 from duckduckgo_search import DDGS
 from langchain_community.document_loaders import WebBaseLoader, AsyncHtmlLoader
 from langchain_community.document_transformers import MarkdownifyTransformer
@@ -17,13 +16,13 @@ from langchain_text_splitters import RecursiveCharacterTextSplitter
 from loguru import logger
 from pydantic import BaseModel, Field
 
-from Config import Config
+from Config import Config, load_config
 from llm.ModelCore import load_reranker, load_embedding
-from llm.RagCore import load_vectorstore, load_doc_store
+from llm.RagCore import load_vectorstore, load_serving_doc_store
 from llm.RetrieverCore import base_retriever
-from uicomponent.StatusBus import get_config
+from utils.HttpUtil import HostClass, get_http_cache, get_session
 
-config: Config = get_config()
+config: Config = load_config()
 
 
 class VecstoreSearchInput(BaseModel):
@@ -50,7 +49,7 @@ class VecstoreSearchTool(BaseTool):
             return "\n\n-------------------------\n\n".join([doc.page_content for doc in docs])
 
         vec_store = load_vectorstore(self.target_collection, embedding)
-        doc_store = load_doc_store(config.get_sqlite_path(self.target_collection))
+        doc_store = load_serving_doc_store(self.target_collection)
 
         retriever = base_retriever(vec_store, doc_store, reranker)
 
@@ -93,22 +92,13 @@ class WebSearchTool(BaseTool):
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
                 }
 
-                if config.serper_config.use_proxy:
-                    response = requests.request(
-                        "POST", url,
-                        headers=headers,
-                        data=payload,
-                        proxies={
-                            'http': config.get_proxy(),
-                            'https': config.get_proxy(),
-                        }
-                    )
-                else:
-                    response = requests.request(
-                        "POST", url,
-                        headers=headers,
-                        data=payload
-                    )
+                session = get_session(
+                    HostClass.SEARCH,
+                    config.get_proxy() if config.serper_config.use_proxy else None,
+                    http_config=config.http_config,
+                    cache=get_http_cache(config)
+                )
+                response = session.post(url, headers=headers, data=payload)
 
                 if response.status_code == 200:
                     search_data = json.loads(response.text)
@@ -135,16 +125,19 @@ class WebSearchTool(BaseTool):
             raise ToolException("所给出的问题没有在互联网上找到相关信息。")
 
         def load_webpage(_urls: list[str]) -> list[Document]:
+            # 共享连接池的会话，同一页面在缓存有效期内不会重复下载
             loader = WebBaseLoader(
                 _urls,
                 header_template={
                     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
                 },
                 encoding='utf-8',
-                proxies={
-                    'http': config.get_proxy(),
-                    'https': config.get_proxy()
-                }
+                session=get_session(
+                    HostClass.WEB,
+                    config.get_proxy(),
+                    http_config=config.http_config,
+                    cache=get_http_cache(config)
+                )
             )
             docs = loader.load()
             logger.info(f'Get {len(_urls)} pages, converting to text...')
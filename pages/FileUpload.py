@@ -1,5 +1,7 @@
 import os
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import Tuple
 
 import pandas as pd
@@ -13,8 +15,8 @@ from Config import Config, MilvusConfig, Collection
 from llm.ModelCore import load_embedding
 from llm.RagCore import load_vectorstore, load_doc_store
 from llm.RetrieverCore import insert_retriever
-from storage.MilvusConnection import MilvusConnection
-from storage.SqliteStore import ReferenceStore
+from storage.SegmentStore import export_segment
+from storage.SqliteStore import ReferenceStore, TeiCache
 from uicomponent.StComponent import side_bar_links, login_message
 from uicomponent.StatusBus import get_config, get_user
 from utils.entities.Paper import *
@@ -93,6 +95,33 @@ def __download_reference(target_collection: Collection, ref_list: DataFrame):
     ref_bar.empty()
 
 
+def __enrich_references(ref_list: list[dict]) -> list[dict]:
+    """
+    在后台线程中分组批量补全参考文献信息，页面线程只负责刷新进度条。
+
+    :param ref_list: 参考文献列表
+    :return: 补全后的参考文献列表
+    """
+    state = {'done': 0, 'total': 0}
+
+    def on_progress(done: int, total: int) -> None:
+        state['done'], state['total'] = done, total
+
+    ref_bar = st.progress(0, text='Analysing reference...')
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        future = executor.submit(pm.enrich_references, ref_list, config, progress=on_progress)
+        while not future.done():
+            if state['total'] > 0:
+                ref_bar.progress(
+                    min(state['done'] / state['total'], 1.),
+                    text=f"Analysing reference ({state['done']}/{state['total']} requests)..."
+                )
+            time.sleep(0.2)
+
+    ref_bar.empty()
+    return future.result()
+
+
 def __download_from_pmc(target_collection: Collection, pmc_id: str, is_reference: bool = True) -> Tuple[int, Reference]:
     with st.spinner('Downloading paper...'):
         _, dl = pmc.download_paper_data(pmc_id, config)
@@ -119,22 +148,7 @@ def __download_from_pmc(target_collection: Collection, pmc_id: str, is_reference
     if not is_reference:
         data.info.ref = True
 
-        with st.spinner('Analysing reference...'):
-            ref_list = data.reference.ref_list
-            for index, ref_dict in enumerate(ref_list):
-                ref_dict: dict
-                if term := ref_dict.get('pmid') != '':
-                    ref_dict = pm.get_info_by_term(term, pm.SearchType.PM)
-                elif term := ref_dict.get('doi') != '':
-                    ref_dict = pm.get_info_by_term(term, pm.SearchType.DOI)
-                elif term := ref_dict.get('title') != '':
-                    ref_dict = pm.get_info_by_term(term, pm.SearchType.TITLE)
-                else:
-                    continue
-
-                ref_list[index] = ref_dict
-
-            data.reference.ref_list = ref_list
+        data.reference.ref_list = __enrich_references(data.reference.ref_list)
     else:
         data.info.ref = False
 
@@ -143,20 +157,30 @@ def __download_from_pmc(target_collection: Collection, pmc_id: str, is_reference
     with st.spinner('Adding paper to vector db...'):
         docs, ref_data = md.split_paper(data)
         if not is_reference:
-            __add_documents(target_collection, docs, ref_data)
+            __add_documents(target_collection, docs, ref_data, output_path)
         else:
             __add_documents(target_collection, docs)
 
     return 0, ref_data
 
 
-def __add_documents(target_collection: Collection, docs: list[Document], ref_data: Reference = None) -> None:
+def __add_documents(
+        target_collection: Collection,
+        docs: list[Document],
+        ref_data: Reference = None,
+        md_path: str = ''
+) -> None:
     embedding = load_embedding()
     vector_db = load_vectorstore(target_collection.collection_name, embedding)
     doc_db = load_doc_store(config.get_sqlite_path(target_collection.collection_name))
     retriever = insert_retriever(vector_db, doc_db, target_collection.language)
     retriever.add_documents(docs)
 
+    # 如果该知识库已导出只读segment，重新导出并原子替换，问答端下次读取时自动加载
+    segment_path = config.get_segment_path(target_collection.collection_name)
+    if os.path.exists(segment_path):
+        export_segment(config.get_sqlite_path(target_collection.collection_name), segment_path)
+
     if (
             st.session_state.get('build_ref_tree')
             and
@@ -164,8 +188,11 @@ def __add_documents(target_collection: Collection, docs: list[Document], ref_dat
             and
             len(ref_data.ref_list) > 0
     ):
+        # 与InitDatabase相同的文件标识，没有DOI的文献按照文件区分，重复导入时覆盖
+        source = f'{target_collection.collection_name}/{os.path.basename(os.path.dirname(md_path))}/' \
+                 f'{os.path.basename(md_path)}' if md_path else ''
         with ReferenceStore(config.get_reference_path()) as ref_store:
-            ref_store.add_reference(ref_data)
+            ref_store.add_reference(ref_data, source)
 
 
 def set_ref_build(key_word: str):
@@ -240,23 +267,14 @@ def markdown_tab():
             for index, uploaded_file in tqdm(enumerate(uploaded_files), total=file_count):
                 doc, ref_data = md.split_markdown(uploaded_file)
 
-                doi = doc[0].metadata.get('doi')
                 year = doc[0].metadata.get('year')
-                if not doi == '':
-                    with MilvusConnection(**milvus_cfg.get_conn_args()) as conn:
-                        _num = len(conn.client.query(
-                            target_collection.collection_name,
-                            filter=f'doi == "{doi}"'
-                        ))
-                    if _num > 0:
-                        st.error(f'文章 {doi} 已存在，跳过')
-                        continue
-
-                __add_documents(target_collection, doc, ref_data)
 
                 file_path = os.path.join(config.get_md_path(target_collection.collection_name), str(year), uploaded_file.name)
                 os.makedirs(os.path.dirname(file_path), exist_ok=True)
 
+                # 文档id由内容确定，已存在的文献会被覆盖而不会重复添加
+                __add_documents(target_collection, doc, ref_data, file_path)
+
                 with open(file_path, 'wb') as f:
                     f.write(uploaded_file.getbuffer())
 
@@ -327,6 +345,7 @@ def pdf_tab():
 
             progress_text = f'正在处理文献(0/{file_count})，请勿关闭或刷新此页面'
             pdf_bar = st.progress(0, text=progress_text)
+            tei_cache = TeiCache(config.get_tei_cache_path())
             for index, uploaded_file in tqdm(enumerate(uploaded_files), total=file_count):
                 pdf_path = os.path.join(
                     config.get_pdf_path(target_name),
@@ -336,7 +355,7 @@ def pdf_tab():
                 with open(pdf_path, 'wb') as f:
                     f.write(uploaded_file.getbuffer())
 
-                with gb.GrobidConnector(config.grobid_config) as connector:
+                with gb.GrobidConnector(config.grobid_config, tei_cache) as connector:
                     _, _, xml_text = connector.parse_file(pdf_path)
 
                 xml_path = os.path.join(
@@ -352,16 +371,6 @@ def pdf_tab():
                 year = result.info.year
                 doi = result.info.doi
 
-                if not doi == '':
-                    with MilvusConnection(**milvus_cfg.get_conn_args()) as conn:
-                        _num = len(conn.client.query(
-                            target_collection.collection_name,
-                            filter=f'doi == "{doi}"'
-                        ))
-                    if _num > 0:
-                        st.error(f'文章 {doi} 已存在，跳过')
-                        continue
-
                 if year != -1:
                     md_path = os.path.join(
                         config.get_md_path(target_name),
@@ -398,25 +407,10 @@ def pdf_tab():
                 docs, ref_data = md.split_paper(result)
 
                 if st.session_state.get('pdf_build_ref_tree'):
-                    with st.spinner('Analysing reference...'):
-                        ref_list = ref_data.ref_list
-                        for ref_idx, ref_dict in enumerate(ref_list):
-                            ref_dict: dict
-                            if term := ref_dict.get('pmid') != '':
-                                ref_dict = pm.get_info_by_term(term, pm.SearchType.PM)
-                            elif term := ref_dict.get('doi') != '':
-                                ref_dict = pm.get_info_by_term(term, pm.SearchType.DOI)
-                            elif term := ref_dict.get('title') != '':
-                                ref_dict = pm.get_info_by_term(term, pm.SearchType.TITLE)
-                            else:
-                                continue
-
-                            ref_list[ref_idx] = ref_dict
-
-                        ref_data.ref_list = ref_list
+                    ref_data.ref_list = __enrich_references(ref_data.ref_list)
 
                     with st.spinner('Adding document to database...'):
-                        __add_documents(target_collection, docs, ref_data)
+                        __add_documents(target_collection, docs, ref_data, md_path)
 
                     # TODO 引用文献下载
                     # ref_list = __check_exist(pd.DataFrame(ref_list))
@@ -438,6 +432,8 @@ def pdf_tab():
                 pdf_bar.progress(progress_num, text=f'正在处理文本({index + 1}/{file_count})，请勿关闭或刷新此页面')
 
             pdf_bar.empty()
+            if tei_cache.hits > 0:
+                st.caption(f'{tei_cache.hits} 篇文献已解析过，直接使用缓存结果')
             st.success('文献添加完毕')
             st.snow()
 
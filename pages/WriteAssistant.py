@@ -8,7 +8,6 @@ from loguru import logger
 from langchain_core.documents import Document
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_milvus import Milvus
-from langchain_community.chat_message_histories import SQLChatMessageHistory
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 import streamlit as st
 
@@ -17,7 +16,7 @@ from llm.ChatCore import write_paper, conclude_chat
 from llm.ModelCore import load_embedding
 from llm.RagCore import load_vectorstore, load_doc_store
 from llm.RetrieverCore import insert_retriever
-from storage.SqliteStore import ProfileStore
+from storage.SqliteStore import ProfileStore, ChatMessageStore
 from uicomponent.StComponent import side_bar_links, login_message
 from uicomponent.StatusBus import get_config, get_user, update_user
 from utils.entities.TimeZones import time_zone_list
@@ -194,11 +193,19 @@ def __on_create_chat_click():
     st.session_state['now_chat'] = chat.session_id
 
 
-def __on_summary_click():
-    chat_message_history = SQLChatMessageHistory(
+def __get_chat_store() -> ChatMessageStore:
+    return ChatMessageStore(
         session_id=st.session_state.get('now_chat'),
-        connection=f"sqlite:///{config.get_user_path()}/{user.name}/chat_history.db"
+        connection_string=os.path.join(config.get_user_path(), user.name, 'chat_history.db')
     )
+
+
+def __on_load_older_click():
+    st.session_state['chat_page_num'] = st.session_state.get('chat_page_num', 1) + 1
+
+
+def __on_summary_click():
+    chat_message_history = __get_chat_store()
     chat_description = conclude_chat(chat_message_history)
 
     now_time = datetime.now().timestamp()
@@ -247,10 +254,13 @@ def __on_file_upload(
 
 
 def __main_page():
-    chat_message_history = SQLChatMessageHistory(
-        session_id=st.session_state.get('now_chat'),
-        connection=f"sqlite:///{config.get_user_path()}/{user.name}/chat_history.db"
-    )
+    chat_message_history = __get_chat_store()
+    history_cfg = config.chat_history_config
+
+    # 切换对话后重新从最新一页开始显示
+    if st.session_state.get('chat_page_session') != chat_message_history.session_id:
+        st.session_state['chat_page_session'] = chat_message_history.session_id
+        st.session_state['chat_page_num'] = 1
 
     prompt = st.chat_input('请输入问题')
 
@@ -259,7 +269,11 @@ def __main_page():
     col_chat.caption(f'{user.name}/{user.last_project}')
     chat_container = col_chat.container(height=690, border=False)
     with chat_container:
-        for message in chat_message_history.messages:
+        show_num = history_cfg.page_size * st.session_state.get('chat_page_num')
+        if chat_message_history.count() > show_num:
+            st.button('加载更早的消息', key='btn_load_older', on_click=__on_load_older_click)
+
+        for _, message in chat_message_history.get_messages(show_num):
             with st.chat_message(message.type):
                 st.markdown(message.content)
 
@@ -314,7 +328,9 @@ def __main_page():
 
         # write_graph = write_with_db("temp1")
         # response = write_graph.stream({"messages":chat_message_history.messages}, stream_mode='values')
-        response = write_paper(chat_message_history)
+        response = write_paper(
+            chat_message_history.get_window(history_cfg.window_tokens, history_cfg.page_size)
+        )
 
         result = chat_container.chat_message('assistant').write_stream(response)
         chat_message_history.add_ai_message(AIMessage(content=result))
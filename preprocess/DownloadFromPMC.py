@@ -1,15 +1,14 @@
 import os
-import random
 import sys
-import time
 
 import pandas as pd
 from loguru import logger
 from tqdm import tqdm
 
 from Config import Config
-from utils.MarkdownPraser import save_to_md
-from utils.PMCUtil import download_paper_data, parse_paper_data, get_pmc_id
+from storage.SqliteStore import JobStore
+from utils.ConvertUtil import ConvertTask, ConvertResult, ConvertStatus, XmlFormat, convert_files, results_table
+from utils.PMCUtil import download_paper_data, get_pmc_id
 
 logger.remove()
 handler_id = logger.add(sys.stderr, level="INFO")
@@ -17,56 +16,66 @@ logger.add('log/pmc.log')
 
 
 def download_from_pmc(csv_file: str):
+    """
+    下载CSV中还没有年份的文献。每篇文献的结果单独记录在任务库中，中断后重新运行只处理剩余的文献，
+    全部处理完后一次性写回CSV。
+
+    :param csv_file: 包含pmc_id列的CSV文件
+    :return: 无返回值
+    """
     df = pd.read_csv(csv_file, encoding='utf-8', dtype={'title': 'str', 'pmc_id': 'str', 'doi': 'str', 'year': 'str'})
 
-    df_output = df.copy()
-    length = df_output.shape[0]
-    for index, row in tqdm(df_output.iterrows(), total=length, desc='download xml'):
-        if not pd.isna(row.year):
-            continue
+    with JobStore(JobStore.journal_path(csv_file), 'download') as jobs:
+        jobs.seed(df.loc[df['year'].isna() & df['pmc_id'].notna(), 'pmc_id'])
+
+        for record in tqdm(jobs.pending(), desc='download xml'):
+            result = download_paper_data(record.key, config)
+            if result is None:
+                jobs.fail(record.key, 'download failed')
+                continue
 
-        pmcid = row.pmc_id
-        _, data = download_paper_data(pmcid, config)
+            _, data = result
+            jobs.done(record.key, doi=data['doi'], year=data['year'])
 
-        df_output.at[index, 'doi'] = data['doi']
-        df_output.at[index, 'year'] = data['year']
-        df_output.to_csv(csv_file, index=False, encoding='utf-8')
-        time.sleep(random.uniform(2.0, 5.0))
+        logger.info(f'download xml: {jobs.counts()}')
+        jobs.compact(csv_file, 'pmc_id')
 
 
-def solve_xml(csv_file: str):
+def solve_xml(csv_file: str, max_workers: int = None):
     df = pd.read_csv(csv_file, encoding='utf-8', dtype={'title': 'str', 'pmc_id': 'str', 'doi': 'str', 'year': 'str'})
 
-    df_output = df.copy()
-    length = df_output.shape[0]
     now_collection = config.milvus_config.get_collection().collection_name
-    for index, row in tqdm(df_output.iterrows(), total=length, desc='adding documents'):
-        if not pd.isna(row.title):
-            continue
-
-        year: str = row.year
-        doi: str = row.doi
-        with open(os.path.join(config.get_xml_path(now_collection), year, doi.replace('/', '@') + '.xml'), 'r',
-                  encoding='utf-8') as f:
-            xml_text = f.read()
-
-        try:
-            flag, data = parse_paper_data(xml_text)
-        except Exception as e:
-            logger.error(f'{year} {doi} {e}')
-            break
-
-        if not flag:
-            df_output.at[index, 'title'] = 'skip'
-            df_output.to_csv(csv_file, index=False, encoding='utf-8')
-            continue
-
-        output_path = os.path.join(config.get_md_path(now_collection), year, doi.replace('/', '@') + '.md')
-        os.makedirs(os.path.join(config.get_md_path(now_collection), year), exist_ok=True)
-        save_to_md(data, output_path)
-
-        df_output.at[index, 'title'] = 'done'
-        df_output.to_csv(csv_file, index=False, encoding='utf-8')
+    with JobStore(JobStore.journal_path(csv_file), 'convert') as jobs:
+        jobs.seed(df.loc[df['title'].isna() & df['pmc_id'].notna(), 'pmc_id'])
+        pending = {record.key for record in jobs.pending()}
+
+        tasks = [
+            ConvertTask(
+                row.pmc_id,
+                os.path.join(config.get_xml_path(now_collection), row.year, row.doi.replace('/', '@') + '.xml'),
+                XmlFormat.PMC,
+                os.path.join(config.get_md_path(now_collection), row.year, row.doi.replace('/', '@') + '.md')
+            )
+            for row in df.itertuples()
+            if row.pmc_id in pending
+        ]
+
+        # 失败的文件记为failed，下次运行时重试
+        def record(result: ConvertResult) -> None:
+            match result.status:
+                case ConvertStatus.DONE:
+                    jobs.done(result.key, title=result.status.value)
+                case ConvertStatus.SKIP:
+                    jobs.skip(result.key, title=result.status.value)
+                case _:
+                    jobs.fail(result.key, result.error or result.status.value)
+
+        results = convert_files(tasks, max_workers=max_workers, desc='adding documents', on_result=record)
+
+        logger.info(f'convert xml: {jobs.counts()}')
+        jobs.compact(csv_file, 'pmc_id')
+
+    results_table(results).to_csv(csv_file.replace('.csv', '_results.csv'), encoding='utf-8')
 
 
 def reset_csv(path: str) -> None:
@@ -74,6 +83,8 @@ def reset_csv(path: str) -> None:
     df['title'] = pd.NA
 
     df.to_csv(path, index=False, encoding='utf-8')
+    with JobStore(JobStore.journal_path(path), 'convert') as jobs:
+        jobs.clear()
 
 
 if __name__ == '__main__':
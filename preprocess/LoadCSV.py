@@ -1,115 +1,121 @@
 import os
-import random
 import sys
-import time
 import pandas as pd
 
 from tqdm import tqdm
 from loguru import logger
 
 from Config import Config
+from storage.SqliteStore import JobStore
+from utils.ConvertUtil import ConvertTask, ConvertResult, ConvertStatus, XmlFormat, convert_files, results_table
 from utils.MarkdownPraser import save_to_md
 from utils.PMCUtil import download_paper_data, parse_paper_data
-from utils.PubmedUtil import get_paper_info
+from utils.PubmedUtil import get_papers_info
 from utils.Decorator import timer
 
 
 @timer
 def download_from_csv(year: int):
     """
-    :param year:
-    :return:
+    查询指定年份文献的元数据，有PMC全文的下载并转换为markdown。每篇文献的结果单独记录在任务库中，
+    中断后重新运行只处理剩余的文献，处理完后一次性写回CSV。
+
+    :param year: 年份
+    :return: 无返回值
     """
-    df = pd.read_csv('nandesyn_pub.csv', encoding='utf-8',
+    csv_file = 'nandesyn_pub.csv'
+    df = pd.read_csv(csv_file, encoding='utf-8',
                      dtype={'Title': 'str', 'PMID': 'str', 'DOI': 'str', 'PMC': 'str'})
-    df.sort_values(by=['Year', 'PMID'], inplace=True)
-    out_put_df = df.copy()
     df_10 = df[df['Year'] == year]
-
-    length = df_10.shape[0]
     collection = config.milvus_config.get_collection().collection_name
-    for index, row in tqdm(df_10.iterrows(), total=length, desc=f'search documents in {year}'):
-        if pd.isna(row.PMID):
-            continue
-
-        if not pd.isna(row.Title):
-            continue
-
-        time.sleep(random.uniform(2.0, 5.0))
-        pm_data, pmc_id = get_paper_info(row.PMID, config)
-        if pmc_id:
-            time.sleep(random.uniform(1.0, 4.0))
-            _, download_info = download_paper_data(pmc_id, config)
-            doi = download_info['doi']
-            year = download_info['year']
-            xml_path = download_info['output_path']
-
-            with open(xml_path, 'r', encoding='utf-8') as f:
-                xml_text = f.read()
-            flag, xml_data = parse_paper_data(xml_text)
-
-            if not flag:
-                out_put_df.at[index, 'Title'] = 'skip'
-                out_put_df.at[index, 'DOI'] = doi
-                out_put_df.at[index, 'PMC'] = pmc_id
-                out_put_df.to_csv('nandesyn_pub.csv', index=False, encoding='utf-8')
-                continue
 
-            output_path = os.path.join(config.get_md_path(collection), year, doi.replace('/', '@') + '.md')
-            os.makedirs(os.path.join(config.get_md_path(collection), year), exist_ok=True)
-            save_to_md(xml_data, output_path)
-
-            out_put_df.at[index, 'Title'] = 'done'
-            out_put_df.at[index, 'DOI'] = doi
-            out_put_df.at[index, 'PMC'] = pmc_id
-        else:
-            title = pm_data.sections[0].text
-            year = pm_data.info.year
-            doi = pm_data.info.doi
-
-            if doi is None:
-                out_put_df.at[index, 'Title'] = title
-                out_put_df.to_csv('nandesyn_pub.csv', index=False, encoding='utf-8')
+    with JobStore(JobStore.journal_path(csv_file), f'search_{year}') as jobs:
+        jobs.seed(df_10.loc[df_10['PMID'].notna() & df_10['Title'].isna(), 'PMID'])
+        todo = jobs.pending()
+
+        # 批量获取所有待处理文献的元数据，请求速率由共享的令牌桶控制
+        papers = get_papers_info([record.key for record in todo], config)
+        logger.info(f'fetch {len(papers)} of {len(todo)} papers in {year}')
+
+        for record in tqdm(todo, desc=f'search documents in {year}'):
+            pmid = record.key
+            if pmid not in papers:
+                logger.warning(f'PMID:{pmid} not found')
+                jobs.fail(pmid, 'not found')
                 continue
 
-            out_put_df.at[index, 'Title'] = title
-            out_put_df.at[index, 'DOI'] = doi
+            pm_data, pmc_id = papers[pmid]
+            if pmc_id:
+                result = download_paper_data(pmc_id, config)
+                if result is None:
+                    jobs.fail(pmid, f'download PMC{pmc_id} failed')
+                    continue
 
-        out_put_df.to_csv('nandesyn_pub.csv', index=False, encoding='utf-8')
+                _, download_info = result
+                doi = download_info['doi']
+                pub_year = download_info['year']
 
+                with open(download_info['output_path'], 'r', encoding='utf-8') as f:
+                    xml_text = f.read()
+                flag, xml_data = parse_paper_data(xml_text)
 
-def load_csv(year: int):
-    df = pd.read_csv('nandesyn_pmc.csv', encoding='utf-8',
-                     dtype={'Title': 'str', 'PMID': 'str', 'DOI': 'str', 'PMC': 'str'})
-    out_put_df = df.copy()
-    df_10 = df[df['Year'] == year]
+                if not flag:
+                    jobs.skip(pmid, Title='skip', DOI=doi, PMC=pmc_id)
+                    continue
 
-    length = df_10.shape[0]
-    collection = config.milvus_config.get_collection().collection_name
-    for index, row in tqdm(df_10.iterrows(), total=length, desc=f'search documents in {year}'):
-        doi: str = row.DOI
-        xml_path = os.path.join(config.get_xml_path(collection), str(year), doi.replace('/', '@') + '.xml')
+                output_path = os.path.join(config.get_md_path(collection), pub_year, doi.replace('/', '@') + '.md')
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                save_to_md(xml_data, output_path)
 
-        if not os.path.exists(xml_path):
-            out_put_df['Title'] = 'not exist'
-            out_put_df.to_csv('nandesyn_pmc.csv', index=False, encoding='utf-8')
-            continue
+                jobs.done(pmid, Title='done', DOI=doi, PMC=pmc_id)
+            else:
+                title = pm_data.sections[0].text
+                doi = pm_data.info.doi
 
-        with open(xml_path, 'r', encoding='utf-8') as f:
-            xml_text = f.read()
-        flag, xml_data = parse_paper_data(xml_text)
+                if doi is None:
+                    jobs.done(pmid, Title=title)
+                else:
+                    jobs.done(pmid, Title=title, DOI=doi)
 
-        if not flag:
-            out_put_df['Title'] = 'skip'
-            out_put_df.to_csv('nandesyn_pmc.csv', index=False, encoding='utf-8')
-            continue
+        logger.info(f'search documents in {year}: {jobs.counts()}')
+        jobs.compact(csv_file, 'PMID')
 
-        output_path = os.path.join(config.get_md_path(collection), str(year), doi.replace('/', '@') + '.md')
-        os.makedirs(os.path.join(config.get_md_path(collection), str(year)), exist_ok=True)
-        save_to_md(xml_data, output_path)
 
-        out_put_df['Title'] = 'done'
-        out_put_df.to_csv('nandesyn_pmc.csv', index=False, encoding='utf-8')
+def load_csv(year: int, max_workers: int = None):
+    csv_file = 'nandesyn_pmc.csv'
+    df = pd.read_csv(csv_file, encoding='utf-8',
+                     dtype={'Title': 'str', 'PMID': 'str', 'DOI': 'str', 'PMC': 'str'})
+    df_10 = df[df['Year'] == year]
+
+    collection = config.milvus_config.get_collection().collection_name
+    with JobStore(JobStore.journal_path(csv_file), f'convert_{year}') as jobs:
+        jobs.seed(df_10.loc[df_10['DOI'].notna(), 'DOI'])
+        pending = {record.key for record in jobs.pending()}
+
+        tasks = [
+            ConvertTask(
+                row.DOI,
+                os.path.join(config.get_xml_path(collection), str(year), row.DOI.replace('/', '@') + '.xml'),
+                XmlFormat.PMC,
+                os.path.join(config.get_md_path(collection), str(year), row.DOI.replace('/', '@') + '.md')
+            )
+            for row in df_10.itertuples()
+            if row.DOI in pending
+        ]
+
+        def record(result: ConvertResult) -> None:
+            match result.status:
+                case ConvertStatus.FAILED:
+                    jobs.fail(result.key, result.error)
+                case ConvertStatus.SKIP:
+                    jobs.skip(result.key, Title=result.status.value)
+                case _:
+                    jobs.done(result.key, Title=result.status.value)
+
+        results = convert_files(tasks, max_workers=max_workers, desc=f'search documents in {year}', on_result=record)
+        jobs.compact(csv_file, 'DOI')
+
+    results_table(results).to_csv(f'nandesyn_pmc_{year}_results.csv', encoding='utf-8')
 
 
 def init_csv():
@@ -120,6 +126,9 @@ def init_csv():
     out_put_df['Title'] = pd.NA
     out_put_df.to_csv('nandesyn_pub.csv', index=False, encoding='utf-8')
 
+    with JobStore(JobStore.journal_path('nandesyn_pub.csv'), 'init') as jobs:
+        jobs.clear(all_jobs=True)
+
 
 def get_pmc_list():
     df = pd.read_csv('nandesyn_pub.csv', encoding='utf-8',
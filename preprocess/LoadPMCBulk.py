@@ -0,0 +1,127 @@
+import glob
+import sys
+
+import pandas as pd
+from loguru import logger
+
+from Config import Config
+from storage.SqliteStore import JobStore
+from utils.ConvertUtil import ConvertResult, ConvertStatus, convert_stream
+from utils.PMCBulkUtil import package_tasks
+from utils.entities.Job import JobStatus
+
+logger.remove()
+handler_id = logger.add(sys.stderr, level="INFO")
+logger.add('log/pmc_bulk.log')
+
+
+def read_pmc_ids(path: str, column: str = 'pmc_id') -> list[str]:
+    """
+    读取PMC ID列表，CSV文件读取指定列，其他文件每行一个ID。
+    """
+    if path.endswith('.csv'):
+        return pd.read_csv(path, encoding='utf-8', dtype=str)[column].dropna().tolist()
+
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def load_packages(
+        packages: list[str],
+        pmc_ids: list[str] = None,
+        query: str = None,
+        max_workers: int = None,
+        batch_size: int = 16
+) -> None:
+    """
+    从本地的PMC OA批量包中读取JATS xml并转换为markdown，保存到当前知识库的markdown目录，之后由InitDatabase入库。
+    压缩包按顺序流式读取，解析和保存在进程池中并行完成；已完成的文献记录在任务库中，重新运行时跳过。
+
+    :param packages: 压缩包路径
+    :param pmc_ids: 只转换这些文献
+    :param query: 文件列表上的查询表达式
+    :param max_workers: 进程数
+    :param batch_size: 每次提交给子进程的文献数
+    :return: 无返回值
+    """
+    collection = config.milvus_config.get_collection().collection_name
+
+    with JobStore(config.get_job_path(collection), 'pmc_bulk') as jobs:
+        finished = {record.key for record in jobs.records([JobStatus.DONE, JobStatus.SKIP])}
+        logger.info(f'{len(finished)} papers already converted')
+
+        def record(result: ConvertResult) -> None:
+            match result.status:
+                case ConvertStatus.DONE:
+                    jobs.done(result.key, doi=result.doi, year=result.year, md_file=result.md_file)
+                case ConvertStatus.SKIP:
+                    jobs.skip(result.key)
+                case _:
+                    jobs.fail(result.key, result.error or result.status.value)
+
+        tasks = package_tasks(packages, config.get_md_path(collection), pmc_ids, query, exclude=finished)
+        convert_stream(tasks, max_workers=max_workers, batch_size=batch_size, desc=collection, on_result=record)
+
+        logger.info(f'pmc bulk: {jobs.counts()}')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='convert PMC open access bulk packages into markdown')
+    parser.add_argument(
+        'packages',
+        nargs='+',
+        help='PMC OA bulk packages (.tar.gz), glob patterns are expanded'
+    )
+    parser.add_argument(
+        '--collection',
+        '-C',
+        type=int,
+        default=0,
+        help='Index of the collection the markdown files are written to'
+    )
+    parser.add_argument(
+        '--pmc_list',
+        '-L',
+        help='Only convert the PMC ids in this file, a csv file (see --id_column) or one id per line'
+    )
+    parser.add_argument(
+        '--id_column',
+        default='pmc_id',
+        help='Column of the PMC ids when --pmc_list is a csv file'
+    )
+    parser.add_argument(
+        '--query',
+        '-Q',
+        help='pandas query over the .filelist.csv next to each package, '
+             'e.g. "license == \'CC BY\' and retracted == \'no\'"'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=None,
+        help='Number of processes parsing xml files, defaults to the number of CPUs'
+    )
+    parser.add_argument(
+        '--batch_size',
+        type=int,
+        default=16,
+        help='Number of papers sent to a worker process at once'
+    )
+    args = parser.parse_args()
+
+    config = Config()
+    config.set_collection(args.collection)
+
+    package_files = sorted({file for pattern in args.packages for file in glob.glob(pattern)})
+    if not package_files:
+        parser.error('no package found')
+
+    load_packages(
+        package_files,
+        read_pmc_ids(args.pmc_list, args.id_column) if args.pmc_list else None,
+        args.query,
+        args.workers,
+        args.batch_size
+    )
@@ -1,65 +1,63 @@
 import os
 
-from tqdm import tqdm
-
 from Config import Config
 from loguru import logger
-from utils.GrobidUtil import parse_xml, GrobidConnector
-from utils.MarkdownPraser import save_to_md
+from storage.SqliteStore import TeiCache
+from utils.ConvertUtil import ConvertTask, ConvertResult, ConvertStatus, XmlFormat, convert_files, results_table
+from utils.GrobidUtil import GrobidConnector
 
 logger.add('log/pdf2md.log')
 
 
 def _pdf2xml(input_path: str | bytes):
     output_path = os.path.join(input_path, 'xml')
-    with GrobidConnector(gr_cfg) as connector:
+    with GrobidConnector(gr_cfg, TeiCache(config.get_tei_cache_path())) as connector:
         connector.parse_files(input_path, output_path, skip_exist=True)
 
 
-def _xml2md(input_path: str | bytes):
+def _xml2md(input_path: str | bytes, max_workers: int = None):
     xml_path = os.path.join(input_path, 'xml')
     md_path = os.path.join(input_path, 'md')
 
-    for root, _, files in os.walk(xml_path):
-        if not files:
-            continue
-
-        for file in tqdm(files, total=len(files)):
-            file_path = os.path.join(root, file)
-
-            data = parse_xml(file_path)
-            year = data.info.year
-            doi = data.info.doi
+    tasks = [
+        ConvertTask(file, os.path.join(root, file), XmlFormat.GROBID, md_root=md_path)
+        for root, _, files in os.walk(xml_path)
+        for file in files
+    ]
 
-            filename = f"{doi.replace('/', '@')}.md" if doi else file.replace('.xml', '.md')
-            year_folder = str(year) if year else 'unknown'
-            md_file = os.path.join(md_path, year_folder, filename)
+    results = convert_files(tasks, max_workers=max_workers)
+    _save_results(results, os.path.join(input_path, 'convert_results.csv'))
 
-            os.makedirs(os.path.dirname(md_file), exist_ok=True)
-            save_to_md(data, md_file)
 
-
-def _assemble_md(silent: bool = True):
+def _assemble_md(silent: bool = True, max_workers: int = None):
     collection = config.milvus_config.get_collection().collection_name
+
+    tasks = []
     for root, dirs, files in os.walk(config.get_xml_path(collection)):
         if len(files) == 0:
             continue
 
         file_year = os.path.basename(root)
-        for file in tqdm(files, total=len(files), desc=f'{file_year}'):
+        for file in files:
             if not file.endswith('.grobid.tei.xml'):
                 if not silent:
                     logger.warning(f'skip {file}')
                 continue
 
-            file_path = os.path.join(root, file)
             doi = file.replace('.grobid.tei.xml', '')
+            md_file = os.path.join(config.get_md_path(collection), file_year, f'{doi}.md')
+            tasks.append(ConvertTask(f'{file_year}/{file}', os.path.join(root, file), XmlFormat.GROBID, md_file))
+
+    results = convert_files(tasks, max_workers=max_workers, desc=collection)
+    _save_results(results, os.path.join(config.get_xml_path(collection), 'convert_results.csv'))
 
-            data = parse_xml(file_path)
 
-            md_path = os.path.join(config.get_md_path(collection), file_year, f'{doi}.md')
-            os.makedirs(os.path.join(config.get_md_path(collection), file_year), exist_ok=True)
-            save_to_md(data, md_path)
+def _save_results(results: list[ConvertResult], path: str):
+    table = results_table(results)
+    failed = table[table['status'] != ConvertStatus.DONE]
+    if len(failed) > 0:
+        logger.warning(f'{len(failed)} files not converted, see {path}')
+    table.to_csv(path, encoding='utf-8')
 
 
 if __name__ == '__main__':
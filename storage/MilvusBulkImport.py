@@ -0,0 +1,182 @@
+import os
+import shutil
+import threading
+import time
+from typing import Any, Protocol, Sequence
+
+from loguru import logger
+from pymilvus import Collection, utility, BulkInsertState
+from pymilvus.bulk_writer import LocalBulkWriter, BulkFileType
+
+FILE_TYPES = {
+    'parquet': BulkFileType.PARQUET,
+    'numpy': BulkFileType.NUMPY,
+}
+
+
+class ObjectStore(Protocol):
+    def upload(self, local_files: Sequence[str], prefix: str) -> list[str]:
+        """
+        上传本地文件，返回Milvus可以读取的对象路径。
+        """
+        ...
+
+
+class MinioObjectStore:
+    def __init__(self, endpoint: str, access_key: str, secret_key: str, bucket: str, secure: bool = False):
+        """
+        Milvus所使用的MinIO对象存储。
+        """
+        from minio import Minio
+
+        self.client = Minio(endpoint, access_key=access_key, secret_key=secret_key, secure=secure)
+        self.bucket = bucket
+
+    def upload(self, local_files: Sequence[str], prefix: str) -> list[str]:
+        remote_files = []
+        for local_file in local_files:
+            remote_file = f'{prefix}/{os.path.basename(local_file)}'
+            self.client.fput_object(self.bucket, remote_file, local_file)
+            remote_files.append(remote_file)
+
+        return remote_files
+
+
+class LocalObjectStore:
+    def __init__(self, root: str):
+        """
+        使用本地目录代替对象存储，用于测试或Milvus与导入程序共享文件系统的部署。
+        """
+        self.root = root
+
+    def upload(self, local_files: Sequence[str], prefix: str) -> list[str]:
+        remote_files = []
+        for local_file in local_files:
+            remote_file = f'{prefix}/{os.path.basename(local_file)}'
+            target = os.path.join(self.root, remote_file)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(local_file, target)
+            remote_files.append(remote_file)
+
+        return remote_files
+
+
+class BulkImportWriter:
+    def __init__(
+            self,
+            collection_name: str,
+            local_path: str,
+            file_type: str = 'parquet',
+            segment_size: int = 512 * 1024 * 1024,
+            using: str = 'default',
+    ):
+        """
+        将子文档的向量和标量字段写入本地的列式文件，之后由bulk_import一次性导入Milvus。
+
+        :param collection_name: 目标知识库，文件按照该集合的schema写入
+        :param local_path: 本地输出目录
+        :param file_type: parquet 或 numpy
+        :param segment_size: 单个文件的大小上限，超出后自动切分
+        :param using: pymilvus连接别名，langchain-milvus的连接别名为 Milvus.alias
+        """
+        self.collection_name = collection_name
+        self.local_path = local_path
+
+        if os.path.exists(local_path):
+            shutil.rmtree(local_path)
+        os.makedirs(local_path)
+
+        self._lock = threading.Lock()
+        self._rows = 0
+        self._writer = LocalBulkWriter(
+            schema=Collection(collection_name, using=using).schema,
+            local_path=local_path,
+            segment_size=segment_size,
+            file_type=FILE_TYPES[file_type],
+        )
+
+    @property
+    def rows(self) -> int:
+        return self._rows
+
+    def append(self, rows: Sequence[dict[str, Any]]) -> None:
+        with self._lock:
+            for row in rows:
+                self._writer.append_row(row)
+            self._rows += len(rows)
+
+    def commit(self) -> list[list[str]]:
+        """
+        将缓冲区中的数据写入文件。
+
+        :return: 生成的文件，每一组文件对应一个导入任务
+        """
+        with self._lock:
+            self._writer.commit()
+            batch_files = self._writer.batch_files
+
+        logger.info(f'write {self._rows} rows into {len(batch_files)} bulk files at {self.local_path}')
+        return batch_files
+
+
+def bulk_import(
+        collection_name: str,
+        batch_files: Sequence[Sequence[str]],
+        object_store: ObjectStore,
+        index_params: dict[str, Any],
+        vector_field: str = 'vector',
+        timeout: int = 3600,
+        poll_interval: int = 5,
+        using: str = 'default',
+) -> int:
+    """
+    将本地列式文件上传到对象存储并通过Milvus的bulk insert导入，导入完成后再建立向量索引并加载集合。
+
+    :param collection_name: 目标知识库
+    :param batch_files: BulkImportWriter.commit 生成的文件
+    :param object_store: Milvus可以读取的对象存储
+    :param index_params: 向量索引参数
+    :param vector_field: 向量字段名
+    :param timeout: 等待导入任务的超时时间(秒)
+    :param poll_interval: 查询任务状态的间隔(秒)
+    :param using: pymilvus连接别名，langchain-milvus的连接别名为 Milvus.alias
+    :return: 导入的行数
+    """
+    collection = Collection(collection_name, using=using)
+
+    # 导入期间不维护索引，全部数据写入后一次性建立
+    collection.release()
+    if collection.has_index():
+        collection.drop_index()
+
+    task_ids = []
+    run_id = int(time.time())
+    for index, files in enumerate(batch_files):
+        prefix = f'bulk/{collection_name}/{run_id}/{index}'
+        remote_files = object_store.upload(files, prefix)
+        task_ids.append(utility.do_bulk_insert(collection_name, files=remote_files, using=using))
+    logger.info(f'submit {len(task_ids)} bulk insert tasks to {collection_name}')
+
+    row_count = 0
+    deadline = time.time() + timeout
+    pending = set(task_ids)
+    while pending:
+        if time.time() > deadline:
+            raise TimeoutError(f'bulk insert tasks {pending} not finished in {timeout}s')
+
+        time.sleep(poll_interval)
+        for task_id in list(pending):
+            state = utility.get_bulk_insert_state(task_id, using=using)
+            if state.state in (BulkInsertState.ImportFailed, BulkInsertState.ImportFailedAndCleaned):
+                raise RuntimeError(f'bulk insert task {task_id} failed: {state.failed_reason}')
+            if state.state == BulkInsertState.ImportCompleted:
+                row_count += state.row_count
+                pending.remove(task_id)
+                logger.info(f'bulk insert task {task_id} completed, {state.row_count} rows')
+
+    logger.info(f'build index on {collection_name}.{vector_field}')
+    collection.create_index(vector_field, index_params)
+    utility.wait_for_index_building_complete(collection_name, using=using)
+    collection.load()
+
+    return row_count
@@ -0,0 +1,221 @@
+import mmap
+import os
+import sqlite3
+import struct
+import threading
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.documents import Document
+from langchain_core.load import loads
+from langchain_core.stores import BaseStore
+from loguru import logger
+
+from storage.SqliteStore import LANGCHAIN_DEFAULT_TABLE_NAME, ITERATOR_WINDOW_SIZE
+
+SEGMENT_MAGIC = b'ALCSEG01'
+
+# 文件头：magic, 文档数, 索引偏移, doc_id区偏移, 内容区偏移
+_HEADER = struct.Struct('<8sQQQQ')
+# 索引项：doc_id偏移, doc_id长度, 内容偏移, 内容长度
+_ENTRY = struct.Struct('<QIQI')
+
+
+def export_segment(
+        connection_string: str,
+        segment_path: str,
+        table_name: str = LANGCHAIN_DEFAULT_TABLE_NAME,
+) -> int:
+    """
+    将sqlite文档库导出为只读的segment文件。
+
+    文件依次为固定长度的文件头、按doc_id排序的索引、连续存放的doc_id和连续存放的序列化文档。
+    先写入同目录下的临时文件再重命名替换，读取方只会看到完整的segment。
+
+    :param connection_string: sqlite文档库路径(document.db)
+    :param segment_path: 需要创建或替换的segment文件路径
+    :param table_name: 文档库表名
+    :return: 导出的文档数
+    """
+    conn = sqlite3.connect(connection_string)
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT doc_id, content FROM {table_name}")
+        rows = {
+            doc_id.encode('utf-8'): content.encode('utf-8')
+            for doc_id, content in cur.fetchall()
+        }
+        cur.close()
+    finally:
+        conn.close()
+
+    keys = sorted(rows.keys())
+    count = len(keys)
+
+    index_offset = _HEADER.size
+    key_offset = index_offset + _ENTRY.size * count
+    payload_offset = key_offset + sum(len(key) for key in keys)
+
+    tmp_path = f'{segment_path}.tmp'
+    os.makedirs(os.path.dirname(os.path.abspath(segment_path)), exist_ok=True)
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(SEGMENT_MAGIC, count, index_offset, key_offset, payload_offset))
+
+        key_pos = key_offset
+        payload_pos = payload_offset
+        for key in keys:
+            payload = rows[key]
+            f.write(_ENTRY.pack(key_pos, len(key), payload_pos, len(payload)))
+            key_pos += len(key)
+            payload_pos += len(payload)
+
+        for key in keys:
+            f.write(key)
+
+        for key in keys:
+            f.write(rows[key])
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, segment_path)
+    logger.info(f'export {count} documents to segment {segment_path}')
+
+    return count
+
+
+class SegmentDocStore(BaseStore[str, Document]):
+    def __init__(self, segment_path: str) -> None:
+        """
+        通过内存映射读取export_segment导出的segment文件的只读文档库。
+        查询时在排序的索引上二分查找，只在反序列化时复制文档内容；磁盘上的segment文件被替换后，下次读取时重新映射。
+
+        :param segment_path: segment文件路径
+        """
+        self.segment_path = segment_path
+
+        self._lock = threading.Lock()
+        self._file = None
+        self._mm: Optional[mmap.mmap] = None
+        self._stat: Optional[Tuple[int, int]] = None
+        self._count = 0
+        self._index_offset = 0
+
+        self.__open()
+
+    def __open(self) -> None:
+        stat = os.stat(self.segment_path)
+        _file = open(self.segment_path, 'rb')
+        if stat.st_size == 0:
+            _file.close()
+            raise ValueError(f'Empty segment file {self.segment_path}')
+
+        mm = mmap.mmap(_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, index_offset, _, _ = _HEADER.unpack_from(mm, 0)
+        if magic != SEGMENT_MAGIC:
+            mm.close()
+            _file.close()
+            raise ValueError(f'{self.segment_path} is not a docstore segment')
+
+        old_mm, old_file = self._mm, self._file
+        self._file, self._mm = _file, mm
+        self._count, self._index_offset = count, index_offset
+        self._stat = (stat.st_ino, stat.st_mtime_ns)
+
+        if old_mm is not None:
+            old_mm.close()
+            old_file.close()
+
+    def refresh(self) -> None:
+        """
+        segment文件在打开之后被替换时重新映射。
+        """
+        stat = os.stat(self.segment_path)
+        if (stat.st_ino, stat.st_mtime_ns) != self._stat:
+            with self._lock:
+                self.__open()
+            logger.info(f'reload segment {self.segment_path}')
+
+    def close(self) -> None:
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __del__(self) -> None:
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __entry(self, index: int) -> Tuple[int, int, int, int]:
+        return _ENTRY.unpack_from(self._mm, self._index_offset + index * _ENTRY.size)
+
+    def __key(self, index: int) -> bytes:
+        key_offset, key_len, _, _ = self.__entry(index)
+        return self._mm[key_offset:key_offset + key_len]
+
+    def __find(self, key: bytes) -> int:
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.__key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        if lo < self._count and self.__key(lo) == key:
+            return lo
+        return -1
+
+    def __load(self, key: str) -> Optional[Document]:
+        index = self.__find(key.encode('utf-8'))
+        if index < 0:
+            return None
+
+        _, _, payload_offset, payload_len = self.__entry(index)
+        with memoryview(self._mm) as view:
+            content = str(view[payload_offset:payload_offset + payload_len], 'utf-8')
+
+        val: Document = loads(content)
+        val.metadata['doc_id'] = key
+        return val
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[Document]]:
+        self.refresh()
+
+        with self._lock:
+            return [self.__load(key) for key in keys]
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Document]]) -> None:
+        raise NotImplementedError('SegmentDocStore is read-only, write to the sqlite docstore and re-export')
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        raise NotImplementedError('SegmentDocStore is read-only, write to the sqlite docstore and re-export')
+
+    def __keys_window(self, start: int) -> list[str]:
+        with self._lock:
+            end = min(start + ITERATOR_WINDOW_SIZE, self._count)
+            return [self.__key(index).decode('utf-8') for index in range(start, end)]
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        self.refresh()
+
+        # 按窗口在锁内读取，迭代过程中其他线程重新映射segment时不会访问已关闭的mmap
+        start = 0
+        while True:
+            keys = self.__keys_window(start)
+            if len(keys) == 0:
+                break
+
+            for key in keys:
+                if prefix is None or key.startswith(prefix):
+                    yield key
+            start += ITERATOR_WINDOW_SIZE
@@ -1,23 +1,49 @@
+import asyncio
+import hashlib
+import json
+import os
 import sqlite3
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
 from datetime import datetime
-from typing import Any, Generic, Iterator, List, Optional, Sequence, Tuple, TypeVar
+from functools import wraps
+from typing import Any, AsyncIterator, Generic, Iterable, Iterator, List, Optional, Sequence, Tuple, TypeVar
 
 import pandas as pd
+from langchain_core.chat_history import BaseChatMessageHistory
 from langchain_core.documents import Document
 from langchain_core.load import dumps, loads
+from langchain_core.messages import BaseMessage, message_to_dict, messages_from_dict
 from langchain_core.stores import BaseStore
 from loguru import logger
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from utils.MarkdownPraser import Reference
+from utils.entities.Ingest import IngestRecord, IngestStatus
+from utils.entities.Job import JobRecord, JobStatus
 from utils.entities.UserProfile import User, UserGroup, Project, ChatHistory
 
 V = TypeVar("V")
 
 ITERATOR_WINDOW_SIZE = 500
+DOCSTORE_IO_WORKERS = 4
 
 LANGCHAIN_DEFAULT_TABLE_NAME = "langchain"
 REFERENCE_DEFAULT_TABLE_NAME = "reference"
+REFERENCE_BATCH_SIZE = 200
+
+CHAT_HISTORY_DEFAULT_TABLE_NAME = "message_store"
+MANIFEST_DEFAULT_TABLE_NAME = "manifest"
+TEI_CACHE_DEFAULT_TABLE_NAME = "tei_cache"
+HTTP_CACHE_DEFAULT_TABLE_NAME = "http_cache"
+JOB_DEFAULT_TABLE_NAME = "job_state"
+
+PROFILE_SCHEMA_VERSION = 1
+PROFILE_CACHE_TTL = 30
 
 
 class SqliteBaseStore(BaseStore[str, V], Generic[V]):
@@ -28,13 +54,20 @@ class SqliteBaseStore(BaseStore[str, V], Generic[V]):
             drop_old: bool = False,
             connection: Optional[sqlite3.connect] = None,
             engine_args: Optional[dict[str, Any]] = None,
+            io_workers: int = DOCSTORE_IO_WORKERS,
     ) -> None:
         self.connection_string = connection_string
         self.table_name = table_name
         self.drop_old = drop_old
         self.engine_args = engine_args or {}
+        self.io_workers = io_workers
 
         self._conn = connection if connection else self.__connect()
+        self._lock = threading.RLock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending_gets: dict[asyncio.AbstractEventLoop, dict[str, list[asyncio.Future]]] = {}
+        # 事件循环只弱引用任务，需要保留合并查询的任务直到完成，否则可能被回收而等待方永远不会返回
+        self._flush_tasks: set[asyncio.Task] = set()
         self.__post_init__()
 
     def __post_init__(self) -> None:
@@ -60,6 +93,19 @@ class SqliteBaseStore(BaseStore[str, V], Generic[V]):
             self._conn.commit()
             logger.info(f'Create table {self.table_name}')
 
+        # doc_id需要唯一才能覆盖写入，旧库先去除重复的doc_id再建立唯一索引
+        index_name = f'idx_{self.table_name}_doc_id'
+        res = cur.execute("SELECT name FROM sqlite_master WHERE type='index' AND name=?", (index_name,))
+        if res.fetchone() is None:
+            cur.execute(f"""
+                DELETE FROM {self.table_name} 
+                WHERE rowid NOT IN (SELECT MAX(rowid) FROM {self.table_name} GROUP BY doc_id)
+            """)
+            if cur.rowcount > 0:
+                logger.info(f'Remove {cur.rowcount} duplicated documents from {self.table_name}')
+            cur.execute(f"CREATE UNIQUE INDEX {index_name} ON {self.table_name} (doc_id)")
+            self._conn.commit()
+
         cur.close()
 
     def __delete_table(self):
@@ -73,6 +119,8 @@ class SqliteBaseStore(BaseStore[str, V], Generic[V]):
         cur.close()
 
     def __del__(self) -> None:
+        if self._executor:
+            self._executor.shutdown(wait=False)
         if self._conn:
             self._conn.close()
 
@@ -90,68 +138,180 @@ class SqliteBaseStore(BaseStore[str, V], Generic[V]):
         except Exception as e:
             logger.error(e)
 
-    def mget(self, keys: Sequence[str]) -> List[Optional[V]]:
-        cur = self._conn.cursor()
+    def __fetch_rows(self, keys: Sequence[str]) -> dict[str, str]:
+        """
+        使用一次查询读取给定id的序列化内容。
+
+        :param keys: doc_id列表，允许重复
+        :return: doc_id到序列化内容的映射，不存在的id不包含在内
+        """
+        if len(keys) == 0:
+            return {}
+
         query = f"""
         SELECT content, doc_id 
         FROM {self.table_name} 
         WHERE doc_id  IN ({','.join(['?'] * len(keys))})
         """
 
-        cur.execute(query, keys)
-        items = cur.fetchall()
-        cur.close()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute(query, keys)
+            items = cur.fetchall()
+            cur.close()
+
+        return {doc_id: content for content, doc_id in items}
 
-        ordered_values = {key: type[Document] for key in keys}
-        for item in items:
-            v = item[0]
-            val: Document = self.__deserialize_value(v)
-            k = item[1]
-            val.metadata['doc_id'] = k
-            ordered_values[k] = val
+    def __load_value(self, key: str, content: Optional[str]) -> Optional[V]:
+        if content is None:
+            return None
+
+        val: Document = self.__deserialize_value(content)
+        val.metadata['doc_id'] = key
+        return val
+
+    def __fetch_keys_window(self, start: int, prefix: Optional[str] = None) -> list[str]:
+        query = f"SELECT doc_id FROM {self.table_name}"
+        params = []
+        if prefix is not None:
+            query += " WHERE doc_id LIKE ?"
+            params.append(f'{prefix}%')
+        query += f" LIMIT {start}, {ITERATOR_WINDOW_SIZE}"
+
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.execute(query, params)
+            items = cur.fetchall()
+            cur.close()
 
-        return [ordered_values[key] for key in keys]
+        return [item[0] for item in items]
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[V]]:
+        rows = self.__fetch_rows(keys)
+
+        return [self.__load_value(key, rows.get(key)) for key in keys]
 
     def mset(self, key_value_pairs: Sequence[Tuple[str, V]]) -> None:
-        cur = self._conn.cursor()
         data = []
         for _id, item in key_value_pairs:
             content = self.__serialize_value(item)
             data.append((content, _id))
 
-        cur.executemany(f"INSERT INTO {self.table_name} VALUES(?, ?)", data)
-        self._conn.commit()
-        cur.close()
+        with self._lock:
+            cur = self._conn.cursor()
+            cur.executemany(
+                f"""
+                INSERT INTO {self.table_name} (content, doc_id) VALUES (?, ?)
+                ON CONFLICT (doc_id) DO UPDATE SET content = excluded.content
+                """,
+                data
+            )
+            self._conn.commit()
+            cur.close()
 
     def mdelete(self, keys: Sequence[str]) -> None:
-        cur = self._conn.cursor()
-        res = cur.execute(f"SELECT name FROM sqlite_master WHERE name='{self.table_name}'")
-        if res.fetchone() is None:
-            raise ValueError("Collection not found")
-        if keys is not None:
-            stmt = f"DELETE FROM {self.table_name} WHERE doc_id IN ({','.join(['?'] * len(keys))})"
-            cur.execute(stmt)
-        self._conn.commit()
-        cur.close()
+        with self._lock:
+            cur = self._conn.cursor()
+            res = cur.execute(f"SELECT name FROM sqlite_master WHERE name='{self.table_name}'")
+            if res.fetchone() is None:
+                raise ValueError("Collection not found")
+            if keys is not None:
+                stmt = f"DELETE FROM {self.table_name} WHERE doc_id IN ({','.join(['?'] * len(keys))})"
+                cur.execute(stmt, keys)
+            self._conn.commit()
+            cur.close()
 
     def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
-        cur = self._conn.cursor()
         start = 0
         while True:
-            query = f"SELECT doc_id FROM {self.table_name}"
-            if prefix is not None:
-                query += f" AND doc_id LIKE '{prefix}%'"
-            query += f" LIMIT {start}, {ITERATOR_WINDOW_SIZE}"
-            cur.execute(query)
-            items = cur.fetchall()
+            items = self.__fetch_keys_window(start, prefix)
 
             if len(items) == 0:
                 break
-            for item in items:
-                yield item[0]
+            yield from items
             start += ITERATOR_WINDOW_SIZE
 
-        cur.close()
+    def __get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.io_workers,
+                thread_name_prefix=f'docstore-{self.table_name}'
+            )
+
+        return self._executor
+
+    async def __run_io(self, func, *args) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__get_executor(), func, *args)
+
+    async def __flush_pending_gets(self, loop: asyncio.AbstractEventLoop) -> None:
+        pending = self._pending_gets.pop(loop, {})
+        if not pending:
+            return
+
+        keys = list(pending.keys())
+        try:
+            rows = await self.__run_io(self.__fetch_rows, keys)
+        except Exception as e:
+            for futures in pending.values():
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(e)
+            return
+
+        for key, futures in pending.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(rows.get(key))
+
+    async def amget(self, keys: Sequence[str]) -> List[Optional[V]]:
+        """
+        mget的异步版本。同一轮事件循环中并发发起的调用合并为一次SQL查询，在文档库的线程池中执行。
+
+        :param keys: doc_id列表
+        :return: 与keys顺序一致的文档，不存在的id对应None
+        """
+        if len(keys) == 0:
+            return []
+
+        loop = asyncio.get_running_loop()
+        pending = self._pending_gets.get(loop)
+        if pending is None:
+            pending = {}
+            self._pending_gets[loop] = pending
+            task = loop.create_task(self.__flush_pending_gets(loop))
+            self._flush_tasks.add(task)
+            task.add_done_callback(self._flush_tasks.discard)
+
+        futures = []
+        for key in keys:
+            future = loop.create_future()
+            pending.setdefault(key, []).append(future)
+            futures.append(future)
+
+        contents = await asyncio.gather(*futures)
+
+        # 每个调用方各自反序列化，避免重叠的id之间共享可变的Document对象
+        return await self.__run_io(
+            lambda: [self.__load_value(key, content) for key, content in zip(keys, contents)]
+        )
+
+    async def amset(self, key_value_pairs: Sequence[Tuple[str, V]]) -> None:
+        await self.__run_io(self.mset, key_value_pairs)
+
+    async def amdelete(self, keys: Sequence[str]) -> None:
+        await self.__run_io(self.mdelete, keys)
+
+    async def ayield_keys(self, prefix: Optional[str] = None) -> AsyncIterator[str]:
+        start = 0
+        while True:
+            items = await self.__run_io(self.__fetch_keys_window, start, prefix)
+
+            if len(items) == 0:
+                break
+            for item in items:
+                yield item
+            start += ITERATOR_WINDOW_SIZE
 
 
 class ReferenceStore:
@@ -159,45 +319,122 @@ class ReferenceStore:
             self,
             connection_string: str,
             table_name: str = REFERENCE_DEFAULT_TABLE_NAME,
+            batch_size: int = REFERENCE_BATCH_SIZE,
     ) -> None:
+        """
+        引用关系图，由文献表和引用边表组成。
+
+        文献优先以DOI标识，没有DOI时依次使用PMID和标题；没有DOI的施引文献以其来源文件标识。
+        每条引用边以(施引文献, ref_id)为键，重复加载同一文献时替换原有的边而不会重复写入，
+        没有任何标识的参考文献被跳过。引用边的两端都建有索引。
+
+        :param connection_string: sqlite数据库路径
+        :param table_name: 表名前缀，同名的旧表会迁移到新的表结构
+        :param batch_size: 每积累多少个文件的引用提交一次，见buffer_reference
+        """
         self.connection_string = connection_string
         self.table_name = table_name
+        self.paper_table = f'{table_name}_paper'
+        self.citation_table = f'{table_name}_citation'
+        self.checkpoint_table = f'{table_name}_checkpoint'
+        self.batch_size = batch_size
+
+        self._buffer: list[tuple] = []
+        self._buffer_sources: list[str] = []
 
         self._conn = self.__connect()
         self.__post_init__()
 
     def __connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.connection_string, check_same_thread=False)
+        # 手动管理事务，便于批量写入
+        conn = sqlite3.connect(self.connection_string, check_same_thread=False, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
         return conn
 
     def __post_init__(self):
         cur = self._conn.cursor()
-
-        res = cur.execute(f"SELECT name FROM sqlite_master WHERE name='{self.table_name}'")
-        if res.fetchone() is None:
-            stmt = f"""CREATE TABLE {self.table_name}
-                            (
-                                source_doi TEXT,
-                                ref_id TEXT,
-                                ref_doi TEXT,
-                                ref_title TEXT,
-                                ref_pmid TEXT,
-                                ref_pmc TEXT
-                            );
-                            """
-            cur.execute(stmt)
-            self._conn.commit()
-            logger.info(f'Create table {self.table_name}')
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.paper_table}
+            (
+                id      INTEGER not null
+                    primary key autoincrement,
+                doi     TEXT    not null default '',
+                title   TEXT    not null default '',
+                pmid    TEXT    not null default '',
+                pmc     TEXT    not null default '',
+                source  TEXT    not null default ''
+            );""")
+        columns = {row[1] for row in cur.execute(f"PRAGMA table_info({self.paper_table})").fetchall()}
+        if 'source' not in columns:
+            cur.execute(f"ALTER TABLE {self.paper_table} ADD COLUMN source TEXT not null default ''")
+        cur.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{self.paper_table}_doi "
+            f"ON {self.paper_table}(doi) WHERE doi != ''"
+        )
+        cur.execute(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{self.paper_table}_source "
+            f"ON {self.paper_table}(source) WHERE source != '' AND doi = ''"
+        )
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.paper_table}_pmid "
+            f"ON {self.paper_table}(pmid) WHERE pmid != ''"
+        )
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.paper_table}_title "
+            f"ON {self.paper_table}(title) WHERE title != ''"
+        )
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.citation_table}
+            (
+                source_id INTEGER not null
+                    references {self.paper_table}(id),
+                ref_id    TEXT    not null,
+                target_id INTEGER not null
+                    references {self.paper_table}(id),
+                primary key (source_id, ref_id)
+            );""")
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.citation_table}_target "
+            f"ON {self.citation_table}(target_id)"
+        )
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.checkpoint_table}
+            (
+                source      TEXT      not null
+                    primary key,
+                update_time TIMESTAMP not null
+            );""")
+
+        res = cur.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{self.table_name}'")
+        if res.fetchone() is not None:
+            self.__migrate_legacy_table(cur)
 
         cur.close()
 
+    def __migrate_legacy_table(self, cur: sqlite3.Cursor) -> None:
+        """
+        将旧的单表引用数据迁移到引用关系图中，并删除旧表。
+
+        :param cur: 游标
+        """
+        cur.execute(
+            f"SELECT source_doi, '', ref_id, ref_doi, ref_title, ref_pmid, ref_pmc FROM {self.table_name}"
+        )
+        rows = cur.fetchall()
+
+        with self.transaction():
+            self.__insert_rows(cur, rows)
+            cur.execute(f"DROP TABLE {self.table_name}")
+
+        logger.info(f'Migrate {len(rows)} rows from table {self.table_name}')
+
     def drop_old(self):
         cur = self._conn.cursor()
-        res = cur.execute(f"SELECT name FROM sqlite_master WHERE name='{self.table_name}'")
-        if res.fetchone() is not None:
-            stmt = f"DROP table {self.table_name}"
-            cur.execute(stmt)
-            self._conn.commit()
+        with self.transaction():
+            cur.execute(f"DELETE FROM {self.citation_table}")
+            cur.execute(f"DELETE FROM {self.paper_table}")
+            cur.execute(f"DELETE FROM {self.checkpoint_table}")
 
         cur.close()
 
@@ -210,54 +447,348 @@ class ReferenceStore:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         if self._conn:
+            # 缓冲区中只有完整的文件，退出时一并提交
+            self.flush()
             self._conn.close()
 
-    def add_reference(self, ref_data: Reference) -> None:
-        cur = self._conn.cursor()
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """
+        在一个显式事务中执行其中的语句，嵌套使用时并入外层事务。
+        """
+        if self._conn.in_transaction:
+            yield
+            return
+
+        self._conn.execute('BEGIN')
+        try:
+            yield
+        except Exception:
+            self._conn.execute('ROLLBACK')
+            raise
+        else:
+            self._conn.execute('COMMIT')
+
+    @staticmethod
+    def __clean(value: Any) -> str:
+        if isinstance(value, str):
+            return value.strip()
+        if isinstance(value, int):
+            return str(value)
+        return ''
+
+    @staticmethod
+    def flatten_reference(ref_data: Reference, source: str = '') -> list[tuple[str, str, str, str, str, str, str]]:
+        """
+        将一篇文献的参考文献列表转换为 (source_doi, source, ref_id, doi, title, pmid, pmc) 行。
+
+        :param ref_data: 文献的引用信息
+        :param source: 来源文件标识，文献没有DOI时用于标识施引文献
+        :return: 行列表，混合引用中的每一项在ref_id后加字母后缀
+        """
+        clean = ReferenceStore.__clean
         data = []
-        source_doi = ref_data.source_doi
-        ref_list = ref_data.ref_list
-        for index, reference in enumerate(ref_list):
+        source_doi = clean(ref_data.source_doi)
+        for index, reference in enumerate(ref_data.ref_list):
             if isinstance(reference, list):
-                for sub_index, sub_ref in enumerate(reference):
-                    data.append((
-                        source_doi,
-                        f'{index + 1}{chr(sub_index + 96)}',
-                        sub_ref.get('doi'),
-                        sub_ref.get('title'),
-                        sub_ref.get('pmid'),
-                        sub_ref.get('pmc'),
-                    ))
+                refs = [(f'{index + 1}{chr(sub_index + 96)}', sub_ref) for sub_index, sub_ref in enumerate(reference)]
             elif isinstance(reference, dict):
+                refs = [(str(index + 1), reference)]
+            else:
+                continue
+
+            for ref_id, ref in refs:
                 data.append((
                     source_doi,
-                    str(index + 1),
-                    reference.get('doi'),
-                    reference.get('title'),
-                    reference.get('pmid'),
-                    reference.get('pmc'),
+                    source,
+                    ref_id,
+                    clean(ref.get('doi')),
+                    clean(ref.get('title')),
+                    clean(ref.get('pmid', ref.get('pubmed'))),
+                    clean(ref.get('pmc')),
                 ))
 
+        return data
+
+    def __get_or_create_source(self, cur: sqlite3.Cursor, doi: str, source: str) -> Optional[int]:
+        """
+        获取施引文献的id，按照DOI或来源文件查找，不存在时创建。
+
+        :param cur: 游标
+        :param doi: 文献DOI
+        :param source: 来源文件标识
+        :return: 文献id，DOI和来源文件都为空时返回None
+        """
+        if doi:
+            return self.__get_or_create_paper(cur, doi, '', '', '')
+        if not source:
+            return None
+
+        cur.execute(f"SELECT id FROM {self.paper_table} WHERE source = ? AND doi = ''", (source,))
+        result = cur.fetchone()
+        if result is not None:
+            return result[0]
+
+        cur.execute(f"INSERT INTO {self.paper_table} (source) VALUES (?)", (source,))
+        return cur.lastrowid
+
+    def __get_or_create_paper(self, cur: sqlite3.Cursor, doi: str, title: str, pmid: str, pmc: str) -> Optional[int]:
+        """
+        获取被引文献的id，依次按照DOI、PMID和标题查找，不存在时创建。
+
+        :param cur: 游标
+        :param doi: 文献DOI
+        :param title: 文献标题
+        :param pmid: PubMed ID
+        :param pmc: PMC ID
+        :return: 文献id，没有任何标识时返回None
+        """
+        if doi:
+            cur.execute(f"SELECT id FROM {self.paper_table} WHERE doi = ?", (doi,))
+        elif pmid:
+            cur.execute(f"SELECT id FROM {self.paper_table} WHERE pmid = ? AND doi = ''", (pmid,))
+        elif title:
+            cur.execute(f"SELECT id FROM {self.paper_table} WHERE title = ? AND doi = '' AND pmid = ''", (title,))
+        else:
+            return None
+
+        result = cur.fetchone()
+        if result is None:
+            cur.execute(
+                f"INSERT INTO {self.paper_table} (doi, title, pmid, pmc) VALUES (?, ?, ?, ?)",
+                (doi, title, pmid, pmc)
+            )
+            return cur.lastrowid
+
+        paper_id = result[0]
+        cur.execute(
+            f"""
+            UPDATE {self.paper_table}
+            SET title = CASE WHEN title = '' THEN ? ELSE title END,
+                pmid  = CASE WHEN pmid = '' THEN ? ELSE pmid END,
+                pmc   = CASE WHEN pmc = '' THEN ? ELSE pmc END
+            WHERE id = ? AND (title = '' OR pmid = '' OR pmc = '')
+            """,
+            (title, pmid, pmc, paper_id)
+        )
+        return paper_id
+
+    def __insert_rows(self, cur: sqlite3.Cursor, rows: Sequence[tuple]) -> None:
+        clean = ReferenceStore.__clean
+        source_ids: dict[tuple[str, str], Optional[int]] = {}
+        edges = []
+        skipped = 0
+        for source_doi, source, ref_id, ref_doi, ref_title, ref_pmid, ref_pmc in rows:
+            key = (clean(source_doi), clean(source))
+            if key not in source_ids:
+                source_id = self.__get_or_create_source(cur, *key)
+                # 重新加载同一篇文献时替换其全部引用，而不是在旧数据上追加
+                if source_id is not None:
+                    cur.execute(f"DELETE FROM {self.citation_table} WHERE source_id = ?", (source_id,))
+                source_ids[key] = source_id
+
+            source_id = source_ids[key]
+            target_id = self.__get_or_create_paper(
+                cur, clean(ref_doi), clean(ref_title), clean(ref_pmid), clean(ref_pmc)
+            )
+            if source_id is None or target_id is None:
+                skipped += 1
+                continue
+            edges.append((source_id, clean(ref_id), target_id))
+
+        if skipped > 0:
+            logger.debug(f'skip {skipped} references without identifier')
+
+        cur.executemany(
+            f"""
+            INSERT INTO {self.citation_table} (source_id, ref_id, target_id) VALUES (?, ?, ?)
+            ON CONFLICT (source_id, ref_id) DO UPDATE SET target_id = excluded.target_id
+            """,
+            edges
+        )
+
+    def add_reference(self, ref_data: Reference, source: str = '') -> None:
+        data = self.flatten_reference(ref_data, source)
+
         if len(data) > 0:
-            cur.executemany(f"INSERT INTO {self.table_name} VALUES(?, ?, ?, ?, ?, ?)", data)
-            self._conn.commit()
+            cur = self._conn.cursor()
+            with self.transaction():
+                self.__insert_rows(cur, data)
+            cur.close()
+
+    def buffer_reference(self, ref_data: Reference, source: str) -> None:
+        """
+        缓存一个来源文件的引用，积累batch_size个文件后一并提交。
 
+        引用和每个文件的检查点在同一个事务中提交，中断后通过loaded_sources可以准确得知哪些文件已经保存。
+
+        :param ref_data: 文献的引用信息
+        :param source: 来源文件标识，作为检查点的键
+        """
+        self._buffer.extend(self.flatten_reference(ref_data, source))
+        self._buffer_sources.append(source)
+
+        if len(self._buffer_sources) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if len(self._buffer_sources) == 0:
+            return
+
+        now_time = datetime.now().timestamp()
+        cur = self._conn.cursor()
+        with self.transaction():
+            self.__insert_rows(cur, self._buffer)
+            cur.executemany(
+                f"""
+                INSERT INTO {self.checkpoint_table} (source, update_time) VALUES (?, ?)
+                ON CONFLICT (source) DO UPDATE SET update_time = excluded.update_time
+                """,
+                [(source, now_time) for source in self._buffer_sources]
+            )
+        cur.close()
+
+        logger.debug(f'commit references of {len(self._buffer_sources)} files')
+        self._buffer.clear()
+        self._buffer_sources.clear()
+
+    def loaded_sources(self) -> set[str]:
+        """
+        :return: 引用已经提交的来源文件标识
+        """
+        cur = self._conn.cursor()
+        cur.execute(f"SELECT source FROM {self.checkpoint_table}")
+        results = cur.fetchall()
         cur.close()
 
+        return {result[0] for result in results}
+
+
+class _TTLCache:
+    def __init__(self, ttl: float) -> None:
+        self.ttl = ttl
+        self._data: dict[tuple, tuple[float, Any]] = {}
+
+    def get(self, key: tuple) -> Any:
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expire, value = item
+        if expire < time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key: tuple, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+
+    def invalidate(self, namespace: str) -> None:
+        for key in [k for k in self._data if k[0] == namespace]:
+            del self._data[key]
+
+
+class _SharedConnection:
+    def __init__(self, connection_string: str, cache_ttl: float) -> None:
+        """
+        每个数据库文件一个sqlite连接，由进程内所有的store共享。
+
+        :param connection_string: sqlite数据库路径
+        :param cache_ttl: 查询缓存的有效时间(秒)
+        """
+        self.conn = sqlite3.connect(connection_string, check_same_thread=False)
+        self.lock = threading.RLock()
+        self.cache = _TTLCache(cache_ttl)
+        self.migrated = False
+        # 已经建好的表，同一个数据库中可能有多张聊天记录表
+        self.tables: set[str] = set()
+
+
+_PROFILE_POOL: dict[str, _SharedConnection] = {}
+_PROFILE_POOL_LOCK = threading.Lock()
+
+_CHAT_POOL: dict[str, _SharedConnection] = {}
+_CHAT_POOL_LOCK = threading.Lock()
+
+
+def _synchronized(func):
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return func(self, *args, **kwargs)
+
+    return wrapper
+
 
 class ProfileStore:
     def __init__(
             self,
             connection_string: str,
+            cache_ttl: float = PROFILE_CACHE_TTL,
     ) -> None:
         self.connection_string = connection_string
 
-        self._conn = self.__connect()
+        self._pool = self.__connect(cache_ttl)
+        self._conn = self._pool.conn
+        self._lock = self._pool.lock
+        self._cache = self._pool.cache
 
-    def __connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.connection_string, check_same_thread=False)
-        return conn
+        if not self._pool.migrated:
+            self.__migrate()
+
+    def __connect(self, cache_ttl: float) -> _SharedConnection:
+        with _PROFILE_POOL_LOCK:
+            if self.connection_string not in _PROFILE_POOL:
+                _PROFILE_POOL[self.connection_string] = _SharedConnection(self.connection_string, cache_ttl)
+
+            return _PROFILE_POOL[self.connection_string]
+
+    @_synchronized
+    def __migrate(self) -> None:
+        """
+        升级已有数据库的表结构：删除重复的行并建立唯一索引。失败时回滚，下次打开时重试。
+        """
+        if self._pool.migrated:
+            return
+
+        cur = self._conn.cursor()
+        version = cur.execute("PRAGMA user_version").fetchone()[0]
+        tables = {
+            row[0]
+            for row in cur.execute("SELECT name FROM sqlite_master WHERE type='table'").fetchall()
+        }
+
+        if version < PROFILE_SCHEMA_VERSION and {'user', 'project', 'chat_history'} <= tables:
+            try:
+                cur.execute("DELETE FROM user WHERE id NOT IN (SELECT MIN(id) FROM user GROUP BY name)")
+                cur.execute(
+                    "DELETE FROM project WHERE id NOT IN (SELECT MIN(id) FROM project GROUP BY owner, name)"
+                )
+                cur.execute(
+                    "DELETE FROM chat_history WHERE id NOT IN (SELECT MIN(id) FROM chat_history GROUP BY session_id)"
+                )
+                self.__create_indexes(cur)
+                cur.execute(f"PRAGMA user_version = {PROFILE_SCHEMA_VERSION}")
+                self._conn.commit()
+                logger.info(f'Migrate user database to version {PROFILE_SCHEMA_VERSION}')
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                cur.close()
+                # 保持未迁移状态，下次打开该数据库时重试
+                logger.error(f'Error while migrating user database: {e}')
+                return
+
+        cur.close()
+        self._pool.migrated = True
 
+    @staticmethod
+    def __create_indexes(cur: sqlite3.Cursor) -> None:
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_user_name ON user(name)")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_project_owner_name ON project(owner, name)")
+        cur.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_history_session ON chat_history(session_id)")
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_owner_project ON chat_history(owner, project)")
+
+    @_synchronized
     def init_tables(self) -> None:
         cur = self._conn.cursor()
 
@@ -311,8 +842,13 @@ class ProfileStore:
             self._conn.commit()
             logger.info(f'Create table chat_history')
 
+        self.__create_indexes(cur)
+        cur.execute(f"PRAGMA user_version = {PROFILE_SCHEMA_VERSION}")
+        self._conn.commit()
+
         cur.close()
 
+    @_synchronized
     def user_exists(self, name: str) -> bool:
         """
         Check if a user with the given name already exists in the 'user' table.
@@ -320,45 +856,51 @@ class ProfileStore:
         :param name: The name of the user to check.
         :return: True if the user does not exist, False if the user exists.
         """
+        if (cached := self._cache.get(('user', name))) is not None:
+            return cached
+
         cur = self._conn.cursor()
         cur.execute("SELECT id FROM user WHERE name = ?", (name,))
         result = cur.fetchone()
         cur.close()
 
+        self._cache.set(('user', name), result is not None)
         return result is not None
 
+    @_synchronized
     def create_user(self, user: User) -> bool:
         """
         Create a new user in the database.
 
-        This function checks if the 'user' table exists in the database and creates it if it does not.
-        It then checks if a user with the given name already exists. If the user does not exist, it inserts
-        the new user into the 'user' table with a hashed password.
+        The unique index on the user name decides whether the user already exists,
+        so the check and the insert are a single statement.
 
         :param user: An instance of the User class containing the user's details.
         :return: True if the user was successfully created, False if the user already exists.
         """
         cur = self._conn.cursor()
 
-        if not self.user_exists(user.name):
-            hashed_password = generate_password_hash(user.password)
+        hashed_password = generate_password_hash(user.password)
 
-            stmt = """
-            INSERT INTO user (name, passwd, user_group, last_project)
-            VALUES (?, ?, ?, ?)
-            """
-            cur.execute(stmt, (user.name, hashed_password, user.user_group, user.last_project))
-            self._conn.commit()
-            cur.close()
+        stmt = """
+        INSERT INTO user (name, passwd, user_group, last_project)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO NOTHING
+        """
+        cur.execute(stmt, (user.name, hashed_password, user.user_group, user.last_project))
+        self._conn.commit()
+        created = cur.rowcount > 0
+        cur.close()
+        self._cache.invalidate('user')
 
+        if created:
             logger.info(f'Create user {user.name}')
             return True
         else:
-            cur.close()
-
             logger.warning(f'User {user.name} already exist!')
             return False
 
+    @_synchronized
     def valid_user(self, user_name: str, passwd: str) -> tuple[bool, User | None]:
         cur = self._conn.cursor()
         try:
@@ -391,6 +933,7 @@ class ProfileStore:
         finally:
             cur.close()
 
+    @_synchronized
     def get_users(self) -> pd.DataFrame:
         cur = self._conn.cursor()
         try:
@@ -410,13 +953,10 @@ class ProfileStore:
         finally:
             cur.close()
 
+    @_synchronized
     def update_user(self, user: User) -> bool:
         cur = self._conn.cursor()
 
-        if not self.user_exists(user.name):
-            logger.warning(f'User {user.name} does not exist!')
-            return False
-
         stmt = """
             UPDATE user 
             SET user_group = ?, last_project = ? 
@@ -424,11 +964,17 @@ class ProfileStore:
             """
         cur.execute(stmt, (user.user_group, user.last_project, user.name))
         self._conn.commit()
+        updated = cur.rowcount > 0
         cur.close()
 
+        if not updated:
+            logger.warning(f'User {user.name} does not exist!')
+            return False
+
         logger.info(f'Updated user {user.name}')
         return True
 
+    @_synchronized
     def project_exists(self, owner: str, project_name: str) -> bool:
         """
         Check if a project with the given name and owner exists in the 'project' table.
@@ -437,62 +983,71 @@ class ProfileStore:
         :param owner: The owner of the project to check.
         :return: True if the project exists, False otherwise.
         """
-        cur = self._conn.cursor()
-        cur.execute("SELECT id FROM project WHERE name = ? AND owner = ?", (project_name, owner,))
-        result = cur.fetchone()
-        cur.close()
-
-        return result is not None
+        return self.get_project(owner, project_name, silent=True) is not None
 
+    @_synchronized
     def create_project(self, project: Project) -> bool:
         cur = self._conn.cursor()
 
-        if not self.user_exists(project.owner):
-            logger.warning(f'User {project.owner} dose not exits!')
-            return False
-
-        if not self.project_exists(project.owner, project.name):
-            stmt = """
-                INSERT INTO project (name, owner, last_chat, update_time, create_time, time_zone)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """
-            cur.execute(stmt, (
-                project.name,
-                project.owner,
-                project.last_chat,
-                project.update_time,
-                project.create_time,
-                project.time_zone
-            ))
-            self._conn.commit()
-            cur.close()
+        stmt = """
+            INSERT INTO project (name, owner, last_chat, update_time, create_time, time_zone)
+            SELECT ?, ?, ?, ?, ?, ?
+            WHERE EXISTS (SELECT 1 FROM user WHERE name = ?)
+            ON CONFLICT (owner, name) DO NOTHING
+            """
+        cur.execute(stmt, (
+            project.name,
+            project.owner,
+            project.last_chat,
+            project.update_time,
+            project.create_time,
+            project.time_zone,
+            project.owner,
+        ))
+        self._conn.commit()
+        created = cur.rowcount > 0
+        cur.close()
 
+        if created:
+            self._cache.invalidate('project')
             logger.info(f'Create project {project.owner}/{project.name}')
             return True
+        elif not self.user_exists(project.owner):
+            logger.warning(f'User {project.owner} dose not exits!')
+            return False
         else:
-            cur.close()
-
             logger.warning(f'Project {project.owner}/{project.name} already exist!')
             return False
 
+    @_synchronized
     def get_project_list(self, user: str) -> list[Project]:
+        if (cached := self._cache.get(('project', 'list', user))) is not None:
+            return [replace(project) for project in cached]
+
         cur = self._conn.cursor()
 
         try:
             cur.execute("SELECT * FROM project where owner=?", (user,))
             results = cur.fetchall()
 
-            return [
+            project_list = [
                 Project.from_list(result)
                 for result in results
             ]
+            self._cache.set(('project', 'list', user), project_list)
+
+            return [replace(project) for project in project_list]
         except Exception as e:
             logger.error(f"Error occurred while retrieving the user project list: {str(e)}")
             return []
         finally:
             cur.close()
 
-    def get_project(self, owner: str, project_name: str) -> Optional[Project]:
+    @_synchronized
+    def get_project(self, owner: str, project_name: str, silent: bool = False) -> Optional[Project]:
+        if (cached := self._cache.get(('project', owner, project_name))) is not None:
+            return replace(cached)
+
         cur = self._conn.cursor()
 
         try:
@@ -500,8 +1055,10 @@ class ProfileStore:
             result = cur.fetchone()
 
             if result:
-                return Project.from_list(result)
-            else:
+                project = Project.from_list(result)
+                self._cache.set(('project', owner, project_name), project)
+                return replace(project)
+            elif not silent:
                 logger.warning(f'Project {owner}/{project_name} does not exist!')
         except Exception as e:
             logger.error(f"Error occurred while retrieving project {owner}/{project_name}: {str(e)}")
@@ -509,6 +1066,7 @@ class ProfileStore:
         finally:
             cur.close()
 
+    @_synchronized
     def update_project(self, project: Project) -> bool:
         cur = self._conn.cursor()
 
@@ -526,6 +1084,7 @@ class ProfileStore:
                 project.owner,
             ))
             self._conn.commit()
+            self._cache.invalidate('project')
 
             logger.info(f'Update project {project.owner}/{project.name}')
             return True
@@ -535,6 +1094,7 @@ class ProfileStore:
         finally:
             cur.close()
 
+    @_synchronized
     def chat_exists(
             self,
             owner: str,
@@ -551,7 +1111,11 @@ class ProfileStore:
 
         return result is not None
 
+    @_synchronized
     def get_chat_list(self, owner: str, project_name: str) -> dict[str, str]:
+        if (cached := self._cache.get(('chat', owner, project_name))) is not None:
+            return dict(cached)
+
         cur = self._conn.cursor()
 
         try:
@@ -561,34 +1125,29 @@ class ProfileStore:
             )
             results = cur.fetchall()
 
-            return {
+            chat_list = {
                 result[1]: result[2]
                 for result in results
             }
+            self._cache.set(('chat', owner, project_name), chat_list)
+
+            return dict(chat_list)
         except Exception as e:
             logger.error(f"Error occurred while retrieving chat list for {owner}/{project_name}: {str(e)}")
             return {}
         finally:
             cur.close()
 
+    @_synchronized
     def create_chat_history(self, chat_history: ChatHistory):
-        if not self.user_exists(chat_history.owner):
-            logger.warning(f'User {chat_history.owner} does not exits!')
-            return False
-
-        if not self.project_exists(chat_history.owner, chat_history.project):
-            logger.warning(f'Project {chat_history.owner}/{chat_history.project} does not exits!')
-            return False
-
-        if self.chat_exists(chat_history.owner, chat_history.project, chat_history.session_id):
-            logger.warning(f'Chat {chat_history.session_id} already exist!')
-            return False
-
         cur = self._conn.cursor()
         try:
+            # 工程存在即说明用户存在，session_id的唯一索引保证不会重复创建
             stmt = """
                 INSERT INTO chat_history (session_id, description, owner, project, update_time, create_time)
-                VALUES (?, ?, ?, ?, ?, ?)
+                SELECT ?, ?, ?, ?, ?, ?
+                WHERE EXISTS (SELECT 1 FROM project WHERE owner = ? AND name = ?)
+                ON CONFLICT (session_id) DO NOTHING
                 """
             cur.execute(stmt, (
                 chat_history.session_id,
@@ -597,17 +1156,30 @@ class ProfileStore:
                 chat_history.project,
                 chat_history.update_time,
                 chat_history.create_time,
+                chat_history.owner,
+                chat_history.project,
             ))
             self._conn.commit()
-
-            logger.info(f'Create new chat for {chat_history.owner}/{chat_history.project}')
-            return True
+            created = cur.rowcount > 0
         except Exception as e:
             logger.error(f'Error while creating new chat for {chat_history.owner}/{chat_history.project}: {str(e)}')
             return False
         finally:
             cur.close()
 
+        if created:
+            self._cache.invalidate('chat')
+            logger.info(f'Create new chat for {chat_history.owner}/{chat_history.project}')
+            return True
+        elif not self.user_exists(chat_history.owner):
+            logger.warning(f'User {chat_history.owner} does not exits!')
+        elif not self.project_exists(chat_history.owner, chat_history.project):
+            logger.warning(f'Project {chat_history.owner}/{chat_history.project} does not exits!')
+        else:
+            logger.warning(f'Chat {chat_history.session_id} already exist!')
+        return False
+
+    @_synchronized
     def get_chat_history(self, session_id: str) -> Optional[ChatHistory]:
         cur = self._conn.cursor()
 
@@ -625,6 +1197,7 @@ class ProfileStore:
         finally:
             cur.close()
 
+    @_synchronized
     def update_chat_history(self, chat_history: ChatHistory) -> bool:
         cur = self._conn.cursor()
 
@@ -641,6 +1214,7 @@ class ProfileStore:
                 chat_history.session_id,
             ))
             self._conn.commit()
+            self._cache.invalidate('chat')
 
             logger.info(f'Update chat {chat_history.session_id}')
             return True
@@ -650,6 +1224,756 @@ class ProfileStore:
         finally:
             cur.close()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # 连接由进程内所有ProfileStore共享，这里不关闭
+        pass
+
+
+class ChatMessageStore(BaseChatMessageHistory):
+    def __init__(
+            self,
+            session_id: str,
+            connection_string: str,
+            table_name: str = CHAT_HISTORY_DEFAULT_TABLE_NAME,
+    ) -> None:
+        """
+        单个会话的聊天记录，与langchain的SQLChatMessageHistory使用同一张message_store表，已有的记录可以继续使用。
+        同一个数据库文件共用一个连接，通过 (session_id, id) 索引读取，调用方可以只加载最近的一页
+        或者符合token预算的窗口，而不必读取整个会话。
+
+        :param session_id: 会话id
+        :param connection_string: sqlite数据库路径
+        :param table_name: 表名
+        """
+        self.session_id = session_id
+        self.connection_string = connection_string
+        self.table_name = table_name
+
+        self._pool = self.__connect()
+        self._conn = self._pool.conn
+        self._lock = self._pool.lock
+
+        if self.table_name not in self._pool.tables:
+            self.__post_init__()
+
+    def __connect(self) -> _SharedConnection:
+        with _CHAT_POOL_LOCK:
+            if self.connection_string not in _CHAT_POOL:
+                _CHAT_POOL[self.connection_string] = _SharedConnection(self.connection_string, 0)
+
+            return _CHAT_POOL[self.connection_string]
+
+    @_synchronized
+    def __post_init__(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name}
+            (
+                id         INTEGER not null
+                    primary key autoincrement,
+                session_id TEXT,
+                message    TEXT
+            );""")
+        cur.execute(
+            f"CREATE INDEX IF NOT EXISTS idx_{self.table_name}_session ON {self.table_name}(session_id, id)"
+        )
+        self._conn.commit()
+        cur.close()
+
+        self._pool.tables.add(self.table_name)
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return [message for _, message in self.get_messages()]
+
+    @_synchronized
+    def add_message(self, message: BaseMessage) -> None:
+        cur = self._conn.cursor()
+        cur.execute(
+            f"INSERT INTO {self.table_name} (session_id, message) VALUES (?, ?)",
+            (self.session_id, json.dumps(message_to_dict(message), ensure_ascii=False))
+        )
+        self._conn.commit()
+        cur.close()
+
+    @_synchronized
+    def clear(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"DELETE FROM {self.table_name} WHERE session_id = ?", (self.session_id,))
+        self._conn.commit()
+        cur.close()
+
+    @_synchronized
+    def count(self) -> int:
+        cur = self._conn.cursor()
+        cur.execute(f"SELECT COUNT(*) FROM {self.table_name} WHERE session_id = ?", (self.session_id,))
+        result = cur.fetchone()
+        cur.close()
+
+        return result[0]
+
+    @_synchronized
+    def get_messages(
+            self,
+            limit: Optional[int] = None,
+            before_id: Optional[int] = None
+    ) -> List[Tuple[int, BaseMessage]]:
+        """
+        读取会话中最近的消息。
+
+        :param limit: 最多读取的消息数，为None时读取全部
+        :param before_id: 只返回早于该行id的消息，用于向前翻页
+        :return: 按时间顺序排列的 (行id, 消息) 列表
+        """
+        query = f"SELECT id, message FROM {self.table_name} WHERE session_id = ?"
+        params: list[Any] = [self.session_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        cur = self._conn.cursor()
+        cur.execute(query, params)
+        results = cur.fetchall()
+        cur.close()
+
+        return [
+            (_id, messages_from_dict([json.loads(message)])[0])
+            for _id, message in reversed(results)
+        ]
+
+    def get_window(self, max_tokens: int, page_size: int = 20) -> List[BaseMessage]:
+        """
+        返回估算token数不超过预算的最近消息，至少包含最后一条消息。
+
+        :param max_tokens: 窗口的token预算
+        :param page_size: 向前读取时每次查询的行数
+        :return: 按时间顺序排列的消息
+        """
+        window: list[BaseMessage] = []
+        used = 0
+        before_id = None
+        while True:
+            page = self.get_messages(page_size, before_id)
+            if len(page) == 0:
+                break
+
+            for _id, message in reversed(page):
+                tokens = estimate_tokens(message.content)
+                if window and used + tokens > max_tokens:
+                    return list(reversed(window))
+                window.append(message)
+                used += tokens
+
+            before_id = page[0][0]
+
+        return list(reversed(window))
+
+
+def estimate_tokens(content: str | list) -> int:
+    """
+    粗略估算token数：每个中日韩字符计一个token，其他字符每四个计一个token。
+    """
+    if not isinstance(content, str):
+        content = json.dumps(content, ensure_ascii=False)
+
+    cjk = sum(1 for char in content if '\u4e00' <= char <= '\u9fff')
+    return cjk + (len(content) - cjk) // 4 + 1
+
+
+class IngestManifest:
+    def __init__(
+            self,
+            connection_string: str,
+            table_name: str = MANIFEST_DEFAULT_TABLE_NAME,
+    ) -> None:
+        """
+        每个知识库的入库清单，记录每个已入库markdown文件的路径、内容哈希、父文档id和入库状态，
+        InitDatabase据此只处理上次运行之后修改过的文件，并清理上次中断留下的数据。
+
+        :param connection_string: sqlite数据库路径
+        :param table_name: 表名
+        """
+        self.connection_string = connection_string
+        self.table_name = table_name
+
+        self._planned: dict[str, IngestRecord] = {}
+        self._resumed: set[str] = set()
+        self._lock = threading.RLock()
+        self._conn = self.__connect()
+        self.__post_init__()
+
+    def __connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.connection_string, check_same_thread=False)
+        return conn
+
+    def __post_init__(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name}
+            (
+                source       TEXT      not null
+                    primary key,
+                path         TEXT      not null,
+                content_hash TEXT      not null,
+                mtime        REAL      not null,
+                size         INTEGER   not null,
+                status       INTEGER   not null,
+                parent_ids   TEXT      not null,
+                update_time  TIMESTAMP not null
+            );""")
+        self._conn.commit()
+        cur.close()
+
+    def __del__(self):
+        if self._conn:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._conn:
+            self._conn.close()
+
+    @_synchronized
+    def clear(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"DELETE FROM {self.table_name}")
+        self._conn.commit()
+        cur.close()
+
+    @_synchronized
+    def get_records(self) -> dict[str, IngestRecord]:
+        cur = self._conn.cursor()
+        cur.execute(
+            f"SELECT source, path, content_hash, mtime, size, status, parent_ids, update_time FROM {self.table_name}"
+        )
+        results = cur.fetchall()
+        cur.close()
+
+        return {result[0]: IngestRecord.from_list(result) for result in results}
+
+    @staticmethod
+    def file_hash(path: str) -> str:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                sha.update(block)
+
+        return sha.hexdigest()
+
+    def plan(self, files: Sequence[Tuple[str, str]]) -> Tuple[List[Tuple[str, str]], List[IngestRecord]]:
+        """
+        将磁盘上的文件与清单比对。
+
+        大小和修改时间都未变化的文件不再重新计算哈希；哈希与已完成的记录一致的文件被跳过。
+        修改过、上次中断和已删除的文件返回其原有记录，以便先删除旧的子文档。
+
+        :param files: 磁盘上markdown文件的 (文件标识, 路径) 列表
+        :return: 需要入库的文件，以及需要删除子文档的过期记录
+        """
+        records = self.get_records()
+        to_ingest = []
+        stale = []
+        self._planned.clear()
+        self._resumed.clear()
+
+        for source, path in files:
+            stat = os.stat(path)
+            record = records.pop(source, None)
+
+            if (
+                    record is not None
+                    and record.status == IngestStatus.DONE
+                    and record.size == stat.st_size
+                    and record.mtime == stat.st_mtime
+            ):
+                continue
+
+            content_hash = self.file_hash(path)
+            if record is not None and record.status == IngestStatus.DONE and record.content_hash == content_hash:
+                self.__touch(record, stat.st_mtime, stat.st_size)
+                continue
+
+            if record is not None and record.parent_ids:
+                stale.append(record)
+            if record is not None and record.content_hash == content_hash:
+                self._resumed.add(source)
+
+            self._planned[source] = IngestRecord(source, path, content_hash, stat.st_mtime, stat.st_size)
+            to_ingest.append((source, path))
+
+        # 磁盘上已经不存在的文件
+        for record in records.values():
+            if record.parent_ids:
+                stale.append(record)
+            self.remove([record.source])
+
+        return to_ingest, stale
+
+    def resumed_sources(self) -> set[str]:
+        """
+        :return: 本次需要入库的文件中，上次中断且内容没有变化的文件标识
+        """
+        return set(self._resumed)
+
+    @_synchronized
+    def __touch(self, record: IngestRecord, mtime: float, size: int) -> None:
+        cur = self._conn.cursor()
+        cur.execute(
+            f"UPDATE {self.table_name} SET mtime = ?, size = ? WHERE source = ?",
+            (mtime, size, record.source)
+        )
+        self._conn.commit()
+        cur.close()
+
+    @_synchronized
+    def __upsert(self, records: Sequence[IngestRecord]) -> None:
+        now_time = datetime.now().timestamp()
+        cur = self._conn.cursor()
+        cur.executemany(
+            f"""
+            INSERT INTO {self.table_name} 
+                (source, path, content_hash, mtime, size, status, parent_ids, update_time)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (source) DO UPDATE SET 
+                path = excluded.path,
+                content_hash = excluded.content_hash,
+                mtime = excluded.mtime,
+                size = excluded.size,
+                status = excluded.status,
+                parent_ids = excluded.parent_ids,
+                update_time = excluded.update_time
+            """,
+            [
+                (
+                    record.source, record.path, record.content_hash, record.mtime, record.size,
+                    int(record.status), json.dumps(record.parent_ids), now_time
+                )
+                for record in records
+            ]
+        )
+        self._conn.commit()
+        cur.close()
+
+    def __mark(self, parent_ids: dict[str, list[str]], status: IngestStatus) -> None:
+        records = []
+        for source, ids in parent_ids.items():
+            record = self._planned.get(source)
+            if record is None:
+                continue
+            record.status = status
+            record.parent_ids = ids
+            records.append(record)
+
+        self.__upsert(records)
+
+    def begin(self, parent_ids: dict[str, list[str]]) -> None:
+        """
+        记录即将写入的文件的父文档id，中断后可以据此清理。
+
+        :param parent_ids: 文件标识到父文档id列表的映射
+        """
+        self.__mark(parent_ids, IngestStatus.WRITING)
+
+    def commit(self, parent_ids: dict[str, list[str]]) -> None:
+        self.__mark(parent_ids, IngestStatus.DONE)
+
+    def fail(self, parent_ids: dict[str, list[str]]) -> None:
+        self.__mark(parent_ids, IngestStatus.FAILED)
+
+    @_synchronized
+    def remove(self, sources: Sequence[str]) -> None:
+        cur = self._conn.cursor()
+        cur.executemany(f"DELETE FROM {self.table_name} WHERE source = ?", [(source,) for source in sources])
+        self._conn.commit()
+        cur.close()
+
+
+class TeiCache:
+    def __init__(
+            self,
+            connection_string: str,
+            table_name: str = TEI_CACHE_DEFAULT_TABLE_NAME,
+            compress_level: int = 6,
+    ) -> None:
+        """
+        Grobid输出的TEI缓存。以PDF的sha256和Grobid请求参数作为键，内容经zlib压缩后保存，
+        同一PDF再次上传或解析时直接从本地返回，不再请求Grobid服务。
+
+        :param connection_string: sqlite数据库路径
+        :param table_name: 表名
+        :param compress_level: zlib压缩等级
+        """
+        self.connection_string = connection_string
+        self.table_name = table_name
+        self.compress_level = compress_level
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.RLock()
+        self._conn = self.__connect()
+        self.__post_init__()
+
+    def __connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.connection_string, check_same_thread=False)
+        # 多个上传会话和解析任务可能共用同一个缓存
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def __post_init__(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name}
+            (
+                cache_key    TEXT      not null
+                    primary key,
+                pdf_hash     TEXT      not null,
+                options      TEXT      not null,
+                tei          BLOB      not null,
+                size         INTEGER   not null,
+                create_time  TIMESTAMP not null
+            );""")
+        self._conn.commit()
+        cur.close()
+
+    def __del__(self):
+        if self._conn:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._conn:
+            self._conn.close()
+
+    @staticmethod
+    def pdf_hash(path: str) -> str:
+        return IngestManifest.file_hash(path)
+
+    @staticmethod
+    def options_key(options: dict[str, Any]) -> str:
+        return json.dumps(options, sort_keys=True, ensure_ascii=False, default=str)
+
+    def cache_key(self, pdf_hash: str, options: dict[str, Any]) -> str:
+        """
+        生成使用指定请求参数解析某个PDF时的缓存键。
+
+        :param pdf_hash: PDF文件的sha256，见IngestManifest.file_hash
+        :param options: Grobid服务名和表单参数，包括consolidate选项和coordinates
+        :return: 缓存键
+        """
+        return hashlib.sha256(f'{pdf_hash}|{self.options_key(options)}'.encode('utf-8')).hexdigest()
+
+    @_synchronized
+    def get(self, cache_key: str) -> Optional[str]:
+        cur = self._conn.cursor()
+        cur.execute(f"SELECT tei FROM {self.table_name} WHERE cache_key = ?", (cache_key,))
+        result = cur.fetchone()
+        cur.close()
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return zlib.decompress(result[0]).decode('utf-8')
+
+    @_synchronized
+    def set(self, cache_key: str, pdf_hash: str, options: dict[str, Any], tei: str) -> None:
+        data = tei.encode('utf-8')
+        cur = self._conn.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO {self.table_name} (cache_key, pdf_hash, options, tei, size, create_time)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET tei = excluded.tei, size = excluded.size,
+                create_time = excluded.create_time
+            """,
+            (
+                cache_key,
+                pdf_hash,
+                self.options_key(options),
+                zlib.compress(data, self.compress_level),
+                len(data),
+                datetime.now()
+            )
+        )
+        self._conn.commit()
+        cur.close()
+
+    @_synchronized
+    def clear(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"DELETE FROM {self.table_name}")
+        self._conn.commit()
+        cur.close()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def __str__(self) -> str:
+        return f'[tei cache] hits: {self.hits}, misses: {self.misses}, hit rate: {self.hit_rate:.2%}'
+
+
+@dataclass
+class CachedResponse:
+    url: str
+    status: int
+    headers: dict[str, str]
+    body: bytes
+    fetched_at: float
+    expires_at: float
+
+    @property
+    def fresh(self) -> bool:
+        return time.time() < self.expires_at
+
+    def validators(self) -> dict[str, str]:
+        """
+        生成条件请求头，内容未变化时服务器可以直接返回304。
+        """
+        headers = {}
+        lowered = {key.lower(): value for key, value in self.headers.items()}
+        if etag := lowered.get('etag'):
+            headers['If-None-Match'] = etag
+        if last_modified := lowered.get('last-modified'):
+            headers['If-Modified-Since'] = last_modified
+
+        return headers
+
+
+class HttpResponseCache:
+    def __init__(
+            self,
+            connection_string: str,
+            table_name: str = HTTP_CACHE_DEFAULT_TABLE_NAME,
+            compress_level: int = 6,
+    ) -> None:
+        """
+        保存在磁盘上的HTTP响应缓存。以规范化后的请求作为键(见utils.HttpUtil.CachingAdapter)，
+        响应内容经zlib压缩后保存。每条缓存有各自的过期时间，过期后保留ETag等校验信息，
+        可以向服务器确认内容是否变化，而不必重新下载。
+
+        :param connection_string: sqlite数据库路径
+        :param table_name: 表名
+        :param compress_level: zlib压缩等级
+        """
+        self.connection_string = connection_string
+        self.table_name = table_name
+        self.compress_level = compress_level
+
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+
+        self._lock = threading.RLock()
+        self._conn = self.__connect()
+        self.__post_init__()
+
+    def __connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.connection_string, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def __post_init__(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name}
+            (
+                cache_key    TEXT      not null
+                    primary key,
+                url          TEXT      not null,
+                status       INTEGER   not null,
+                headers      TEXT      not null,
+                body         BLOB      not null,
+                fetched_at   REAL      not null,
+                expires_at   REAL      not null
+            );""")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table_name}_expires ON {self.table_name} (expires_at)")
+        self._conn.commit()
+        cur.close()
+
+    def __del__(self):
+        if self._conn:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self._conn:
+            self._conn.close()
+
+    @_synchronized
+    def get(self, cache_key: str) -> Optional[CachedResponse]:
+        """
+        查询缓存的响应，无论是否过期。未过期的计为命中，不存在或已过期的计为未命中。
+
+        :param cache_key: 规范化后的请求键
+        :return: 缓存的响应，从未缓存过时返回None
+        """
+        cur = self._conn.cursor()
+        cur.execute(
+            f"SELECT url, status, headers, body, fetched_at, expires_at FROM {self.table_name} WHERE cache_key = ?",
+            (cache_key,)
+        )
+        result = cur.fetchone()
+        cur.close()
+
+        if result is None:
+            self.misses += 1
+            return None
+
+        url, status, headers, body, fetched_at, expires_at = result
+        entry = CachedResponse(url, status, json.loads(headers), zlib.decompress(body), fetched_at, expires_at)
+        if entry.fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+        return entry
+
+    @_synchronized
+    def set(self, cache_key: str, url: str, status: int, headers: dict[str, str], body: bytes, ttl: float) -> None:
+        """
+        保存响应，已存在时覆盖。
+
+        :param cache_key: 规范化后的请求键
+        :param url: 请求地址
+        :param status: 状态码
+        :param headers: 响应头
+        :param body: 响应内容
+        :param ttl: 有效时间(秒)
+        """
+        now = time.time()
+        cur = self._conn.cursor()
+        cur.execute(
+            f"""
+            INSERT INTO {self.table_name} (cache_key, url, status, headers, body, fetched_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(cache_key) DO UPDATE SET url = excluded.url, status = excluded.status,
+                headers = excluded.headers, body = excluded.body,
+                fetched_at = excluded.fetched_at, expires_at = excluded.expires_at
+            """,
+            (cache_key, url, status, json.dumps(headers), zlib.compress(body, self.compress_level), now, now + ttl)
+        )
+        self._conn.commit()
+        cur.close()
+
+    @_synchronized
+    def touch(self, cache_key: str, ttl: float) -> None:
+        """
+        服务器确认内容未变化(304)后延长缓存的有效时间。
+
+        :param cache_key: 规范化后的请求键
+        :param ttl: 有效时间(秒)
+        """
+        now = time.time()
+        cur = self._conn.cursor()
+        cur.execute(
+            f"UPDATE {self.table_name} SET fetched_at = ?, expires_at = ? WHERE cache_key = ?",
+            (now, now + ttl, cache_key)
+        )
+        self._conn.commit()
+        cur.close()
+        self.revalidated += 1
+
+    @_synchronized
+    def purge(self, older_than: float = 0) -> int:
+        """
+        删除过期超过older_than秒的缓存。
+
+        :param older_than: 过期后保留的时间(秒)
+        :return: 删除的条数
+        """
+        cur = self._conn.cursor()
+        cur.execute(f"DELETE FROM {self.table_name} WHERE expires_at < ?", (time.time() - older_than,))
+        count = cur.rowcount
+        self._conn.commit()
+        cur.close()
+
+        return count
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.
+
+    def __str__(self) -> str:
+        return f'[http cache] hits: {self.hits}, misses: {self.misses}, ' \
+               f'revalidated: {self.revalidated}, hit rate: {self.hit_rate:.2%}'
+
+
+class JobStore:
+    def __init__(
+            self,
+            connection_string: str,
+            job: str,
+            table_name: str = JOB_DEFAULT_TABLE_NAME,
+    ) -> None:
+        """
+        记录针对CSV文件逐行处理的批量任务的进度，例如下载或转换PMC ID列表中的文献。
+        每个条目以(job, key)为主键保存一行，每次状态变化单独提交，任务中断时最多丢失正在处理的条目，
+        下次运行从pending()继续。CSV文件只在compact()时重写。
+
+        :param connection_string: sqlite数据库路径，见journal_path
+        :param job: 任务名，同一个CSV文件上的不同任务分别记录
+        :param table_name: 表名
+        """
+        self.connection_string = connection_string
+        self.job = job
+        self.table_name = table_name
+
+        self._lock = threading.RLock()
+        self._conn = self.__connect()
+        self.__post_init__()
+
+    @staticmethod
+    def journal_path(csv_file: str) -> str:
+        """
+        与CSV文件放在同一目录下的任务数据库，该文件上的所有任务共用。
+
+        :param csv_file: CSV文件路径
+        :return: 数据库路径
+        """
+        return f'{os.path.splitext(csv_file)[0]}.jobs.db'
+
+    def __connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.connection_string, check_same_thread=False)
+        # WAL模式下每次提交只是追加少量内容，崩溃时不会留下写了一半的表
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def __post_init__(self) -> None:
+        cur = self._conn.cursor()
+        cur.execute(f"""
+            CREATE TABLE IF NOT EXISTS {self.table_name}
+            (
+                job          TEXT      not null,
+                key          TEXT      not null,
+                status       INTEGER   not null,
+                data         TEXT      not null,
+                error        TEXT,
+                update_time  TIMESTAMP not null,
+                primary key (job, key)
+            );""")
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {self.table_name}_status ON {self.table_name} (job, status)")
+        self._conn.commit()
+        cur.close()
+
     def __del__(self):
         if self._conn:
             self._conn.close()
@@ -661,6 +1985,155 @@ class ProfileStore:
         if self._conn:
             self._conn.close()
 
+    @_synchronized
+    def seed(self, keys: Iterable[Any]) -> int:
+        """
+        将条目添加为待处理状态，已存在的条目保留原有的状态和数据。
+
+        :param keys: 条目的键，例如需要处理的行的PMC ID
+        :return: 新增的条目数
+        """
+        now_time = datetime.now().timestamp()
+        cur = self._conn.cursor()
+        before = self._conn.total_changes
+        cur.executemany(
+            f"""
+            INSERT OR IGNORE INTO {self.table_name} (job, key, status, data, error, update_time)
+            VALUES (?, ?, ?, '{{}}', NULL, ?)
+            """,
+            [(self.job, str(key), int(JobStatus.PENDING), now_time) for key in keys]
+        )
+        self._conn.commit()
+        cur.close()
+
+        return self._conn.total_changes - before
+
+    @_synchronized
+    def update(self, key: Any, status: JobStatus, error: str = '', **data: Any) -> None:
+        """
+        记录一个条目的处理结果。data与之前记录的值合并，compact()时写回CSV文件中的同名列。
+
+        :param key: 条目的键
+        :param status: 状态
+        :param error: 错误信息
+        :param data: 需要写回CSV文件的值
+        """
+        cur = self._conn.cursor()
+        cur.execute(
+            f"SELECT data FROM {self.table_name} WHERE job = ? AND key = ?",
+            (self.job, str(key))
+        )
+        result = cur.fetchone()
+        values = {**json.loads(result[0]), **data} if result else data
+
+        cur.execute(
+            f"""
+            INSERT INTO {self.table_name} (job, key, status, data, error, update_time)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (job, key) DO UPDATE SET
+                status = excluded.status,
+                data = excluded.data,
+                error = excluded.error,
+                update_time = excluded.update_time
+            """,
+            (
+                self.job, str(key), int(status), json.dumps(values, ensure_ascii=False, default=str),
+                error or None, datetime.now().timestamp()
+            )
+        )
+        self._conn.commit()
+        cur.close()
+
+    def done(self, key: Any, **data: Any) -> None:
+        self.update(key, JobStatus.DONE, **data)
+
+    def skip(self, key: Any, **data: Any) -> None:
+        self.update(key, JobStatus.SKIP, **data)
+
+    def fail(self, key: Any, error: str) -> None:
+        self.update(key, JobStatus.FAILED, error=error)
+
+    @_synchronized
+    def records(self, statuses: Sequence[JobStatus] = None) -> list[JobRecord]:
+        cur = self._conn.cursor()
+        sql = f"SELECT key, status, data, error, update_time FROM {self.table_name} WHERE job = ?"
+        params = [self.job]
+        if statuses is not None:
+            sql += f" AND status IN ({', '.join('?' * len(statuses))})"
+            params += [int(status) for status in statuses]
+        cur.execute(sql + " ORDER BY rowid", params)
+        results = cur.fetchall()
+        cur.close()
+
+        return [JobRecord.from_list(result) for result in results]
+
+    def pending(self, retry_failed: bool = True) -> list[JobRecord]:
+        """
+        按添加顺序返回仍需处理的条目。
+
+        :param retry_failed: 是否包含失败的条目
+        :return: 条目列表
+        """
+        statuses = [JobStatus.PENDING, JobStatus.FAILED] if retry_failed else [JobStatus.PENDING]
+        return self.records(statuses)
+
+    @_synchronized
+    def counts(self) -> dict[str, int]:
+        cur = self._conn.cursor()
+        cur.execute(f"SELECT status, count(*) FROM {self.table_name} WHERE job = ? GROUP BY status", (self.job,))
+        results = cur.fetchall()
+        cur.close()
+
+        return {JobStatus(status).name.lower(): count for status, count in results}
+
+    @_synchronized
+    def clear(self, all_jobs: bool = False) -> None:
+        """
+        清除该任务的进度。
+
+        :param all_jobs: 为True时清除同一CSV文件上所有任务的进度
+        """
+        cur = self._conn.cursor()
+        if all_jobs:
+            cur.execute(f"DELETE FROM {self.table_name}")
+        else:
+            cur.execute(f"DELETE FROM {self.table_name} WHERE job = ?", (self.job,))
+        self._conn.commit()
+        cur.close()
+
+    def compact(self, csv_file: str, key_column: str) -> int:
+        """
+        将记录的值写回CSV文件：每个条目通过update()记录的值覆盖key_column匹配的行中的同名列。
+        先写入临时文件再替换原文件，读取方和崩溃时都不会看到写了一半的CSV。
+
+        :param csv_file: 任务对应的CSV文件
+        :param key_column: 保存条目键的列
+        :return: 更新的行数
+        """
+        df = pd.read_csv(csv_file, encoding='utf-8', dtype=str)
+        records = [record for record in self.records() if record.data]
+
+        updated = pd.Series(False, index=df.index)
+        if records:
+            values = pd.DataFrame([{key_column: record.key, **record.data} for record in records])
+            keys = df[key_column].astype(str)
+            for column in values.columns.drop(key_column):
+                mapping = values.dropna(subset=[column]).drop_duplicates(key_column, keep='last') \
+                    .set_index(key_column)[column]
+                hit = keys.isin(mapping.index)
+                if column not in df.columns:
+                    df[column] = pd.NA
+                df[column] = df[column].astype(object)
+                df.loc[hit, column] = keys[hit].map(mapping)
+                updated |= hit
+
+        tmp_file = f'{csv_file}.tmp'
+        df.to_csv(tmp_file, index=False, encoding='utf-8')
+        os.replace(tmp_file, csv_file)
+        logger.info(f'compact {int(updated.sum())} rows of job {self.job} into {csv_file}')
+
+        return int(updated.sum())
+
 
 SqliteDocStore = SqliteBaseStore[Document]
 
@@ -1,7 +1,7 @@
 from uicomponent.StatusBus import *
 from utils.entities.UserProfile import UserGroup
 
-config = get_config()
+config = load_config()
 
 
 def side_bar_links():
@@ -62,3 +62,24 @@ def score_text(score: float) -> str:
                 f'border-radius: 10px; font-size: 10px; font-family: Arial, sans-serif;">{round(score, 4)}</span>')
 
     return html_str
+
+
+def highlight_text(text: str, spans: list[tuple[int, int]]) -> str:
+    """
+    按照有序且互不重叠的字符区间，一次遍历拼接出高亮后的markdown文本。
+
+    :param text: 原文
+    :param spans: (start, end) 列表
+    :return: 高亮后的文本
+    """
+    segments = []
+    cursor = 0
+    for start, end in spans:
+        if start < cursor or end > len(text):
+            continue
+        segments.append(text[cursor:start])
+        segments.append(f' :orange[{text[start:end]}]')
+        cursor = end
+    segments.append(text[cursor:])
+
+    return ''.join(segments)
@@ -1,6 +1,6 @@
 import streamlit as st
 
-from Config import Config
+from Config import Config, load_config
 from storage.SqliteStore import ProfileStore
 from utils.entities.UserProfile import User, UserGroup
 
@@ -51,10 +51,28 @@ def set_owner_enable():
 
 
 def get_config() -> Config:
-    if 'config' not in st.session_state:
-        st.session_state['config'] = Config()
+    """
+    获取会话级配置。配置文件只在进程内读取一次，各会话共用同一份快照，会话中只保存知识库的选择和可见性；
+    快照重新加载后保留会话当前的选择。
+    """
+    snapshot = load_config()
+    config: Config | None = st.session_state.get('config')
+
+    # 会话配置与快照共用yml，不是同一个对象说明快照已经重新加载
+    if config is None or config.yml is not snapshot.yml:
+        session_config = snapshot.overlay()
+        if config is not None:
+            milvus_cfg = session_config.milvus_config
+            milvus_cfg.set_group_visibility(config.milvus_config.visible)
+
+            names = [collection.collection_name for collection in milvus_cfg.collections]
+            selected = config.milvus_config.get_collection().collection_name
+            if selected in names:
+                milvus_cfg.default_collection = names.index(selected)
+
+        st.session_state['config'] = session_config
+        config = session_config
 
-    config: Config = st.session_state.get('config')
     return config
 
 
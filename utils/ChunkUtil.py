@@ -0,0 +1,111 @@
+import hashlib
+import uuid
+from collections import defaultdict
+from typing import Tuple
+
+from langchain_core.documents import Document
+from langchain_text_splitters import TextSplitter
+
+CHUNK_NAMESPACE = uuid.UUID('5b2f3c1e-8d4a-4f6b-9c7e-2a1d0e9f8b36')
+
+SECTION_KEYS = ('title', 'section', 'subtitle')
+
+
+def content_hash(text: str) -> str:
+    """
+    计算文本内容的哈希值。
+
+    :param text: 文本
+    :return: sha256十六进制字符串
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def paper_key(docs: list[Document]) -> str:
+    """
+    获取文献的唯一标识，优先使用DOI，没有DOI时使用全文内容的哈希值。
+
+    :param docs: 同一篇文献切分出的文档
+    :return: 文献标识
+    """
+    for doc in docs:
+        if doi := doc.metadata.get('doi'):
+            return f'doi:{doi}'
+
+    return f'sha256:{content_hash("".join(doc.page_content for doc in docs))}'
+
+
+def chunk_id(*parts: str | int) -> str:
+    """
+    由各组成部分生成确定性的uuid，相同输入总是得到相同的id。
+
+    :param parts: id的组成部分
+    :return: uuid字符串
+    """
+    return str(uuid.uuid5(CHUNK_NAMESPACE, '|'.join(str(part) for part in parts)))
+
+
+def set_offset(doc: Document, source_text: str, cursor: int = 0) -> int:
+    """
+    记录文档在来源文本中的字符区间，写入start_index与end_index元数据。
+    切分结果按顺序出现在来源文本中，从上一个块的末尾开始查找即可。
+
+    :param doc: 切分得到的文档
+    :param source_text: 被切分的文本
+    :param cursor: 开始查找的位置
+    :return: 下一次查找的位置
+    """
+    start = source_text.find(doc.page_content, cursor)
+    if start < 0:
+        doc.metadata['start_index'] = -1
+        doc.metadata['end_index'] = -1
+        return cursor
+
+    end = start + len(doc.page_content)
+    doc.metadata['start_index'] = start
+    doc.metadata['end_index'] = end
+    return end
+
+
+def split_with_ids(
+        docs: list[Document],
+        parent_splitter: TextSplitter,
+        child_splitter: TextSplitter,
+        id_key: str = 'doc_id',
+        key: str = None,
+) -> Tuple[list[Tuple[str, Document]], list[Document]]:
+    """
+    切分父文档和子文档，并根据(文献标识, 章节路径, 序号, 内容哈希)生成确定性的id。
+    同一篇文献重复入库时得到相同的id，写入时覆盖即可，不会产生重复数据。
+
+    :param docs: 同一篇文献按标题切分后的文档
+    :param parent_splitter: 父文档切分器
+    :param child_splitter: 子文档切分器
+    :param id_key: 子文档中指向父文档的元数据字段
+    :param key: 文献标识，为空时由paper_key生成
+    :return: (父文档id, 父文档) 列表和子文档列表。子文档的chunk_id元数据为其自身id；
+        父文档的start_index/end_index为其在章节中的位置，子文档的为其在父文档中的位置
+    """
+    key = key or paper_key(docs)
+    ordinals = defaultdict(int)
+
+    parents = []
+    children = []
+    for section in docs:
+        section_cursor = 0
+        for doc in parent_splitter.split_documents([section]):
+            section_cursor = set_offset(doc, section.page_content, section_cursor)
+            section_path = '/'.join(str(doc.metadata.get(section_key, '')) for section_key in SECTION_KEYS)
+            ordinal = ordinals[section_path]
+            ordinals[section_path] += 1
+
+            _id = chunk_id(key, section_path, ordinal, content_hash(doc.page_content))
+            cursor = 0
+            for index, sub_doc in enumerate(child_splitter.split_documents([doc])):
+                cursor = set_offset(sub_doc, doc.page_content, cursor)
+                sub_doc.metadata[id_key] = _id
+                sub_doc.metadata['chunk_id'] = chunk_id(_id, index, content_hash(sub_doc.page_content))
+                children.append(sub_doc)
+            parents.append((_id, doc))
+
+    return parents, children
@@ -0,0 +1,215 @@
+import os
+import time
+import traceback
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, Future, FIRST_COMPLETED, wait
+from dataclasses import dataclass, asdict
+from enum import StrEnum
+from itertools import islice
+from typing import Callable, Iterable, Sequence
+
+import pandas as pd
+from loguru import logger
+from tqdm import tqdm
+
+from utils.GrobidUtil import parse_xml
+from utils.MarkdownPraser import save_to_md
+from utils.PMCUtil import parse_paper_data
+
+
+class XmlFormat(StrEnum):
+    GROBID = 'grobid'
+    PMC = 'pmc'
+
+
+class ConvertStatus(StrEnum):
+    DONE = 'done'
+    SKIP = 'skip'
+    NOT_EXIST = 'not exist'
+    FAILED = 'failed'
+
+
+@dataclass
+class ConvertTask:
+    """
+    单个xml文件的转换任务。
+
+    :param key: 任务标识，用于将结果对应回调用方的数据，例如DataFrame的行索引
+    :param xml_path: xml文件路径
+    :param xml_format: GROBID 为Grobid输出的TEI，PMC 为PMC的JATS
+    :param md_file: 输出的markdown文件；为空时按照文献的年份和DOI保存到md_root下
+    :param md_root: md_file为空时的输出根目录
+    :param xml_text: xml内容，不为空时直接解析，xml_path只用于记录来源，例如压缩包中的文件
+    """
+    key: int | str
+    xml_path: str
+    xml_format: XmlFormat
+    md_file: str | None = None
+    md_root: str | None = None
+    xml_text: str | None = None
+
+
+@dataclass
+class ConvertResult:
+    key: int | str
+    xml_path: str
+    status: ConvertStatus
+    md_file: str | None = None
+    doi: str | None = None
+    year: int | None = None
+    error: str | None = None
+    seconds: float = 0.
+
+
+def _default_md_file(task: ConvertTask, year: int, doi: str) -> str:
+    filename = f"{doi.replace('/', '@')}.md" if doi else os.path.splitext(os.path.basename(task.xml_path))[0] + '.md'
+    year_folder = str(year) if year else 'unknown'
+
+    return os.path.join(task.md_root, year_folder, filename)
+
+
+def convert_file(task: ConvertTask) -> ConvertResult:
+    """
+    解析xml文件并保存为markdown，在子进程中运行。异常被记录到结果中，不会中断其他文件的转换。
+
+    :param task: 转换任务
+    :return: 转换结果
+    """
+    start = time.perf_counter()
+    result = ConvertResult(task.key, task.xml_path, ConvertStatus.FAILED)
+
+    try:
+        if task.xml_text is None and not os.path.exists(task.xml_path):
+            result.status = ConvertStatus.NOT_EXIST
+            return result
+
+        match task.xml_format:
+            case XmlFormat.GROBID:
+                paper = parse_xml(task.xml_path, xml_text=task.xml_text)
+            case XmlFormat.PMC:
+                if task.xml_text is None:
+                    with open(task.xml_path, 'r', encoding='utf-8') as f:
+                        flag, paper = parse_paper_data(f.read())
+                else:
+                    flag, paper = parse_paper_data(task.xml_text)
+                if not flag:
+                    result.status = ConvertStatus.SKIP
+                    return result
+            case _:
+                raise ValueError(f'unknown xml format {task.xml_format}')
+
+        result.doi = paper.info.doi
+        result.year = paper.info.year
+        md_file = task.md_file or _default_md_file(task, paper.info.year, paper.info.doi)
+
+        os.makedirs(os.path.dirname(md_file), exist_ok=True)
+        save_to_md(paper, md_file)
+
+        result.md_file = md_file
+        result.status = ConvertStatus.DONE
+    except Exception as e:
+        result.error = f'{type(e).__name__}: {e}\n{traceback.format_exc(limit=3)}'
+    finally:
+        result.seconds = time.perf_counter() - start
+
+    return result
+
+
+def convert_files(
+        tasks: Sequence[ConvertTask],
+        max_workers: int = None,
+        chunksize: int = 16,
+        desc: str = 'xml to markdown',
+        on_result: Callable[[ConvertResult], None] = None
+) -> list[ConvertResult]:
+    """
+    使用进程池将xml文件批量转换为markdown。任务按块提交以减少进程间通信，结果按照提交顺序返回。
+
+    :param tasks: 转换任务
+    :param max_workers: 进程数，默认为CPU核数
+    :param chunksize: 每次提交给子进程的任务数
+    :param desc: 进度条描述
+    :param on_result: 每个文件转换完成后在主进程中调用，例如记录任务进度
+    :return: 与tasks一一对应的转换结果，失败的文件记录在结果中
+    """
+    if len(tasks) == 0:
+        return []
+
+    results = []
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for result in tqdm(executor.map(convert_file, tasks, chunksize=chunksize), total=len(tasks), desc=desc):
+            if result.status == ConvertStatus.FAILED:
+                logger.error(f'{result.xml_path} {result.error.splitlines()[0]}')
+            if on_result is not None:
+                on_result(result)
+            results.append(result)
+
+    counts = pd.Series([result.status for result in results]).value_counts().to_dict()
+    logger.info(f'convert {len(tasks)} files: {counts}')
+
+    return results
+
+
+def convert_batch(tasks: Sequence[ConvertTask]) -> list[ConvertResult]:
+    return [convert_file(task) for task in tasks]
+
+
+def convert_stream(
+        tasks: Iterable[ConvertTask],
+        max_workers: int = None,
+        batch_size: int = 16,
+        max_pending: int = None,
+        desc: str = 'xml to markdown',
+        on_result: Callable[[ConvertResult], None] = None
+) -> dict[ConvertStatus, int]:
+    """
+    使用进程池转换任务流，任务可以由生成器逐个产生，例如从压缩包中顺序读取的xml。
+    任务按批提交，同时在处理中的批次数量有上限，内存占用与任务总数无关。结果按照完成顺序交给on_result。
+
+    :param tasks: 转换任务，可以是生成器
+    :param max_workers: 进程数，默认为CPU核数
+    :param batch_size: 每次提交给子进程的任务数
+    :param max_pending: 同时在处理中的批次数，默认为进程数的两倍
+    :param desc: 进度条描述
+    :param on_result: 每个文件转换完成后在主进程中调用
+    :return: 各状态的文件数
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    max_pending = max_pending or max_workers * 2
+    counts = Counter()
+
+    def collect(done: set[Future]) -> None:
+        for future in done:
+            for result in future.result():
+                if result.status == ConvertStatus.FAILED:
+                    logger.error(f'{result.xml_path} {result.error.splitlines()[0]}')
+                if on_result is not None:
+                    on_result(result)
+                counts[result.status] += 1
+                progress.update()
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, tqdm(desc=desc) as progress:
+        pending = set()
+        iterator = iter(tasks)
+        while batch := list(islice(iterator, batch_size)):
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(convert_batch, batch))
+
+        collect(wait(pending).done)
+
+    logger.info(f'convert {sum(counts.values())} files: { {str(status): n for status, n in counts.items()} }')
+
+    return dict(counts)
+
+
+def results_table(results: Sequence[ConvertResult]) -> pd.DataFrame:
+    """
+    将转换结果整理为表格，以任务标识为索引。
+
+    :param results: 转换结果
+    :return: DataFrame
+    """
+    return pd.DataFrame([asdict(result) for result in results], columns=list(ConvertResult.__dataclass_fields__))\
+        .set_index('key')
@@ -0,0 +1,173 @@
+import re
+import zlib
+from functools import lru_cache
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+DEFAULT_BOILERPLATE = (
+    r'all rights reserved',
+    r'creative commons attribution',
+    r'the authors declare (that they have )?no (known )?(competing|conflicts? of) interests?',
+)
+
+
+def normalize_text(text: str) -> str:
+    """
+    统一大小写并合并空白字符，避免排版差异影响相似度。
+
+    :param text: 原始文本
+    :return: 规范化后的文本
+    """
+    return ' '.join(text.lower().split())
+
+
+def shingles(text: str, size: int = 5) -> set[str]:
+    """
+    将文本切分为字符级n-gram集合，同时适用于中文和英文。
+
+    :param text: 规范化后的文本
+    :param size: n-gram长度
+    :return: n-gram集合，文本短于size时返回整个文本
+    """
+    if len(text) <= size:
+        return {text}
+
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = 128, shingle_size: int = 5, seed: int = 1):
+        """
+        使用 (a * x + b) mod p 形式的哈希函数族计算MinHash签名。
+
+        :param num_perm: 签名长度
+        :param shingle_size: n-gram长度
+        :param seed: 随机种子，相同的种子生成相同的签名，以便在多个进程中计算
+        """
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+
+        generator = np.random.RandomState(seed)
+        self.a = generator.randint(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+        self.b = generator.randint(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray:
+        grams = shingles(normalize_text(text), self.shingle_size)
+        hashes = np.fromiter(
+            (zlib.crc32(gram.encode('utf-8')) for gram in grams),
+            dtype=np.uint64,
+            count=len(grams)
+        )
+        permuted = (hashes[:, None] * self.a + self.b) % MERSENNE_PRIME & MAX_HASH
+
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def signatures(self, texts: Sequence[str]) -> np.ndarray:
+        if len(texts) == 0:
+            return np.empty((0, self.num_perm), dtype=np.uint32)
+
+        return np.stack([self.signature(text) for text in texts])
+
+
+@lru_cache(maxsize=4)
+def get_minhasher(num_perm: int = 128, shingle_size: int = 5) -> MinHasher:
+    return MinHasher(num_perm, shingle_size)
+
+
+def optimal_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    选择LSH的分段数和每段行数，使 (1/b)^(1/r) 最接近相似度阈值。
+
+    :param threshold: Jaccard相似度阈值
+    :param num_perm: 签名长度
+    :return: (分段数, 每段行数)
+    """
+    candidates = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(candidates, key=lambda pair: abs((1 / pair[0]) ** (1 / pair[1]) - threshold))
+
+
+class NearDuplicateFilter:
+    def __init__(
+            self,
+            threshold: Optional[float] = None,
+            num_perm: int = 128,
+            boilerplate: Optional[Sequence[str]] = DEFAULT_BOILERPLATE,
+    ):
+        """
+        子文档过滤器。匹配到样板文字(版权声明、利益冲突声明等)的文本会被丢弃；指定threshold时，
+        基于MinHash与LSH，与已保留文本的估计Jaccard相似度不低于阈值的文本也会被丢弃。
+        被丢弃的近似重复文本所属的父文档无法再通过这段文本检索到，因此默认不启用。
+
+        :param threshold: Jaccard相似度阈值，为空时不过滤近似重复文本
+        :param num_perm: 签名长度，需要与计算签名的MinHasher一致
+        :param boilerplate: 样板文字的正则表达式，不区分大小写
+        """
+        self.threshold = threshold
+        self.num_perm = num_perm if threshold is not None else 0
+        self.bands, self.rows = optimal_bands(threshold, num_perm) if threshold is not None else (0, 0)
+        self.boilerplate = [re.compile(pattern, re.IGNORECASE) for pattern in boilerplate or []]
+
+        self._buckets: list[dict[bytes, int]] = [{} for _ in range(self.bands)]
+        self._signatures: list[np.ndarray] = []
+
+        self.total = 0
+        self.duplicates = 0
+        self.boilerplate_hits = 0
+
+    def __is_boilerplate(self, text: str) -> bool:
+        return any(pattern.search(text) for pattern in self.boilerplate)
+
+    def __is_duplicate(self, signature: np.ndarray) -> bool:
+        keys = [
+            signature[i * self.rows:(i + 1) * self.rows].tobytes()
+            for i in range(self.bands)
+        ]
+
+        candidates = {bucket[key] for bucket, key in zip(self._buckets, keys) if key in bucket}
+        for candidate in candidates:
+            if np.mean(self._signatures[candidate] == signature) >= self.threshold:
+                return True
+
+        index = len(self._signatures)
+        self._signatures.append(signature)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, index)
+
+        return False
+
+    def filter(self, docs: list[Document], signatures: Optional[np.ndarray] = None) -> list[Document]:
+        """
+        过滤重复文本，保留第一次出现的文本。
+
+        :param docs: 子文档
+        :param signatures: 与docs一一对应的MinHash签名，不过滤近似重复文本时可以为空
+        :return: 保留的子文档
+        """
+        if signatures is None:
+            signatures = [None] * len(docs)
+
+        kept = []
+        for doc, signature in zip(docs, signatures):
+            self.total += 1
+            if self.__is_boilerplate(doc.page_content):
+                self.boilerplate_hits += 1
+                continue
+            if self.threshold is not None and self.__is_duplicate(signature):
+                self.duplicates += 1
+                continue
+            kept.append(doc)
+
+        return kept
+
+    @property
+    def ratio(self) -> float:
+        return (self.duplicates + self.boilerplate_hits) / self.total if self.total > 0 else 0.
+
+    def __str__(self) -> str:
+        return f'[dedup] chunks: {self.total}, near duplicates: {self.duplicates}, ' \
+               f'boilerplate: {self.boilerplate_hits}, dedup ratio: {self.ratio:.2%}'
@@ -1,8 +1,5 @@
 import re
 import string
-from typing import List
-
-from bs4 import Tag
 
 
 def format_filename(filename: str) -> str:
@@ -20,33 +17,6 @@ def format_filename(filename: str) -> str:
     return filename
 
 
-def split_words(kw_block: Tag) -> List[str]:
-    """
-    分割文本中的单词。
-
-    此函数使用正则表达式来识别并分割文本中的单词，包括那些被括号包围的单词。分割后的单词会移除括号。
-
-    :param kw_block:
-    :return: 包含分割出的单词的列表，其中括号已被移除。
-    """
-
-    kw_list = kw_block.find_all('term')
-    if len(kw_list) > 0:
-        clean_words = [
-            kw.text.replace('\n', '').replace('\r', ' ').strip()
-            for kw in kw_list
-        ]
-    else:
-        pattern = re.compile(r'\([^()]*\)|\S+')
-        words = pattern.findall(kw_block.text)
-        clean_words = [
-            word.replace('(', '').replace(')', '').replace('\n', '').replace('\r', ' ').strip()
-            for word in words
-        ]
-
-    return clean_words
-
-
 def replace_multiple_spaces(text: str) -> str:
     """
     替换文本中的多个连续空格为单个空格。
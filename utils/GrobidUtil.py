@@ -1,11 +1,14 @@
+import asyncio
 import os.path
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import time
 from enum import StrEnum
+from functools import lru_cache
 from pathlib import Path
 from typing import LiteralString, Any, Tuple
 
+import httpx
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
 from requests import RequestException, Response, ReadTimeout
 from requests.adapters import HTTPAdapter
 from tqdm import tqdm
@@ -15,6 +18,7 @@ from Config import GrobidConfig
 
 from utils.MarkdownPraser import *
 from utils.FileUtil import *
+from utils.XmlUtil import first_node, node_text
 
 
 class ConsolidateHeader(StrEnum):
@@ -36,14 +40,91 @@ class ConsolidateFunders(StrEnum):
     CITATION_AND_DOI = '2'
 
 
+def request_data(
+        coordinates: list[str],
+        *,
+        consolidate_header: str = ConsolidateHeader.ALL_METADATA,
+        consolidate_citations: str = ConsolidateCitations.ALL_METADATA,
+        consolidate_funders: str = ConsolidateFunders.NO_CONSOLIDATION,
+        include_raw_citations: bool = True,
+        include_raw_affiliations: bool = False,
+        include_raw_copyrights: bool = False,
+        segment_sentences: bool = False,
+        generate_ids: bool = False,
+        start: int = -1,
+        end: int = -1
+) -> dict[str, Any]:
+    """
+    生成Grobid全文解析接口的表单参数，参数含义见 GrobidConnector.parse_file。
+    """
+    return {
+        "consolidateHeader": consolidate_header,
+        "consolidateCitations": consolidate_citations,
+        "consolidateFunders": consolidate_funders,
+        "teiCoordinates": coordinates,
+        "start": start,
+        "end": end,
+        "includeRawCitations": "1" if include_raw_citations else "0",
+        "includeRawAffiliations": "1" if include_raw_affiliations else "0",
+        "includeRawCopyrights": "1" if include_raw_copyrights else "0",
+        "segmentSentences": "1" if segment_sentences else "0",
+        "generateIDs": "1" if generate_ids else "0"
+    }
+
+
+def cache_options(server_url: str, the_data: dict[str, Any]) -> dict[str, Any]:
+    """
+    TEI缓存键中的解析参数：服务接口与表单参数。start/end等参数不同的请求不会共用缓存。
+    """
+    return {'service': server_url.rsplit('/', 1)[-1], **the_data}
+
+
+def xml_output_file(output_path: str | bytes, pdf_file: str | bytes) -> str:
+    return os.path.join(output_path, Path(pdf_file).name.replace('.pdf', '.grobid.xml'))
+
+
+def list_pdf_files(pdf_path: str | bytes, output_path: str | bytes, skip_exist: bool = False) -> Tuple[list[str], int]:
+    """
+    列出目录下的PDF文件。
+
+    :param pdf_path: PDF目录
+    :param output_path: xml输出目录
+    :param skip_exist: 是否跳过已有非空xml结果的文件
+    :return: 需要解析的文件，以及跳过的文件数
+    """
+    file_list = [
+        os.path.join(dir_path, filename)
+        for dir_path, _, filenames in os.walk(pdf_path)
+        for filename in filenames
+        if filename.lower().endswith('.pdf')
+    ]
+    if not skip_exist:
+        return file_list, 0
+
+    todo = []
+    for file in file_list:
+        xml_file = xml_output_file(output_path, file)
+        if os.path.exists(xml_file) and os.path.getsize(xml_file) != 0:
+            continue
+        todo.append(file)
+
+    return todo, len(file_list) - len(todo)
+
+
 class GrobidConnector:
-    def __init__(self, config: GrobidConfig):
+    def __init__(self, config: GrobidConfig, cache: Any = None):
+        """
+        :param config: Grobid配置
+        :param cache: 可选的TEI缓存(storage.SqliteStore.TeiCache)，相同的PDF与解析参数直接返回缓存结果
+        """
+        self.cache = cache
         self.server_url = f'{config.grobid_server}/api/{config.service}'
         self.check_url = f'{config.grobid_server}/api/isalive'
         self.coordinates = config.coordinates
         self.timeout = config.timeout
         self.batch_size = config.batch_size
         self.max_works = config.multi_process
+        self.config = config
 
     def __enter__(self):
         self._check_server_status()
@@ -63,6 +144,8 @@ class GrobidConnector:
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self.session.close()
+        if self.cache is not None and self.cache.hits + self.cache.misses > 0:
+            logger.info(str(self.cache))
 
     def _check_server_status(self):
         try:
@@ -113,25 +196,32 @@ class GrobidConnector:
                 )
             }
 
-            the_data = {
-                "consolidateHeader": consolidate_header,
-                "consolidateCitations": consolidate_citations,
-                "consolidateFunders": consolidate_funders,
-                "teiCoordinates": self.coordinates,
-                "start": start,
-                "end": end,
-                "includeRawCitations": "1" if include_raw_citations else "0",
-                "includeRawAffiliations": "1" if include_raw_affiliations else "0",
-                "includeRawCopyrights": "1" if include_raw_copyrights else "0",
-                "segmentSentences": "1" if segment_sentences else "0",
-                "generateIDs": "1" if generate_ids else "0"
-            }
+            the_data = request_data(
+                self.coordinates,
+                consolidate_header=consolidate_header,
+                consolidate_citations=consolidate_citations,
+                consolidate_funders=consolidate_funders,
+                include_raw_citations=include_raw_citations,
+                include_raw_affiliations=include_raw_affiliations,
+                include_raw_copyrights=include_raw_copyrights,
+                segment_sentences=segment_sentences,
+                generate_ids=generate_ids,
+                start=start,
+                end=end
+            )
+
+            cache_key = pdf_hash = None
+            if self.cache is not None:
+                pdf_hash = self.cache.pdf_hash(pdf_file)
+                cache_key = self.cache.cache_key(pdf_hash, cache_options(self.server_url, the_data))
+                if (tei := self.cache.get(cache_key)) is not None:
+                    return pdf_file, 200, tei
 
             response = self.session.post(self.server_url, files=files, data=the_data, timeout=self.timeout)
-            return pdf_file, response.status_code, response.text
+            if self.cache is not None and response.status_code == 200:
+                self.cache.set(cache_key, pdf_hash, cache_options(self.server_url, the_data), response.text)
 
-    def __default_parse(self, pdf_file: str | bytes):
-        return self.parse_file(pdf_file)
+            return pdf_file, response.status_code, response.text
 
     def parse_files(
             self,
@@ -140,72 +230,317 @@ class GrobidConnector:
             multi_process: bool = False,
             skip_exist: bool = False,
     ) -> None:
-        file_list = [
-            os.path.join(dir_path, filename)
-            for dir_path, _, filenames in os.walk(pdf_path)
-            for filename in filenames
-            if filename.lower().endswith('.pdf')
-        ]
+        """
+        解析目录下的所有PDF文件，结果保存为 <文件名>.grobid.xml。
+
+        :param pdf_path: PDF目录
+        :param output_path: xml输出目录
+        :param multi_process: 是否并发解析，并发时使用AsyncGrobidConnector并根据服务负载自动调整并发数
+        :param skip_exist: 是否跳过已有xml结果的文件
+        :return: 无返回值
+        """
+        if multi_process:
+            asyncio.run(self.__parse_files_async(pdf_path, output_path, skip_exist))
+            return
+
+        file_list, skipped = list_pdf_files(pdf_path, output_path, skip_exist)
+        if skipped > 0:
+            logger.info(f'skip {skipped} parsed files')
 
         with tqdm(total=len(file_list), desc="Processing PDFs", unit="file") as pbar:
-            if multi_process:
-                for i in range(0, len(file_list), self.batch_size):
-                    batch = file_list[i:i + self.batch_size]
-
-                    with ThreadPoolExecutor(max_workers=self.max_works) as executor:
-                        responses = [
-                            executor.submit(
-                                self.__default_parse,
-                                file
-                            ) for file in batch
-                        ]
-
-                        for response in as_completed(responses):
-                            input_file, status, text = response.result()
-
-                            if status == 200:
-                                xml_file = os.path.join(
-                                    output_path,
-                                    Path(input_file).name.replace('.pdf', '.grobid.xml')
-                                )
-                                os.makedirs(output_path, exist_ok=True)
-                                with open(xml_file, 'w', encoding='utf8') as f:
-                                    f.write(text)
-                            else:
-                                logger.error(f'Parse {input_file} error.')
-
-                            pbar.update(1)
+            for file in file_list:
+                try:
+                    xml_file = xml_output_file(output_path, file)
+                    input_file, status, text = self.parse_file(file)
+
+                    if status == 200:
+                        os.makedirs(output_path, exist_ok=True)
+                        with open(xml_file, 'w', encoding='utf8') as f:
+                            f.write(text)
+                    else:
+                        logger.error(f'Parse {input_file} error.')
+                except ReadTimeout:
+                    logger.error(f'timeout while parsing {file}')
+                finally:
+                    pbar.update(1)
+
+    async def __parse_files_async(self, pdf_path: str | bytes, output_path: str | bytes, skip_exist: bool) -> None:
+        async with AsyncGrobidConnector(self.config, self.cache) as connector:
+            await connector.parse_files(pdf_path, output_path, skip_exist=skip_exist)
+
+
+class AdaptiveLimiter:
+    def __init__(self, max_limit: int, min_limit: int = 1, target_latency: float = 0, initial: int = None):
+        """
+        AIMD(加性增、乘性减)并发控制。请求成功且延迟低于目标时，每完成约 limit 个请求并发数加一；
+        遇到过载(503)或延迟超过目标时并发数减半，同一批在途请求只会触发一次减半。
+
+        :param max_limit: 并发上限
+        :param min_limit: 并发下限
+        :param target_latency: 目标延迟(秒)，为0时不根据延迟调整
+        :param initial: 初始并发数，默认为下限与上限的中间值
+        """
+        self.max_limit = max(max_limit, 1)
+        self.min_limit = max(min(min_limit, self.max_limit), 1)
+        self.target_latency = target_latency
+        self.limit = float(initial or max((self.min_limit + self.max_limit) // 2, self.min_limit))
+
+        self._in_flight = 0
+        self._condition = asyncio.Condition()
+        self._sequence = 0
+        self._last_decrease = -1
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    async def acquire(self) -> int:
+        """
+        等待可用的并发额度。
+
+        :return: 请求序号，释放时传回，用于判断过载信号是否来自上次减半之前发出的请求
+        """
+        async with self._condition:
+            await self._condition.wait_for(lambda: self._in_flight < int(self.limit))
+            self._in_flight += 1
+            self._sequence += 1
+            return self._sequence
+
+    async def release(self, sequence: int, overloaded: bool, latency: float = 0) -> None:
+        async with self._condition:
+            self._in_flight -= 1
+
+            slow = self.target_latency > 0 and latency > self.target_latency
+            if overloaded or slow:
+                if sequence > self._last_decrease:
+                    self.limit = max(self.limit / 2, self.min_limit)
+                    self._last_decrease = self._sequence
+                    logger.debug(f'grobid overloaded, concurrency -> {int(self.limit)}')
             else:
-                for file in file_list:
-                    try:
-                        xml_file = os.path.join(
-                            output_path,
-                            Path(file).name.replace('.pdf', '.grobid.xml')
-                        )
+                self.limit = min(self.limit + 1 / self.limit, self.max_limit)
+
+            self._condition.notify_all()
 
-                        if skip_exist and os.path.exists(xml_file) and os.path.getsize(xml_file) != 0:
-                            continue
 
-                        input_file, status, text = self.parse_file(file)
+class AsyncGrobidConnector:
+    def __init__(self, config: GrobidConfig, cache: Any = None):
+        """
+        基于asyncio与httpx的Grobid客户端。使用持久连接池，以流的形式上传PDF，
+        根据503与响应延迟自适应调整并发数，解析结果完成一个写入一个。
 
+        :param config: Grobid配置
+        :param cache: 可选的TEI缓存，命中时不占用并发额度
+        """
+        self.config = config
+        self.cache = cache
+        self.server_url = f'{config.grobid_server}/api/{config.service}'
+        self.check_url = f'{config.grobid_server}/api/isalive'
+        self.coordinates = config.coordinates
+        self.timeout = config.timeout
+        self.max_retries = config.max_retries
+        self.limiter = AdaptiveLimiter(
+            config.multi_process,
+            config.min_concurrency,
+            config.target_latency or config.timeout / 2
+        )
+
+    async def __aenter__(self):
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=self.limiter.max_limit,
+                max_keepalive_connections=self.limiter.max_limit
+            ),
+            headers={
+                'User-Agent': 'GrobidConnector/1.0',
+                'Accept': 'application/xml'
+            }
+        )
+
+        try:
+            response = await self.client.get(self.check_url)
+            response.raise_for_status()
+        except httpx.HTTPError as e:
+            await self.client.aclose()
+            logger.error(f'[{e}]: Grobid server is unavailable.')
+            raise ConnectionError('Grobid server is unavailable.')
+
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.client.aclose()
+
+    async def parse_file(self, pdf_file: str | bytes, **kwargs) -> tuple[str | bytes, int, str]:
+        """
+        解析单个PDF文件，503时按照限流器的节奏重试。参数与 GrobidConnector.parse_file 相同。
+
+        :param pdf_file: PDF文件路径
+        :return: (文件路径, 状态码, 响应文本)
+        """
+        the_data = request_data(self.coordinates, **kwargs)
+
+        cache_key = pdf_hash = None
+        if self.cache is not None:
+            pdf_hash = await asyncio.to_thread(self.cache.pdf_hash, pdf_file)
+            cache_key = self.cache.cache_key(pdf_hash, cache_options(self.server_url, the_data))
+            if (tei := await asyncio.to_thread(self.cache.get, cache_key)) is not None:
+                return pdf_file, 200, tei
+
+        status, text = 503, ''
+        for attempt in range(self.max_retries + 1):
+            sequence = await self.limiter.acquire()
+            start = time.perf_counter()
+            # 连接错误等任何异常都视为过载，在向上抛出之前让限流器减半并发数
+            overloaded = True
+            try:
+                with open(pdf_file, 'rb') as f:
+                    # httpx按块读取文件对象，不会一次性读入整个PDF
+                    files = {'input': (os.path.basename(pdf_file), f, 'application/pdf', {'Expires': '0'})}
+                    response = await self.client.post(self.server_url, files=files, data=the_data)
+                status, text = response.status_code, response.text
+                overloaded = status == 503
+            except httpx.TimeoutException:
+                status, text = 408, ''
+            finally:
+                await self.limiter.release(sequence, overloaded, time.perf_counter() - start)
+
+            if not overloaded or attempt == self.max_retries:
+                break
+
+            await asyncio.sleep(min(2 ** attempt, 30))
+
+        if self.cache is not None and status == 200:
+            await asyncio.to_thread(
+                self.cache.set, cache_key, pdf_hash, cache_options(self.server_url, the_data), text
+            )
+
+        return pdf_file, status, text
+
+    async def parse_files(
+            self,
+            pdf_path: str | bytes,
+            output_path: str | bytes,
+            skip_exist: bool = False,
+            **kwargs
+    ) -> dict[str, int]:
+        """
+        并发解析目录下的所有PDF文件，结果保存为 <文件名>.grobid.xml。
+        同时存在的任务数不超过并发上限，文件在完成时立即写入。
+
+        :param pdf_path: PDF目录
+        :param output_path: xml输出目录
+        :param skip_exist: 是否跳过已有xml结果的文件
+        :param kwargs: 传给parse_file的解析参数
+        :return: 每种状态码对应的文件数
+        """
+        file_list, skipped = list_pdf_files(pdf_path, output_path, skip_exist)
+        if skipped > 0:
+            logger.info(f'skip {skipped} parsed files')
+        os.makedirs(output_path, exist_ok=True)
+
+        queue: asyncio.Queue[str] = asyncio.Queue()
+        for file in file_list:
+            queue.put_nowait(file)
+
+        counts = {}
+        with tqdm(total=len(file_list), desc="Processing PDFs", unit="file") as pbar:
+            async def worker():
+                while not queue.empty():
+                    file = queue.get_nowait()
+                    try:
+                        input_file, status, text = await self.parse_file(file, **kwargs)
                         if status == 200:
-                            os.makedirs(output_path, exist_ok=True)
-                            with open(xml_file, 'w', encoding='utf8') as f:
-                                f.write(text)
+                            await asyncio.to_thread(self.__write, xml_output_file(output_path, input_file), text)
                         else:
-                            logger.error(f'Parse {input_file} error.')
-                    except ReadTimeout:
-                        logger.error(f'timeout while parsing {file}')
-                    finally:
-                        pbar.update(1)
+                            logger.error(f'Parse {input_file} error, status {status}.')
+                    except (httpx.HTTPError, OSError) as e:
+                        status = -1
+                        logger.error(f'Parse {file} error: {e}')
+
+                    counts[status] = counts.get(status, 0) + 1
+                    pbar.set_postfix(concurrency=int(self.limiter.limit), refresh=False)
+                    pbar.update(1)
+
+            await asyncio.gather(*(worker() for _ in range(min(self.limiter.max_limit, len(file_list)))))
+
+        logger.info(f'grobid results: {counts}')
+        if self.cache is not None:
+            logger.info(str(self.cache))
+        return counts
+
+    @staticmethod
+    def __write(xml_file: str, text: str) -> None:
+        with open(xml_file, 'w', encoding='utf8') as f:
+            f.write(text)
+
+
+TEI_NAMESPACE = 'http://www.tei-c.org/ns/1.0'
 
 
-def parse_xml(xml_path: LiteralString | str | bytes, sections: list = None) -> Paper:
+@lru_cache(maxsize=2)
+def _tei_xpaths(namespace: str | None) -> dict[str, etree.XPath]:
     """
-    解析XML文件，提取相关信息。
+    预编译TEI文档所需的XPath。Grobid的输出使用TEI默认命名空间，没有命名空间的文件同样可以解析。
+    """
+    p = 'tei:' if namespace else ''
+    namespaces = {'tei': namespace} if namespace else None
+    paths = {
+        'title': f'(//{p}titleStmt)[1]//{p}title[@type="main"]',
+        'source_desc': f'(//{p}sourceDesc)[1]',
+        'pers_name': f'.//{p}persName',
+        'first_name': f'(.//{p}forename[@type="first"])[1]',
+        'middle_name': f'(.//{p}forename[@type="middle"])[1]',
+        'surname': f'(.//{p}surname)[1]',
+        'date': f'(//{p}publicationStmt)[1]//{p}date',
+        'doi': f'(.//{p}idno[@type="DOI"])[1]',
+        'profile_desc': f'(//{p}profileDesc)[1]',
+        'keywords': f'(.//{p}keywords)[1]',
+        'term': f'.//{p}term',
+        'abstract_p': f'.//{p}abstract//{p}p',
+        'div': f'(//{p}body)[1]//{p}div',
+        'head': f'(.//{p}head)[1]',
+        'p': f'.//{p}p',
+        'bibl_struct': f'(//{p}back)[1]//{p}biblStruct',
+        'bibl_title': f'(.//{p}title)[1]',
+    }
+
+    return {key: etree.XPath(path, namespaces=namespaces) for key, path in paths.items()}
+
+
+def __split_words(kw_block: etree._Element, xpaths: dict[str, etree.XPath]) -> list[str]:
+    """
+    分割关键词。有term节点时按term分割，否则使用正则表达式分割文本中的单词，包括被括号包围的单词，
+    分割后的单词会移除括号。
+
+    :param kw_block: keywords节点
+    :param xpaths: 预编译的XPath
+    :return: 关键词列表
+    """
+    kw_list = xpaths['term'](kw_block)
+    if len(kw_list) > 0:
+        return [node_text(kw).replace('\n', '').replace('\r', ' ').strip() for kw in kw_list]
+
+    pattern = re.compile(r'\([^()]*\)|\S+')
+    words = pattern.findall(node_text(kw_block))
+    return [
+        word.replace('(', '').replace(')', '').replace('\n', '').replace('\r', ' ').strip()
+        for word in words
+    ]
+
+
+def parse_xml(
+        xml_path: LiteralString | str | bytes,
+        sections: list = None,
+        xml_text: str = None
+) -> Paper:
+    """
+    解析Grobid输出的TEI XML文件，提取相关信息。
+
+    使用lxml与预编译的XPath实现，函数及返回值都可以序列化，能够在进程池中运行。
 
     :param xml_path: XML文件的路径，可以是字符串路径、字节序列或LiteralString。
-    :param sections:
+    :param sections: 已有的段落，不为空时只追加正文部分
+    :param xml_text: XML内容，不为空时直接解析，xml_path只用于记录来源
     :return: 格式化后的段落信息
     """
 
@@ -215,23 +550,27 @@ def parse_xml(xml_path: LiteralString | str | bytes, sections: list = None) -> P
     else:
         append = True
 
-    with open(xml_path, 'r', encoding='utf-8') as f:
-        xml_data = f.read()
-        soup = BeautifulSoup(xml_data, 'xml')
+    parser = etree.XMLParser(recover=True, huge_tree=True, resolve_entities=False, remove_pis=True)
+    if xml_text is None:
+        root = etree.parse(xml_path, parser).getroot()
+    else:
+        root = etree.fromstring(xml_text.encode('utf-8'), parser)
+    xpaths = _tei_xpaths(etree.QName(root).namespace)
 
     # 提取XML中的标题
-    title = soup.find('titleStmt').find('title', {'type': 'main'})
-    title = format_filename(title.text.strip()) if title is not None else ''
+    title = first_node(root, xpaths['title'])
+    title = format_filename(node_text(title).strip()) if title is not None else ''
 
     # 提取作者信息
+    source_desc = first_node(root, xpaths['source_desc'])
     authors = []
-    for author in soup.find('sourceDesc').find_all('persName'):
-        first_name = author.find('forename', {'type': 'first'})
-        first_name = first_name.text.strip() if first_name is not None else ''
-        middle_name = author.find('forename', {'type': 'middle'})
-        middle_name = middle_name.text.strip() if middle_name is not None else ''
-        last_name = author.find('surname')
-        last_name = last_name.text.strip() if last_name is not None else ''
+    for author in xpaths['pers_name'](source_desc):
+        first_name = first_node(author, xpaths['first_name'])
+        first_name = node_text(first_name).strip() if first_name is not None else ''
+        middle_name = first_node(author, xpaths['middle_name'])
+        middle_name = node_text(middle_name).strip() if middle_name is not None else ''
+        last_name = first_node(author, xpaths['surname'])
+        last_name = node_text(last_name).strip() if last_name is not None else ''
 
         if middle_name != '':
             authors.append(__extract_author_name(last_name, f'{first_name} {middle_name}'))
@@ -242,9 +581,8 @@ def parse_xml(xml_path: LiteralString | str | bytes, sections: list = None) -> P
         authors.append("")
 
     # 提取出版年份
-    pub_date = soup.find('publicationStmt')
-    year_block = pub_date.find('date')
-    year = year_block.attrs.get('when') if year_block is not None else ''
+    year_block = first_node(root, xpaths['date'])
+    year = year_block.get('when') if year_block is not None else ''
 
     try:
         match len(year):
@@ -258,12 +596,13 @@ def parse_xml(xml_path: LiteralString | str | bytes, sections: list = None) -> P
         year = -1
         logger.error(f"{xml_path} 年份提取失败")
 
-    doi = soup.find('sourceDesc').find('idno', {'type': 'DOI'})
-    doi = doi.text if doi else ''
+    doi = first_node(source_desc, xpaths['doi'])
+    doi = node_text(doi) if doi is not None else ''
 
     # 提取关键词
-    key_div = soup.find('profileDesc').find('keywords')
-    keywords = split_words(key_div) if key_div is not None else ['']
+    profile_desc = first_node(root, xpaths['profile_desc'])
+    key_div = first_node(profile_desc, xpaths['keywords'])
+    keywords = __split_words(key_div, xpaths) if key_div is not None else ['']
 
     paper_info = PaperInfo(authors[0], year, PaperType.GROBID_PAPER, ','.join(keywords), True, doi)
 
@@ -271,18 +610,19 @@ def parse_xml(xml_path: LiteralString | str | bytes, sections: list = None) -> P
         sections.append(Section(title, 1))
 
         # 提取摘要
-        abstract_list = soup.find('profileDesc').select('abstract p')
+        abstract_list = xpaths['abstract_p'](profile_desc)
         if len(abstract_list) > 0:
             sections.append(Section('Abstract', 2))
             for p in abstract_list:
-                sections.append(Section(p.text.strip(), 0))
+                sections.append(Section(node_text(p).strip(), 0))
 
     # 提取章节信息
-    for section in soup.find('body').find_all('div'):
-        if section.find('head') is None:
+    for section in xpaths['div'](root):
+        head = first_node(section, xpaths['head'])
+        if head is None:
             continue
-        section_title = section.find('head').text.strip()
-        title_level = section.find('head').attrs.get('n')
+        section_title = node_text(head).strip()
+        title_level = head.get('n')
         if title_level:
             matches = re.findall(r'\d', title_level)
             level = len(matches) + 1
@@ -291,23 +631,15 @@ def parse_xml(xml_path: LiteralString | str | bytes, sections: list = None) -> P
 
         sections.append(Section(section_title, level))
 
-        for p in section.find_all('p'):
-            ref_tags = p.find_all('ref', {'type': 'bibr'})
-
-            for ref_tag in ref_tags:
-                if 'target' in ref_tag:
-                    target_info: str = ref_tag['target']
-                    target_info = target_info.replace('#b', '')
-                    ref_tag.insert_after(f'[^{target_info}]')
-
-            text = replace_multiple_spaces(p.text.strip())
+        for p in xpaths['p'](section):
+            text = replace_multiple_spaces(node_text(p).strip())
             if text:
                 sections.append(Section(text, 0))
 
     # 提取引用信息
     ref_list = []
-    for reference in soup.find('back').find_all('biblStruct'):
-        ref_title = reference.find('title').text
+    for reference in xpaths['bibl_struct'](root):
+        ref_title = node_text(first_node(reference, xpaths['bibl_title']))
         ref_list.append({'title': ref_title, 'pmid': '', 'pmc': '', 'doi': ''})
 
     return Paper(paper_info, sections, Reference(doi, ref_list))
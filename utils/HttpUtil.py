@@ -0,0 +1,342 @@
+import asyncio
+import hashlib
+import importlib.util
+import re
+import threading
+import time
+import weakref
+from enum import StrEnum
+from typing import Any, Callable, Sequence
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from Config import Config, HttpConfig, load_config
+from storage.SqliteStore import HttpResponseCache, CachedResponse
+
+DAY = 24 * 3600
+
+# (URL正则, 缓存时间(秒))，按顺序匹配第一个
+CACHE_TTLS = (
+    (r'eutils\.ncbi\.nlm\.nih\.gov/.*/efetch', 30 * DAY),
+    (r'eutils\.ncbi\.nlm\.nih\.gov/.*/esearch', DAY),
+    (r'ncbi\.nlm\.nih\.gov/pmc/utils/idconv', 30 * DAY),
+    (r'google\.serper\.dev', DAY),
+)
+DEFAULT_TTL = 7 * DAY
+
+# 服务端错误时重试的状态码
+RETRY_STATUS = (500, 502, 503, 504)
+
+# 不参与缓存键计算的参数，凭据不应影响缓存命中，也不会写入缓存
+IGNORED_PARAMS = ('api_key',)
+
+
+def ttl_for(url: str) -> float:
+    for pattern, ttl in CACHE_TTLS:
+        if re.search(pattern, url):
+            return ttl
+
+    return DEFAULT_TTL
+
+
+def canonical_url(url: str, ignored_params: Sequence[str] = IGNORED_PARAMS) -> str:
+    """
+    统一URL的写法：协议和域名小写，查询参数排序并去掉忽略的参数。
+    """
+    parts = urlsplit(url)
+    query = sorted((k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in ignored_params)
+
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+
+def cache_key(request: requests.PreparedRequest, ignored_params: Sequence[str] = IGNORED_PARAMS) -> str:
+    """
+    由请求方法、规范化的URL和请求体生成缓存键。表单请求体同样排序并去掉忽略的参数。
+    """
+    body = request.body or b''
+    if isinstance(body, str):
+        body = body.encode('utf-8')
+
+    content_type = request.headers.get('Content-Type', '')
+    if body and content_type.startswith('application/x-www-form-urlencoded'):
+        form = sorted(
+            (k, v) for k, v in parse_qsl(body.decode('utf-8'), keep_blank_values=True)
+            if k not in ignored_params
+        )
+        body = urlencode(form).encode('utf-8')
+
+    digest = hashlib.sha256()
+    digest.update(f'{request.method} {canonical_url(request.url, ignored_params)}\n'.encode('utf-8'))
+    digest.update(body)
+
+    return digest.hexdigest()
+
+
+def build_response(entry: CachedResponse, request: requests.PreparedRequest) -> requests.Response:
+    response = requests.Response()
+    response.status_code = entry.status
+    response.headers = CaseInsensitiveDict(entry.headers)
+    response._content = entry.body
+    response.encoding = get_encoding_from_headers(response.headers)
+    response.url = request.url
+    response.request = request
+    response.reason = 'OK'
+    response.from_cache = True
+
+    return response
+
+
+class HostClass(StrEnum):
+    NCBI = 'ncbi'
+    SEARCH = 'search'
+    WEB = 'web'
+    MODEL = 'model'
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(
+            self,
+            timeout: float | tuple[float, float] = None,
+            before_send: Callable[[], object] = None,
+            retries: int = 0,
+            backoff_factor: float = 1,
+            *args,
+            **kwargs
+    ):
+        """
+        设置默认超时的连接池适配器。连接错误、超时和服务端错误(RETRY_STATUS)在适配器中重试，
+        每次重试同样先调用before_send，重试的请求也受限速约束。
+
+        :param timeout: 请求没有指定超时时使用的超时，(连接超时, 读取超时)
+        :param before_send: 每次真正发出网络请求前调用，例如令牌桶限速
+        :param retries: 最大重试次数
+        :param backoff_factor: 第n次重试前等待 backoff_factor * 2^n 秒，服务端给出Retry-After时以其为准
+        """
+        super().__init__(*args, **kwargs)
+        self.timeout = timeout
+        self.before_send = before_send
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if kwargs.get('timeout') is None and self.timeout is not None:
+            kwargs['timeout'] = self.timeout
+
+        for attempt in range(self.retries + 1):
+            if self.before_send is not None:
+                self.before_send()
+
+            last_attempt = attempt == self.retries
+            try:
+                response = super().send(request, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if last_attempt:
+                    raise
+                time.sleep(self.__backoff(attempt))
+                continue
+
+            if response.status_code not in RETRY_STATUS or last_attempt:
+                return response
+
+            wait = self.__backoff(attempt, response.headers.get('Retry-After'))
+            response.close()
+            time.sleep(wait)
+
+    def __backoff(self, attempt: int, retry_after: str = None) -> float:
+        if retry_after is not None and retry_after.isdigit():
+            return float(retry_after)
+
+        return min(self.backoff_factor * 2 ** attempt, 30)
+
+
+class CachingAdapter(PooledAdapter):
+    def __init__(self, cache: HttpResponseCache, ttl: float = None, *args, **kwargs):
+        """
+        带持久化缓存的requests传输适配器。未过期的响应直接从缓存返回；过期的响应带上
+        If-None-Match/If-Modified-Since重新验证，服务端返回304时继续使用缓存内容。只缓存GET/POST的200响应。
+        命中缓存时不会调用before_send。
+
+        :param cache: 响应缓存
+        :param ttl: 缓存时间(秒)，为空时按照CACHE_TTLS匹配
+        """
+        super().__init__(*args, **kwargs)
+        self.cache = cache
+        self.ttl = ttl
+
+    def send(self, request: requests.PreparedRequest, **kwargs) -> requests.Response:
+        if request.method not in ('GET', 'POST'):
+            return super().send(request, **kwargs)
+
+        key = cache_key(request)
+        entry = self.cache.get(key)
+        if entry is not None and entry.fresh:
+            return build_response(entry, request)
+
+        if entry is not None:
+            request.headers.update(entry.validators())
+
+        response = super().send(request, **kwargs)
+
+        ttl = self.ttl if self.ttl is not None else ttl_for(request.url)
+        if response.status_code == 304 and entry is not None:
+            self.cache.touch(key, ttl)
+            return build_response(entry, request)
+
+        cache_control = response.headers.get('Cache-Control', '')
+        if response.status_code == 200 and 'no-store' not in cache_control:
+            self.cache.set(
+                key,
+                canonical_url(request.url),
+                response.status_code,
+                dict(response.headers),
+                response.content,
+                ttl
+            )
+
+        return response
+
+
+_CACHES: dict[str, HttpResponseCache] = {}
+_CACHES_LOCK = threading.Lock()
+
+
+def get_http_cache(config: Config = None) -> HttpResponseCache:
+    """
+    获取共享的HTTP响应缓存，同一个缓存文件在进程内只打开一次。
+    """
+    if config is None:
+        config = load_config()
+
+    path = config.get_http_cache_path()
+    with _CACHES_LOCK:
+        if path not in _CACHES:
+            _CACHES[path] = HttpResponseCache(path)
+
+        return _CACHES[path]
+
+
+_SESSIONS: dict[tuple, requests.Session] = {}
+_CLIENTS: dict[tuple[str, str | None, HttpConfig], httpx.Client] = {}
+_ASYNC_CLIENTS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+_REGISTRY_LOCK = threading.Lock()
+
+HTTP2_AVAILABLE = importlib.util.find_spec('h2') is not None
+
+
+def __http_config(http_config: HttpConfig | None) -> HttpConfig:
+    return http_config if http_config is not None else load_config().http_config
+
+
+def get_session(
+        host_class: HostClass,
+        proxy: str = None,
+        *,
+        http_config: HttpConfig = None,
+        cache: HttpResponseCache = None,
+        before_send: Callable[[], object] = None
+) -> requests.Session:
+    """
+    获取进程内共享的requests会话。同一 (服务类别, 代理, 连接配置, 缓存, 限速回调) 复用一个连接池，
+    避免重复的TCP、TLS和代理握手。任一设置不同时(例如修改了配置文件中的http部分，或更换API key、请求速率后
+    得到新的令牌桶)使用新的会话，不会沿用旧的设置。
+
+    :param host_class: 服务类别
+    :param proxy: 代理地址，为空时直连
+    :param http_config: 连接池与超时配置，为空时读取默认配置
+    :param cache: 可选的HTTP响应缓存
+    :param before_send: 发出网络请求前的回调，例如令牌桶限速
+    :return: 会话
+    """
+    http_cfg = __http_config(http_config)
+    # 绑定方法按照所属对象比较，同一个令牌桶的acquire得到同一个键
+    key = (host_class, proxy, http_cfg, cache, before_send)
+    with _REGISTRY_LOCK:
+        if key in _SESSIONS:
+            return _SESSIONS[key]
+
+        adapter_kwargs = dict(
+            timeout=(http_cfg.connect_timeout, http_cfg.read_timeout),
+            before_send=before_send,
+            retries=http_cfg.retries,
+            pool_connections=http_cfg.max_keepalive,
+            pool_maxsize=http_cfg.max_connections,
+        )
+        adapter = CachingAdapter(cache, **adapter_kwargs) if cache is not None else PooledAdapter(**adapter_kwargs)
+
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        if proxy:
+            session.proxies.update({'http': proxy, 'https': proxy})
+
+        _SESSIONS[key] = session
+        return session
+
+
+def __httpx_kwargs(proxy: str | None, http_cfg: HttpConfig) -> dict[str, Any]:
+    return dict(
+        proxy=proxy,
+        http2=http_cfg.http2 and HTTP2_AVAILABLE,
+        limits=httpx.Limits(
+            max_connections=http_cfg.max_connections,
+            max_keepalive_connections=http_cfg.max_keepalive,
+            keepalive_expiry=http_cfg.keepalive_expiry
+        ),
+        timeout=httpx.Timeout(http_cfg.read_timeout, connect=http_cfg.connect_timeout),
+    )
+
+
+def get_client(host_class: HostClass, proxy: str = None, *, http_config: HttpConfig = None) -> httpx.Client:
+    """
+    获取进程内共享的httpx同步客户端，同一 (服务类别, 代理, 连接配置) 复用一个连接池，安装了h2时使用HTTP/2。
+
+    :param host_class: 服务类别
+    :param proxy: 代理地址，为空时直连
+    :param http_config: 连接池与超时配置
+    :return: 客户端
+    """
+    http_cfg = __http_config(http_config)
+    key = (host_class, proxy, http_cfg)
+    with _REGISTRY_LOCK:
+        if key not in _CLIENTS or _CLIENTS[key].is_closed:
+            _CLIENTS[key] = httpx.Client(**__httpx_kwargs(proxy, http_cfg))
+
+        return _CLIENTS[key]
+
+
+def get_async_client(host_class: HostClass, proxy: str = None, *, http_config: HttpConfig = None) -> httpx.AsyncClient:
+    """
+    获取共享的httpx异步客户端，同一 (服务类别, 代理, 连接配置) 复用一个连接池。异步连接绑定在事件循环上，因此按照当前事件循环分别缓存。
+
+    :param host_class: 服务类别
+    :param proxy: 代理地址，为空时直连
+    :param http_config: 连接池与超时配置
+    :return: 客户端
+    """
+    loop = asyncio.get_running_loop()
+    http_cfg = __http_config(http_config)
+    key = (host_class, proxy, http_cfg)
+    with _REGISTRY_LOCK:
+        clients = _ASYNC_CLIENTS.setdefault(loop, {})
+        if key not in clients or clients[key].is_closed:
+            clients[key] = httpx.AsyncClient(**__httpx_kwargs(proxy, http_cfg))
+
+        return clients[key]
+
+
+def close_all() -> None:
+    """
+    关闭所有共享的同步会话和客户端。
+    """
+    with _REGISTRY_LOCK:
+        for session in _SESSIONS.values():
+            session.close()
+        for client in _CLIENTS.values():
+            client.close()
+        _SESSIONS.clear()
+        _CLIENTS.clear()
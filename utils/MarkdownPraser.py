@@ -9,7 +9,7 @@ from langchain_core.documents import Document
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 from loguru import logger
 from yaml import Dumper
-from langchain_text_splitters import MarkdownHeaderTextSplitter, RecursiveCharacterTextSplitter
+from langchain_text_splitters import MarkdownHeaderTextSplitter
 
 from utils.entities.Paper import *
 
@@ -39,8 +39,7 @@ def split_markdown_text(md_text: str) -> Tuple[list[Document], Reference]:
     """
     分割Markdown文本。
 
-    该函数首先根据Markdown中的标题（#，##，###，####）进行分割，然后将文本进一步拆分为多个文档块，
-    每个文档块保持相对的完整性。此外，如果提供了`year`、`doi`和`author`参数，则会将这些信息添加到
+    该函数根据Markdown中的标题（#，##，###，####）将文本分割为章节，按长度的进一步切分在入库时完成。此外，如果提供了`year`、`doi`和`author`参数，则会将这些信息添加到
     每个拆分后的文档的元数据中；如果没有提供这些参数，则从Markdown文本的元数据部分自动提取。
 
     :param md_text: 要分割的Markdown文本字符串。
@@ -50,12 +49,6 @@ def split_markdown_text(md_text: str) -> Tuple[list[Document], Reference]:
     md_splitter = MarkdownHeaderTextSplitter(
         headers_to_split_on=[('#', 'title'), ('##', 'section'), ('###', 'subtitle'), ('####', 'subtitle')]
     )
-    r_splitter = RecursiveCharacterTextSplitter(
-        chunk_size=450,
-        chunk_overlap=0,
-        separators=['\n\n', '\n', '\t\n'],
-        keep_separator=False
-    )
 
     head_split_docs = md_splitter.split_text(md_text)
 
@@ -83,9 +76,8 @@ def split_markdown_text(md_text: str) -> Tuple[list[Document], Reference]:
         doc.metadata['keywords'] = paper_info.keywords
         doc.metadata['doi'] = paper_info.doi
 
-    md_docs = r_splitter.split_documents(head_split_docs)
-
-    return md_docs, Reference(paper_info.doi, reference_data)
+    # 按长度的切分统一由SplitterCore中的父文档切分器完成
+    return head_split_docs, Reference(paper_info.doi, reference_data)
 
 
 def split_paper(paper: Paper) -> Tuple[list[Document], Reference]:
@@ -0,0 +1,137 @@
+import os
+import re
+import tarfile
+from typing import Iterable, Iterator
+
+import pandas as pd
+from loguru import logger
+
+from utils.ConvertUtil import ConvertTask, XmlFormat
+
+PACKAGE_SUFFIX = '.tar.gz'
+XML_SUFFIXES = ('.xml', '.nxml')
+
+# PMC OA批量包的文件列表中的列，改为便于在query中使用的列名
+FILELIST_COLUMNS = {
+    'Article File': 'file',
+    'Article Citation': 'citation',
+    'AccessionID': 'pmc_id',
+    'LastUpdated (YYYY-MM-DD HH:MM:SS)': 'last_updated',
+    'PMID': 'pmid',
+    'License': 'license',
+    'Retracted': 'retracted',
+}
+
+_PMC_ID = re.compile(r'PMC\d+', re.IGNORECASE)
+
+
+def normalize_pmc_id(value: str | int) -> str:
+    """
+    统一PMC ID的写法，例如 123、pmc123 与 PMC123 都返回 PMC123。
+    """
+    value = str(value).strip()
+    return value.upper() if value.upper().startswith('PMC') else f'PMC{value}'
+
+
+def member_pmc_id(name: str) -> str | None:
+    """
+    从压缩包中的文件名获取PMC ID，例如 PMC000xxxxxx/PMC176545.xml 返回 PMC176545。
+    """
+    match = _PMC_ID.search(os.path.basename(name))
+    return match.group().upper() if match else None
+
+
+def filelist_path(package: str) -> str:
+    return f'{package.removesuffix(PACKAGE_SUFFIX)}.filelist.csv'
+
+
+def read_filelist(package: str) -> pd.DataFrame | None:
+    """
+    读取批量包对应的文件列表(与压缩包同名的 .filelist.csv)，不存在时返回None。
+
+    :param package: 压缩包路径
+    :return: 文件列表，列名见FILELIST_COLUMNS
+    """
+    path = filelist_path(package)
+    if not os.path.exists(path):
+        return None
+
+    return pd.read_csv(path, encoding='utf-8', dtype=str).rename(columns=FILELIST_COLUMNS)
+
+
+def select_members(package: str, pmc_ids: set[str] = None, query: str = None) -> set[str] | None:
+    """
+    根据PMC ID列表和文件列表上的查询确定需要读取的PMC ID。
+
+    :param package: 压缩包路径
+    :param pmc_ids: 只读取这些文献，为空时不按ID过滤
+    :param query: pandas查询表达式，例如 "license == 'CC BY' and retracted == 'no'"，需要文件列表
+    :return: 需要读取的PMC ID，为None时读取全部文件
+    """
+    if query is None:
+        return pmc_ids
+
+    filelist = read_filelist(package)
+    if filelist is None:
+        raise FileNotFoundError(f'query needs the file list {filelist_path(package)}')
+
+    selected = set(filelist.query(query)['pmc_id'].map(normalize_pmc_id))
+    logger.info(f'{len(selected)} of {filelist.shape[0]} files in {os.path.basename(package)} match "{query}"')
+
+    return selected & pmc_ids if pmc_ids is not None else selected
+
+
+def iter_package(package: str, pmc_ids: set[str] = None) -> Iterator[tuple[str, str, str]]:
+    """
+    按顺序流式读取压缩包中的xml文件，不解压到磁盘。
+
+    :param package: PMC OA批量包(.tar.gz)
+    :param pmc_ids: 只读取这些文献，为空时读取全部
+    :return: (PMC ID, 包内路径, xml内容) 的迭代器
+    """
+    with tarfile.open(package, mode='r|gz') as tar:
+        for member in tar:
+            if not member.isfile() or not member.name.endswith(XML_SUFFIXES):
+                continue
+
+            pmc_id = member_pmc_id(member.name)
+            if pmc_ids is not None and pmc_id not in pmc_ids:
+                continue
+
+            with tar.extractfile(member) as f:
+                yield pmc_id, member.name, f.read().decode('utf-8', errors='replace')
+
+
+def package_tasks(
+        packages: Iterable[str],
+        md_root: str,
+        pmc_ids: Iterable[str] = None,
+        query: str = None,
+        exclude: set[str] = None
+) -> Iterator[ConvertTask]:
+    """
+    将批量包中的文献逐个转换为ConvertTask，配合convert_stream使用。
+
+    :param packages: 压缩包路径
+    :param md_root: markdown输出根目录，按照年份和DOI保存
+    :param pmc_ids: 只转换这些文献
+    :param query: 文件列表上的查询表达式
+    :param exclude: 跳过的PMC ID，例如上次已经转换完成的文献
+    :return: 转换任务的迭代器，任务的key为PMC ID
+    """
+    wanted = {normalize_pmc_id(_id) for _id in pmc_ids} if pmc_ids is not None else None
+    exclude = exclude or set()
+
+    for package in packages:
+        selected = select_members(package, wanted, query)
+        if selected is not None:
+            selected = selected - exclude
+            if not selected:
+                logger.info(f'skip {os.path.basename(package)}, no file selected')
+                continue
+
+        for pmc_id, name, xml_text in iter_package(package, selected):
+            if pmc_id in exclude:
+                continue
+
+            yield ConvertTask(pmc_id, f'{package}/{name}', XmlFormat.PMC, md_root=md_root, xml_text=xml_text)
@@ -1,20 +1,20 @@
-import json
 import os.path
 import random
 import re
 from enum import Enum
 from typing import Tuple, Dict, List, Any
 
-import requests
 import pandas as pd
 import yaml
-from bs4 import BeautifulSoup, NavigableString
+from bs4 import BeautifulSoup
+from lxml import etree
 from loguru import logger
-from requests import sessions
 
-from Config import Config
+from Config import Config, load_config
 from utils.FileUtil import replace_multiple_spaces
 from utils.Decorator import timer, retry
+from utils.PubmedUtil import get_eutils_client
+from utils.XmlUtil import first_node, node_text
 from utils.MarkdownPraser import *
 
 
@@ -42,23 +42,11 @@ def get_pmc_id(term: str, file_name: str = 'pmlist.csv') -> None:
     :return: 无返回值
     """
 
-    url = f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pmc&term={term}'
+    # 通过客户端请求，带上API key并遵循限速，被限流时退避重试
+    pmc_list = get_eutils_client().esearch(term, db='pmc')
+    df = pd.DataFrame({'title': pd.NA, 'pmc_id': pmc_list, 'doi': pd.NA, 'year': pd.NA})
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    }
-
-    response = requests.request("GET", url, headers=headers, timeout=10)
-
-    if response.status_code == 200:
-        data = json.loads(response.text)
-
-        pmc_list = data['esearchresult']['idlist']
-        df = pd.DataFrame({'title': pd.NA, 'pmc_id': pmc_list, 'doi': pd.NA, 'year': pd.NA})
-
-        df.to_csv(file_name, mode='w', index=False, encoding='utf-8')
-    else:
-        raise Exception('下载请求失败')
+    df.to_csv(file_name, mode='w', index=False, encoding='utf-8')
 
 
 @retry(delay=random.uniform(2.0, 5.0))
@@ -72,24 +60,9 @@ def download_paper_data(pmc_id: str, config: Config = None) -> Tuple[int, dict]:
     """
 
     if config is None:
-        config = Config()
-
-    url = (f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pmc&id={pmc_id}'
-           f'&retmode=xml&api_key={config.pubmed_config.api_key}')
-
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    }
-
-    with sessions.Session() as session:
-        if config.pubmed_config.use_proxy:
-            proxies = {
-                'http': config.get_proxy(),
-                'https': config.get_proxy()
-            }
-            response = session.request("GET", url, headers=headers, proxies=proxies, timeout=10)
-        else:
-            response = session.request("GET", url, headers=headers, timeout=10)
+        config = load_config()
+
+    response = get_eutils_client(config).request('efetch.fcgi', {'db': 'pmc', 'id': pmc_id, 'retmode': 'xml'})
 
     if response.status_code == 200:
         soup = BeautifulSoup(response.text, 'xml')
@@ -125,6 +98,49 @@ def download_paper_data(pmc_id: str, config: Config = None) -> Tuple[int, dict]:
         raise Exception('下载请求失败')
 
 
+_XML_DECLARATION = re.compile(r'^\s*<\?xml[^>]*\?>')
+
+_X_FRONT = etree.XPath('(//front)[1]')
+_X_JOURNAL_META = etree.XPath('(.//journal-meta)[1]')
+_X_ISSN_PPUB = etree.XPath('(.//issn[@pub-type="ppub"])[1]')
+_X_ISSN_EPUB = etree.XPath('(.//issn[@pub-type="epub"])[1]')
+_X_CONTRIB_GROUP = etree.XPath('(//contrib-group)[1]')
+_X_NAME = etree.XPath('(.//name)[1]')
+_X_SURNAME = etree.XPath('(.//surname)[1]')
+_X_GIVEN_NAMES = etree.XPath('(.//given-names)[1]')
+_X_PUB_DATE = etree.XPath('(//pub-date)[1]')
+_X_YEAR = etree.XPath('(.//year)[1]')
+_X_ARTICLE_DOI = etree.XPath('(//article-id[@pub-id-type="doi"])[1]')
+_X_KEYWORDS = etree.XPath('(//*[self::keywords or self::kwd-group])[1]')
+_X_KEYWORD = etree.XPath('.//*[self::term or self::kwd]')
+_X_ARTICLE_TITLE = etree.XPath('(//article-title)[1]')
+_X_ABSTRACT = etree.XPath('(//abstract)[1]')
+_X_BODY = etree.XPath('(//body)[1]')
+_X_REF_LIST = etree.XPath('(//ref-list)[1]')
+_X_HAS_BIBR = etree.XPath('boolean(.//xref[@ref-type="bibr"])')
+_X_REF_TITLE = etree.XPath('(.//article-title)[1]')
+_X_REF_DOI = etree.XPath('(.//pub-id[@pub-id-type="doi"])[1]')
+_X_REF_PMID = etree.XPath('(.//pub-id[@pub-id-type="pmid"])[1]')
+
+_CITATION_TAGS = {'element-citation', 'mixed-citation'}
+
+
+def __render_text(node: etree._Element, replacements: dict[etree._Element, str]) -> str:
+    """
+    拼接节点文本，并将指定的直接子节点替换为给定的字符串，效果与在BeautifulSoup中替换节点后取 .text 相同，
+    但不修改文档树。
+    """
+    parts = [node.text or '']
+    for child in node:
+        if child in replacements:
+            parts.append(replacements[child])
+        elif isinstance(child.tag, str):
+            parts.append(node_text(child))
+        parts.append(child.tail or '')
+
+    return ''.join(parts)
+
+
 def parse_paper_data(xml_text: str, silent: bool = True) -> Tuple[bool, Paper]:
     """
     从给定的XML文本中解析论文数据。
@@ -133,23 +149,22 @@ def parse_paper_data(xml_text: str, silent: bool = True) -> Tuple[bool, Paper]:
     :param silent: 是否静默运行
     :return: 格式化后的section列表
     """
-
-    # 使用BeautifulSoup解析XML文本
-    soup = BeautifulSoup(xml_text, 'xml')
+    parser = etree.XMLParser(recover=True, huge_tree=True, resolve_entities=False, remove_pis=True)
+    root = etree.fromstring(_XML_DECLARATION.sub('', xml_text, count=1), parser)
 
     try:
         # 尝试获取纸质版本的ISSN号，如果不存在则获取电子版本的ISSN号
-        issn_block = soup.find('front').find('journal-meta').find('issn', {'pub-type': 'ppub'})
-        if not issn_block:
-            issn_block = soup.find('front').find('journal-meta').find('issn', {'pub-type': 'epub'})
+        journal_meta = first_node(first_node(root, _X_FRONT), _X_JOURNAL_META)
+        issn_block = first_node(journal_meta, _X_ISSN_PPUB)
+        if issn_block is None:
+            issn_block = first_node(journal_meta, _X_ISSN_EPUB)
 
-        issn = issn_block.text if issn_block else None
+        issn = node_text(issn_block) if issn_block is not None else None
     except Exception as e:
         if not silent:
             logger.warning(e)
-        issn = None  # 如果无法获取ISSN号，则最终设置为None
+        issn = None
 
-    # 检查ISSN号是否需要修正，并设置相应的标识
     global reference_type
     if issn and issn in fuck_journal:
         reference_type = RefIdType.SB
@@ -159,25 +174,24 @@ def parse_paper_data(xml_text: str, silent: bool = True) -> Tuple[bool, Paper]:
         reference_type = RefIdType.NORMAL
 
     # 提取论文作者信息
-    author_block = soup.find('contrib-group').find('name')
-    author = __extract_author_name(author_block) if author_block else ''
+    contrib_group = first_node(root, _X_CONTRIB_GROUP)
+    if contrib_group is None:
+        raise ValueError('missing contrib-group')
+    author_block = first_node(contrib_group, _X_NAME)
+    author = __extract_author_name(author_block) if author_block is not None else ''
 
     # 提取文章的DOI和发表年份
-    year = soup.find('pub-date').find('year').text \
-        if soup.find('pub-date') \
-        else ''
+    pub_date = first_node(root, _X_PUB_DATE)
+    year = node_text(first_node(pub_date, _X_YEAR)) if pub_date is not None else ''
 
-    doi = soup.find('article-id', {'pub-id-type': 'doi'}).text \
-        if soup.find('article-id', {'pub-id-type': 'doi'}) \
-        else ''
+    doi_block = first_node(root, _X_ARTICLE_DOI)
+    doi = node_text(doi_block) if doi_block is not None else ''
 
     # 关键词
     keywords = []
-    if soup.find(['keywords', 'kwd-group']):
-        keyword_list = soup.find(['keywords', 'kwd-group']).find_all(['term', 'kwd'])
-
-        for kw in keyword_list:
-            keywords.append(kw.text.replace('\n', '').replace('\r', ' ').strip())
+    if (keyword_block := first_node(root, _X_KEYWORDS)) is not None:
+        for kw in _X_KEYWORD(keyword_block):
+            keywords.append(node_text(kw).replace('\n', '').replace('\r', ' ').strip())
     if len(keywords) == 0:
         keywords.append('')
 
@@ -190,131 +204,129 @@ def parse_paper_data(xml_text: str, silent: bool = True) -> Tuple[bool, Paper]:
         doi.replace('\n', '').replace('\r', '').strip()
     )
 
-    # 初始化论文章节列表
     sections: list[Section] = []
-    # 提取并处理论文标题
-    title = soup.find('article-title').text.replace('\n', ' ') \
-        if soup.find('article-title') \
-        else None
+    title_block = first_node(root, _X_ARTICLE_TITLE)
+    title = node_text(title_block).replace('\n', ' ') if title_block is not None else None
     title = replace_multiple_spaces(title)
     sections.append(Section(title, 1))
 
-    # 提取论文摘要和正文部分
-    abs_block = soup.find('abstract')
-    main_sections = soup.select_one('body')
+    abs_block = first_node(root, _X_ABSTRACT)
+    main_sections = first_node(root, _X_BODY)
 
-    # 尝试提取论文引用信息
-    ref_block = soup.find('ref-list')
-    if ref_block is None or len(ref_block) == 0:
+    # 与BeautifulSoup中 len(tag) 的含义一致：没有任何子节点(包括文本)
+    ref_block = first_node(root, _X_REF_LIST)
+    if ref_block is None or (len(ref_block) == 0 and not ref_block.text):
         if not silent:
             logger.warning(f'{doi} has no reference')
-        return False, Paper(paper_info, sections, {'source_doi': doi, 'ref_data': []})
+        return False, Paper(paper_info, sections, Reference(doi))
 
-    # 如果存在摘要，将其添加为一个章节，并处理摘要内容及引用信息
-    if abs_block:
+    if abs_block is not None:
         sections.append(Section('Abstract', 2))
         sections = __solve_section(abs_block, sections, 2)
     else:
         if not silent:
             logger.warning(f'{doi} has no Abstract')
-        return False, Paper(paper_info, sections, {'source_doi': doi, 'ref_data': []})
+        return False, Paper(paper_info, sections, Reference(doi))
 
-    # 处理正文部分的章节信息
-    if main_sections:
+    if main_sections is not None:
         sections = __solve_section(main_sections, sections, 1)
 
-    # 添加参考文献
     global mix_ref
     ref_data = __extract_ref(ref_block, mix_ref)
 
-    # 返回解析后的论文信息
-    return True, Paper(paper_info, sections, {'source_doi': doi, 'ref_data': ref_data})
+    return True, Paper(paper_info, sections, Reference(doi, ref_data))
 
 
-def __extract_author_name(xml_block: BeautifulSoup | NavigableString | None) -> str:
+def __extract_author_name(name_block: etree._Element) -> str:
     """
     从XML块中提取作者的姓名。
 
-    :param xml_block: 包含作者信息的BeautifulSoup对象或NavigableString对象，或为None。
+    :param name_block: 包含作者信息的name节点
     :return: 格式化后的作者姓名，格式为"姓, 名首字母."。
     """
-    # 提取作者的姓氏
-    surname = xml_block.find('surname').text
-    # 尝试提取作者的名字，如果不存在则默认为空字符串
-    given_names = xml_block.find('given-names').text if xml_block.find('given-names') else ''
+    surname = node_text(first_node(name_block, _X_SURNAME))
+    given_block = first_node(name_block, _X_GIVEN_NAMES)
+    given_names = node_text(given_block) if given_block is not None else ''
 
-    # 将名字拆分并提取首字母，形成缩写
     initials = ' '.join([name[0] + '.' for name in given_names.split()])
 
-    # 返回格式化后的姓名
     return f'{surname}, {initials}'
 
 
-def __solve_section(
-        soup: BeautifulSoup,
-        sections: list[Section],
-        title_level: int
-) -> list[Section]:
+def __solve_section(node: etree._Element, sections: list[Section], title_level: int) -> list[Section]:
     """
-    解析给定的BeautifulSoup对象，从中提取章节信息，并将其添加到sections列表中。
+    解析给定的节点，从中提取章节信息，并将其添加到sections列表中。引用标记通过__render_text拼接，不修改文档树。
 
-    :param soup: BeautifulSoup对象，代表待解析的HTML或XML文档的一部分。
+    :param node: 代表待解析的XML文档的一部分的节点。
     :param sections: Section对象列表，用于收集从文档中解析出的各个章节信息。
     :param title_level: 当前解析标题的层级，用于组织章节结构。
     :return: 更新后的Section对象列表。
     """
-    # 尝试找到章节标题
-    title = soup.find('title', recursive=False)
-    if title:
-        sections.append(Section(title.text, title_level))
+    title = node.find('title')
+    if title is not None:
+        sections.append(Section(node_text(title), title_level))
 
-    # 尝试找到所有的sec标签，递归解析它们
-    section_list = soup.find_all('sec', recursive=False)
+    section_list = node.findall('sec')
     if section_list:
         for sec in section_list:
             sections = __solve_section(sec, sections, title_level + 1)
-    else:
-        # 如果没有sec标签，尝试解析段落p标签
-        p_tags = soup.find_all('p', recursive=False)
-        for p_tag in p_tags:
-            if p_tag and not p_tag.text == '':
-                matches = re.findall(r'\[\s*\d+\s*(?:,\s*\d+\s*)*]', p_tag.text)
-                if matches:
-                    # 处理傻逼格式
-                    section_text = p_tag.text.strip().replace('\n', ' ')
-                    section_text = deal_sb_paper(section_text)
-                else:
-                    # 提取段落文本，处理换行符，并尝试找到引用信息
-                    sup_block = p_tag.find_all('sup', recursive=False)
-                    found = False
-                    for sup in sup_block:
-                        tag = sup.find('xref', {'ref-type': 'bibr'})
-                        if tag:
-                            target_info = parse_range_string(sup.text)
-                            found = True
-                        else:
-                            continue
-
-                        sup.insert_after(''.join([f'[^{ref_id}]' for ref_id in target_info]))
-                        sup.extract()
-
-                    if p_tag.find('xref', {'ref-type': 'bibr'}) and not found:
-                        ref_block = p_tag.find_all('xref', {'ref-type': 'bibr'}, recursive=False)
-                        for ref_tag in ref_block:
-                            target_info = ref_tag.text
-                            ref_tag.insert_after(f'[^{target_info}]')
-                            ref_tag.extract()
-
-                        section_text = p_tag.text.strip().replace('\n', ' ')
-                    else:
-                        section_text = p_tag.text.strip().replace('\n', ' ')
-
-                section = replace_multiple_spaces(section_text)
-                sections.append(Section(section, 0))
+        return sections
+
+    for p_tag in node.findall('p'):
+        p_text = node_text(p_tag)
+        if p_text == '':
+            continue
+
+        if re.findall(r'\[\s*\d+\s*(?:,\s*\d+\s*)*]', p_text):
+            # 处理傻逼格式
+            section_text = deal_sb_paper(p_text.strip().replace('\n', ' '))
+        else:
+            replacements = {}
+            for sup in p_tag.findall('sup'):
+                if _X_HAS_BIBR(sup):
+                    target_info = parse_range_string(node_text(sup))
+                    replacements[sup] = ''.join([f'[^{ref_id}]' for ref_id in target_info])
+
+            if not replacements and _X_HAS_BIBR(p_tag):
+                for ref_tag in p_tag.findall('xref[@ref-type="bibr"]'):
+                    replacements[ref_tag] = f'[^{node_text(ref_tag)}]'
+
+            section_text = __render_text(p_tag, replacements).strip().replace('\n', ' ')
+
+        sections.append(Section(replace_multiple_spaces(section_text), 0))
 
     return sections
 
 
+def __extract_ref(ref_list: etree._Element, check_mix: bool = False) -> List[Dict[str, Any]]:
+    ref_data = []
+
+    for ref_block in ref_list.findall('ref'):
+        element_blocks = [child for child in ref_block if child.tag in _CITATION_TAGS]
+        if len(element_blocks) == 1:
+            ref_data.append(__get_ref_info(ref_block))
+        elif check_mix:
+            ref_data.append([__get_ref_info(element_block) for element_block in element_blocks])
+        else:
+            for element_block in element_blocks:
+                ref_data.append(__get_ref_info(element_block))
+
+    return ref_data
+
+
+def __get_ref_info(ref_block: etree._Element) -> Dict:
+    ref_title_block = first_node(ref_block, _X_REF_TITLE)
+    ref_title = node_text(ref_title_block).replace('\n', '').replace('\r', ' ') if ref_title_block is not None else ''
+
+    ref_doi_block = first_node(ref_block, _X_REF_DOI)
+    ref_doi = node_text(ref_doi_block) if ref_doi_block is not None else ''
+
+    ref_pm_block = first_node(ref_block, _X_REF_PMID)
+    ref_pm = node_text(ref_pm_block) if ref_pm_block is not None else ''
+
+    return {'title': ref_title, 'pmid': ref_pm, 'pmc': '', 'doi': ref_doi}
+
+
 def deal_sb_paper(origin_str: str) -> str:
     matches = re.findall(r'\[\s*\d+\s*(?:,\s*\d+\s*)*]', origin_str)
 
@@ -339,46 +351,6 @@ def deal_sb_paper(origin_str: str) -> str:
     return origin_str
 
 
-def __extract_ref(ref_soup: BeautifulSoup, check_mix: bool = False) -> List[Dict[str, Any]]:
-    ref_blocks = ref_soup.find_all('ref', recursive=False)
-    ref_list = []
-
-    for ref_block in ref_blocks:
-        element_blocks = ref_block.find_all(['element-citation', 'mixed-citation'], recursive=False)
-        if len(element_blocks) == 1:
-            ref_list.append(__get_ref_info(ref_block))
-        else:
-            if check_mix:
-                temp = []
-                for element_block in element_blocks:
-                    temp.append(__get_ref_info(element_block))
-                ref_list.append(temp)
-            else:
-                for element_block in element_blocks:
-                    ref_list.append(__get_ref_info(element_block))
-
-    return ref_list
-
-
-def __get_ref_info(ref_block: BeautifulSoup) -> Dict:
-    if ref_title_block := ref_block.find('article-title'):
-        ref_title = ref_title_block.text.replace('\n', '').replace('\r', ' ')
-    else:
-        ref_title = ''
-
-    if ref_doi_block := ref_block.find('pub-id', {'pub-id-type': 'doi'}):
-        ref_doi = ref_doi_block.text
-    else:
-        ref_doi = ''
-
-    if ref_pm_block := ref_block.find('pub-id', {'pub-id-type': 'pmid'}):
-        ref_pm = ref_pm_block.text
-    else:
-        ref_pm = ''
-
-    return {'title': ref_title, 'pmid': ref_pm, 'pmc': '', 'doi': ref_doi}
-
-
 def remove_last_digit(input_string: str) -> str:
     return input_string.rstrip('0123456789')
 
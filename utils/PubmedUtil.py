@@ -1,235 +1,515 @@
 import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 from enum import IntEnum
-from typing import Dict, Any
+from typing import Dict, Any, Callable, Iterator, Sequence, Tuple
 
 import pandas as pd
 import requests
-
-from bs4 import BeautifulSoup
+from lxml import etree
 from loguru import logger
 
-from Config import Config
+from Config import Config, HttpConfig, load_config
+from storage.SqliteStore import HttpResponseCache
 from utils.Decorator import retry
+from utils.HttpUtil import HostClass, get_http_cache, get_session
 from utils.MarkdownPraser import PaperInfo, Section, PaperType, Paper, Reference
+from utils.RateLimiter import get_bucket
+
+EUTILS_URL = 'https://eutils.ncbi.nlm.nih.gov/entrez/eutils'
+IDCONV_URL = 'https://www.ncbi.nlm.nih.gov/pmc/utils/idconv/v1.0/'
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+HEADERS = {'User-Agent': USER_AGENT}
+
+# NCBI的限额：有API key时每秒10次请求，没有时每秒3次
+RATE_WITH_KEY = 10
+RATE_WITHOUT_KEY = 3
+# 每次按DOI检索时合并的DOI数量，过长的检索式会被拒绝
+DOI_SEARCH_BATCH_SIZE = 50
+# PMC ID转换接口每次最多200个ID
+IDCONV_BATCH_SIZE = 200
 
 
 class SearchType(IntEnum):
-    TITLE: 0
-    DOI: 1
-    PM: 2
+    TITLE = 0
+    DOI = 1
+    PM = 2
+
+
+class EUtilsClient:
+    def __init__(
+            self,
+            api_key: str = '',
+            proxy: str = None,
+            requests_per_second: float = 0,
+            batch_size: int = 200,
+            timeout: int = 30,
+            max_retries: int = 5,
+            cache: HttpResponseCache = None,
+            http_config: HttpConfig = None
+    ):
+        """
+        NCBI E-utilities客户端。复用连接池，多个ID合并为一次efetch请求，
+        同一个API key的所有请求共用一个令牌桶，按照配额限速而不是固定休眠。
+        提供缓存时，命中缓存的请求不发出网络请求，也不消耗令牌。
+
+        :param api_key: NCBI API key
+        :param proxy: 代理地址
+        :param requests_per_second: 每秒请求数，为0时根据是否有API key选择NCBI的限额
+        :param batch_size: 每次efetch的ID数量
+        :param timeout: 请求超时时间(秒)
+        :param max_retries: 被限流(429)时的最大重试次数
+        :param cache: HTTP响应缓存
+        :param http_config: 连接池配置
+        """
+        self.api_key = api_key
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.max_retries = max_retries
+
+        rate = requests_per_second or (RATE_WITH_KEY if api_key else RATE_WITHOUT_KEY)
+        self.bucket = get_bucket(f'eutils:{api_key}', rate)
+
+        # 同一代理下的NCBI请求共用一个连接池；限速放在传输层，命中缓存的请求不消耗令牌
+        self.session = get_session(
+            HostClass.NCBI,
+            proxy,
+            http_config=http_config,
+            cache=cache,
+            before_send=self.bucket.acquire
+        )
+
+    def request(self, endpoint: str, params: dict[str, Any], method: str = 'GET') -> requests.Response:
+        """
+        发送限速后的请求。ID列表较长时使用POST，参数放在请求体中。
+
+        :param endpoint: 接口名，例如 efetch.fcgi，也可以是NCBI其他接口的完整地址
+        :param params: 请求参数，不需要包含api_key
+        :param method: GET 或 POST
+        :return: 响应
+        """
+        params = {**params, 'api_key': self.api_key} if self.api_key else params
+        url = endpoint if endpoint.startswith('http') else f'{EUTILS_URL}/{endpoint}'
+
+        for _ in range(self.max_retries):
+            if method == 'POST':
+                response = self.session.post(url, data=params, headers=HEADERS, timeout=self.timeout)
+            else:
+                response = self.session.get(url, params=params, headers=HEADERS, timeout=self.timeout)
+
+            if response.status_code == 429:
+                self.bucket.penalize(float(response.headers.get('Retry-After', 1)))
+                continue
+
+            response.raise_for_status()
+            return response
+
+        raise Exception(f'{endpoint} 请求被限流')
+
+    def efetch(self, ids: Sequence[str], db: str = 'pubmed') -> Iterator[etree._Element]:
+        """
+        分批获取文献的XML。
+
+        :param ids: PMID列表
+        :param db: 数据库
+        :return: 逐个返回PubmedArticle节点
+        """
+        ids = list(dict.fromkeys(str(_id) for _id in ids if _id))
+        parser = etree.XMLParser(recover=True, huge_tree=True, resolve_entities=False)
+        for i in range(0, len(ids), self.batch_size):
+            batch = ids[i:i + self.batch_size]
+            response = self.request(
+                'efetch.fcgi',
+                {'db': db, 'id': ','.join(batch), 'retmode': 'xml'},
+                method='POST'
+            )
+            root = etree.fromstring(response.content, parser)
+            if root is None:
+                logger.error(f'empty efetch response for {len(batch)} ids')
+                continue
+
+            yield from root.iterfind('PubmedArticle')
+
+    def idconv(self, ids: Sequence[str]) -> dict[str, str]:
+        """
+        通过PMC ID转换接口将DOI批量转换为PMID，只能转换PMC收录的文献。
+
+        :param ids: DOI列表，每次不超过200个
+        :return: 小写DOI到PMID的映射
+        """
+        response = self.request(
+            IDCONV_URL,
+            {'ids': ','.join(ids), 'format': 'json', 'tool': 'rag_tool'},
+        )
 
+        return {
+            record['doi'].lower(): str(record['pmid'])
+            for record in response.json().get('records', [])
+            if record.get('doi') and record.get('pmid')
+        }
 
-@retry(delay=random.uniform(2.0, 5.0))
-def get_paper_info(pmid: str, config: Config = None, silent: bool = True) -> tuple[Paper, str | None]:
-    """
-    根据PubMed ID (PMID) 获取论文信息。
+    def esearch(self, term: str, db: str = 'pubmed', retmax: int = 20) -> list[str]:
+        """
+        检索文献。
 
-    :param pmid: 需要查询的PubMed ID。
-    :param config: 包含API密钥和代理配置的配置对象。如果未提供，则使用默认配置。
-    :param silent: 是否在查询时记录日志信息。默认为True，即不记录。
-    :return: 返回一个Paper对象，包含论文的各种信息，如标题、作者、年份、摘要等。
-    """
+        :param term: 检索式
+        :param db: 数据库
+        :param retmax: 最多返回的ID数量
+        :return: ID列表
+        """
+        response = self.request(
+            'esearch.fcgi',
+            {'db': db, 'term': term, 'retmode': 'json', 'retmax': retmax},
+            method='POST'
+        )
+        return response.json().get('esearchresult', {}).get('idlist', [])
 
-    if config is None:
-        config = Config()
 
-    if not silent:
-        logger.info(f'request PMID:{pmid}')
-    url = (f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id={pmid}'
-           f'&retmode=xml&api_key={config.pubmed_config.api_key}')
+_CLIENTS: dict[tuple, EUtilsClient] = {}
+_CLIENTS_LOCK = threading.Lock()
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    }
 
-    if config.pubmed_config.use_proxy:
-        proxies = {
-            'http': config.get_proxy(),
-            'https': config.get_proxy()
-        }
-        response = requests.request("GET", url, headers=headers, proxies=proxies, timeout=10)
-    else:
-        response = requests.request("GET", url, headers=headers, timeout=10)
+def get_eutils_client(config: Config = None) -> EUtilsClient:
+    """
+    获取共享的E-utilities客户端，相同的API key与代理设置复用同一个连接池。
+
+    :param config: 配置，为空时使用默认配置
+    :return: 客户端
+    """
+    if config is None:
+        config = load_config()
 
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'xml')
+    pubmed_cfg = config.pubmed_config
+    proxy = config.get_proxy() if pubmed_cfg.use_proxy else None
+    key = (pubmed_cfg.api_key, proxy, pubmed_cfg.requests_per_second, pubmed_cfg.batch_size)
 
-        title = soup.find('Article').find('ArticleTitle').text if soup.find('Article') else None
-        year = (soup.find('Article')
-                .find('JournalIssue')
-                .find('PubDate').find('Year').text)
+    with _CLIENTS_LOCK:
+        if key not in _CLIENTS:
+            _CLIENTS[key] = EUtilsClient(
+                pubmed_cfg.api_key,
+                proxy,
+                pubmed_cfg.requests_per_second,
+                pubmed_cfg.batch_size,
+                cache=get_http_cache(config),
+                http_config=config.http_config
+            )
 
-        author = ''
-        if author_block := soup.find('Author'):
-            last_name = author_block.find('LastName').text if author_block.find('LastName') else ''
-            initials = author_block.find('Initials').text if author_block.find('Initials') else ''
-            author = f'{last_name}, {initials}'
+        return _CLIENTS[key]
 
-        abstract = soup.find('AbstractText').text if soup.find('AbstractText') else None
 
-        keyword_list = soup.find('KeywordList')
-        if keyword_list:
-            keywords = [keyword.text for keyword in keyword_list.find_all('Keyword')]
-        else:
-            keywords = []
+def __text(node: etree._Element | None) -> str | None:
+    return ''.join(node.itertext()) if node is not None else None
 
-        doi_block = soup.find('ArticleIdList').find('ArticleId', {'IdType': 'doi'})
-        if doi_block:
-            doi = doi_block.text
-        else:
-            doi = None
-            logger.warning('DOI not found')
 
-        pmc_block = soup.find('ArticleIdList').find('ArticleId', {'IdType': 'pmc'})
-        if pmc_block:
-            pmc = pmc_block.text.replace('PMC', '')
-        else:
-            pmc = None
+def __article_id(article: etree._Element, id_type: str) -> str | None:
+    return __text(article.find(f'PubmedData/ArticleIdList/ArticleId[@IdType="{id_type}"]'))
 
-        ref_block = soup.find('ReferenceList')
 
-        ref_list = []
-        if ref_block:
-            for ref in ref_block.find_all('Reference'):
-                if id_list := ref.find('ArticleIdList'):
-                    if ref_pmc_block := id_list.find('ArticleId', {'IdType': 'pmc'}):
-                        ref_pmc = ref_pmc_block.text
-                    else:
-                        ref_pmc = pd.NA
+def __pub_year(article: etree._Element) -> int:
+    pub_date = article.find('MedlineCitation/Article/Journal/JournalIssue/PubDate')
+    if pub_date is None:
+        return -1
 
-                    if ref_pm_block := id_list.find('ArticleId', {'IdType': 'pubmed'}):
-                        ref_pm = ref_pm_block.text
-                    else:
-                        ref_pm = pd.NA
+    if (year := pub_date.findtext('Year')) is not None:
+        return int(year)
 
-                    if ref_doi_block := id_list.find('ArticleId', {'IdType': 'doi'}):
-                        ref_doi = ref_doi_block.text
-                    else:
-                        ref_doi = pd.NA
+    # 部分文献只有 MedlineDate，例如 "2019 Nov-Dec"
+    medline_date = pub_date.findtext('MedlineDate') or ''
+    return int(medline_date[:4]) if medline_date[:4].isdigit() else -1
 
-                    ref_list.append({'doi': ref_doi, 'pubmed': ref_pm, 'pmc': ref_pmc})
 
-        if pmc is None:
-            paper_info = PaperInfo(author, int(year), PaperType.GROBID_PAPER, ''.join(keywords), True, doi)
-        else:
-            paper_info = PaperInfo(author, int(year), PaperType.PMC_PAPER, ''.join(keywords), True, doi)
-
-        section_list = [
-            Section(title, 1),
-            Section('Abstract', 2),
-            Section(abstract, 0)
-        ]
-        return Paper(paper_info, section_list, Reference(doi, ref_list)), pmc
-    else:
-        # 请求失败时抛出异常
-        raise Exception('下载请求失败')
+def article_pmid(article: etree._Element) -> str:
+    return article.findtext('MedlineCitation/PMID', '')
 
 
-@retry(delay=random.uniform(2.0, 5.0))
-def get_info_by_term(term: str, search_type: int, config: Config = None, silent: bool = True) -> Dict[str, Any]:
+def parse_pubmed_article(article: etree._Element) -> tuple[Paper, str | None]:
     """
-    通过标题、doi号等补全参考文献信息
+    解析efetch返回的单篇文献。
 
-    :param term: 查询关键字，可以是标题、DOI号、PMID
-    :param search_type: 查询类别
-    :param config:
-    :param silent:
-    :return: 包含索引信息的字典
+    :param article: PubmedArticle节点
+    :return: 论文信息及PMC编号(不含PMC前缀)，没有PMC全文时为None
     """
-    if config is None:
-        config = Config()
-
-    if search_type == SearchType.TITLE:
-        if not silent:
-            logger.info(f'search title: {term}')
-
-        url = (f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&term={term}'
-               f'&retmode=xml&api_key={config.pubmed_config.api_key}')
+    title = __text(article.find('MedlineCitation/Article/ArticleTitle'))
+    year = __pub_year(article)
+
+    author = ''
+    if (author_block := article.find('.//AuthorList/Author')) is not None:
+        last_name = author_block.findtext('LastName', '')
+        initials = author_block.findtext('Initials', '')
+        author = f'{last_name}, {initials}'
+
+    abstract = __text(article.find('.//AbstractText'))
+    keywords = [__text(keyword) for keyword in article.iterfind('.//KeywordList/Keyword')]
+
+    doi = __article_id(article, 'doi')
+    if doi is None:
+        logger.warning(f'DOI not found: {article_pmid(article)}')
+
+    pmc = __article_id(article, 'pmc')
+    if pmc is not None:
+        pmc = pmc.replace('PMC', '')
+
+    ref_list = []
+    for ref in article.iterfind('PubmedData/ReferenceList//Reference'):
+        if (id_list := ref.find('ArticleIdList')) is not None:
+            ref_pmc = __text(id_list.find('ArticleId[@IdType="pmc"]'))
+            ref_pm = __text(id_list.find('ArticleId[@IdType="pubmed"]'))
+            ref_doi = __text(id_list.find('ArticleId[@IdType="doi"]'))
+
+            ref_list.append({
+                'doi': ref_doi if ref_doi is not None else pd.NA,
+                'pubmed': ref_pm if ref_pm is not None else pd.NA,
+                'pmc': ref_pmc if ref_pmc is not None else pd.NA
+            })
+
+    paper_type = PaperType.GROBID_PAPER if pmc is None else PaperType.PMC_PAPER
+    paper_info = PaperInfo(author, year, paper_type, ''.join(keywords), True, doi)
+
+    section_list = [
+        Section(title, 1),
+        Section('Abstract', 2),
+        Section(abstract, 0)
+    ]
+    return Paper(paper_info, section_list, Reference(doi, ref_list)), pmc
+
+
+def article_info(article: etree._Element) -> Dict[str, Any]:
+    """
+    提取参考文献的索引信息。
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-    elif search_type == SearchType.DOI:
-        if not silent:
-            logger.info(f'search title: {term}')
+    :param article: PubmedArticle节点
+    :return: 包含标题、PMID、PMC编号和DOI的字典
+    """
+    pmc = __article_id(article, 'pmc')
 
-        url = (f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi?db=pubmed&term={term}[doi]'
-               f'&retmode=xml&api_key={config.pubmed_config.api_key}')
+    return {
+        'title': __text(article.find('MedlineCitation/Article/ArticleTitle')),
+        'pmid': article_pmid(article),
+        'pmc': pmc.replace('PMC', '') if pmc else '',
+        'doi': __article_id(article, 'doi') or ''
+    }
 
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-        }
-    else:
-        return __get_info(term)
 
-    if config.pubmed_config.use_proxy:
-        proxies = {
-            'http': config.get_proxy(),
-            'https': config.get_proxy()
-        }
-        response = requests.request("GET", url, headers=headers, proxies=proxies, timeout=10)
-    else:
-        response = requests.request("GET", url, headers=headers, timeout=10)
+def get_papers_info(pmids: Sequence[str], config: Config = None) -> dict[str, tuple[Paper, str | None]]:
+    """
+    批量获取论文信息，每次efetch请求包含多个PMID。
 
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'xml')
+    :param pmids: PubMed ID列表
+    :param config: 包含API密钥和代理配置的配置对象
+    :return: PMID到 (论文信息, PMC编号) 的映射，查询不到的PMID不在结果中
+    """
+    client = get_eutils_client(config)
 
-        count: int = soup.find('Count').text if soup.find('Count') else 0
+    papers = {}
+    for article in client.efetch(pmids):
+        pmid = article_pmid(article)
+        try:
+            papers[pmid] = parse_pubmed_article(article)
+        except Exception as e:
+            logger.error(f'parse PMID:{pmid} failed, {repr(e)}')
 
-        if count > 0:
-            pmid = soup.find('IdList').find_all('Id')[0].text
-            return __get_info(pmid)
+    return papers
 
 
 @retry(delay=random.uniform(2.0, 5.0))
-def __get_info(pmid: str, config: Config = None) -> Dict[str, Any]:
+def get_paper_info(pmid: str, config: Config = None, silent: bool = True) -> tuple[Paper, str | None]:
     """
-    通过 PMID获取参考文献的相关信息
+    根据PubMed ID (PMID) 获取论文信息。
 
-    :param pmid:
-    :param config:
-    :return:
+    :param pmid: 需要查询的PubMed ID。
+    :param config: 包含API密钥和代理配置的配置对象。如果未提供，则使用默认配置。
+    :param silent: 是否在查询时记录日志信息。默认为True，即不记录。
+    :return: 返回一个Paper对象，包含论文的各种信息，如标题、作者、年份、摘要等。
     """
-    if config is None:
-        config = Config()
+    if not silent:
+        logger.info(f'request PMID:{pmid}')
 
-    url = (f'https://eutils.ncbi.nlm.nih.gov/entrez/eutils/efetch.fcgi?db=pubmed&id={pmid}'
-           f'&retmode=xml&api_key={config.pubmed_config.api_key}')
+    papers = get_papers_info([pmid], config)
+    if str(pmid) not in papers:
+        raise Exception('下载请求失败')
+
+    return papers[str(pmid)]
 
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
-    }
 
-    if config.pubmed_config.use_proxy:
-        proxies = {
-            'http': config.get_proxy(),
-            'https': config.get_proxy()
+def get_infos_by_terms(
+        terms: Sequence[Tuple[str, SearchType]],
+        config: Config = None,
+        silent: bool = True,
+        max_workers: int = 4,
+        progress: Callable[[int, int], None] = None
+) -> list[Dict[str, Any] | None]:
+    """
+    批量补全参考文献信息。
+    DOI先通过PMC ID转换接口批量转换，转换不到的再合并为一个检索式检索；标题逐个检索；
+    最后统一通过efetch批量获取。各批次在线程池中并发执行，总请求速率仍由令牌桶控制。
+
+    :param terms: (查询关键字, 查询类别) 列表
+    :param config: 配置
+    :param silent: 是否不记录日志
+    :param max_workers: 并发请求数
+    :param progress: 进度回调，参数为 (已完成的请求数, 当前已知的请求总数)
+    :return: 与terms一一对应的索引信息，查询不到时为None
+    """
+    client = get_eutils_client(config)
+
+    pmids: list[str | None] = [None] * len(terms)
+    doi_index: dict[str, list[int]] = {}
+    title_index: dict[str, list[int]] = {}
+    for index, (term, search_type) in enumerate(terms):
+        if not term:
+            continue
+
+        match search_type:
+            case SearchType.PM:
+                pmids[index] = str(term)
+            case SearchType.DOI:
+                doi_index.setdefault(term.lower(), []).append(index)
+            case SearchType.TITLE:
+                title_index.setdefault(term, []).append(index)
+
+    tracker = _Progress(progress)
+
+    def run(futures: dict[Future, Any]) -> Iterator[Tuple[Any, Any]]:
+        tracker.add(len(futures))
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result()
+            except Exception as e:
+                logger.error(f'reference lookup failed, {repr(e)}')
+            finally:
+                tracker.done()
+
+    dois = list(doi_index)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # DOI转换与标题检索互不依赖，同时提交
+        doi_pmid: dict[str, str] = {}
+        futures = {
+            executor.submit(client.idconv, dois[i:i + IDCONV_BATCH_SIZE]): None
+            for i in range(0, len(dois), IDCONV_BATCH_SIZE)
         }
-        response = requests.request("GET", url, headers=headers, proxies=proxies, timeout=10)
-    else:
-        response = requests.request("GET", url, headers=headers, timeout=10)
+        if not silent:
+            logger.info(f'search {len(title_index)} titles')
+        futures.update({executor.submit(client.esearch, title, retmax=1): title for title in title_index})
+        for title, result in run(futures):
+            if title is None:
+                doi_pmid.update(result)
+            elif result:
+                for index in title_index[title]:
+                    pmids[index] = result[0]
+
+        # 不在PMC中的DOI通过检索式批量检索，检索得到的PMID在efetch之后才能对应回DOI
+        remaining = [doi for doi in dois if doi not in doi_pmid]
+        if not silent and remaining:
+            logger.info(f'search {len(remaining)} dois')
+        searched = []
+        futures = {
+            executor.submit(
+                client.esearch,
+                ' OR '.join(f'"{doi}"[doi]' for doi in remaining[i:i + DOI_SEARCH_BATCH_SIZE]),
+                retmax=len(remaining[i:i + DOI_SEARCH_BATCH_SIZE]) * 2
+            ): None
+            for i in range(0, len(remaining), DOI_SEARCH_BATCH_SIZE)
+        }
+        for _, result in run(futures):
+            searched.extend(result)
 
-    if response.status_code == 200:
-        soup = BeautifulSoup(response.text, 'xml')
+        fetch_ids = list(dict.fromkeys([pmid for pmid in pmids if pmid] + list(doi_pmid.values()) + searched))
+        futures = {
+            executor.submit(lambda batch: list(client.efetch(batch)), fetch_ids[i:i + client.batch_size]): None
+            for i in range(0, len(fetch_ids), client.batch_size)
+        }
+        infos = {}
+        by_doi = {}
+        for _, articles in run(futures):
+            for article in articles:
+                info = article_info(article)
+                infos[info['pmid']] = info
+                if info['doi']:
+                    by_doi[info['doi'].lower()] = info
+
+    results = [infos.get(pmid) if pmid else None for pmid in pmids]
+    for doi, indexes in doi_index.items():
+        info = infos.get(doi_pmid[doi]) if doi in doi_pmid else by_doi.get(doi)
+        for index in indexes:
+            results[index] = info
+
+    return results
+
+
+class _Progress:
+    def __init__(self, callback: Callable[[int, int], None] = None):
+        self.callback = callback
+        self.total = 0
+        self.finished = 0
+        self._lock = threading.Lock()
+
+    def add(self, count: int) -> None:
+        with self._lock:
+            self.total += count
+            self.__report()
+
+    def done(self) -> None:
+        with self._lock:
+            self.finished += 1
+            self.__report()
+
+    def __report(self) -> None:
+        if self.callback is not None:
+            self.callback(self.finished, self.total)
+
+
+def __valid_term(value: Any) -> bool:
+    return isinstance(value, str) and value.strip() != ''
+
+
+def enrich_references(
+        ref_list: Sequence[Dict[str, Any]],
+        config: Config = None,
+        max_workers: int = 4,
+        progress: Callable[[int, int], None] = None
+) -> list[Dict[str, Any]]:
+    """
+    补全参考文献列表。每条参考文献按照 PMID > DOI > 标题 的优先级选择查询方式，
+    分组批量查询后按原顺序合并，查询不到的参考文献保持原样。
+
+    :param ref_list: 参考文献，包含title、pmid、pmc、doi字段
+    :param config: 配置
+    :param max_workers: 并发请求数
+    :param progress: 进度回调，参数为 (已完成的请求数, 当前已知的请求总数)
+    :return: 补全后的参考文献列表
+    """
+    terms = []
+    positions = []
+    for index, ref in enumerate(ref_list):
+        if __valid_term(ref.get('pmid')):
+            terms.append((ref['pmid'].strip(), SearchType.PM))
+        elif __valid_term(ref.get('doi')):
+            terms.append((ref['doi'].strip(), SearchType.DOI))
+        elif __valid_term(ref.get('title')):
+            terms.append((ref['title'].strip(), SearchType.TITLE))
+        else:
+            continue
+        positions.append(index)
 
-        title = soup.find('Article').find('ArticleTitle').text if soup.find('Article') else None
+    infos = get_infos_by_terms(terms, config, max_workers=max_workers, progress=progress)
 
-        doi_block = soup.find('ArticleIdList').find('ArticleId', {'IdType': 'doi'})
-        if doi_block:
-            doi = doi_block.text
-        else:
-            doi = ''
-            logger.warning('DOI not found')
+    results = list(ref_list)
+    for index, info in zip(positions, infos):
+        if info is not None:
+            results[index] = {**ref_list[index], **{key: value for key, value in info.items() if value}}
 
-        pmc_block = soup.find('ArticleIdList').find('ArticleId', {'IdType': 'pmc'})
-        if pmc_block:
-            pmc = pmc_block.text.replace('PMC', '')
-        else:
-            pmc = ''
+    logger.info(f'enrich {sum(info is not None for info in infos)} of {len(ref_list)} references')
+    return results
 
-        return {
-            'title': title,
-            'pmid': pmid,
-            'pmc': pmc,
-            'doi': doi
-        }
+
+def get_info_by_term(term: str, search_type: int, config: Config = None, silent: bool = True) -> Dict[str, Any]:
+    """
+    通过标题、doi号等补全参考文献信息
+
+    :param term: 查询关键字，可以是标题、DOI号、PMID
+    :param search_type: 查询类别
+    :param config:
+    :param silent:
+    :return: 包含索引信息的字典，查询不到或请求失败时为None。请求已在EUtilsClient中重试
+    """
+    return get_infos_by_terms([(term, SearchType(search_type))], config, silent)[0]
@@ -0,0 +1,78 @@
+import threading
+import time
+
+from loguru import logger
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None):
+        """
+        线程安全的令牌桶限速器。令牌以 rate 个/秒的速度补充，最多积累 capacity 个，
+        允许短时间的突发请求，长期速率不超过 rate。
+
+        :param rate: 每秒补充的令牌数
+        :param capacity: 桶容量，默认等于rate
+        """
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __refill(self) -> None:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens: float = 1) -> float:
+        """
+        取得令牌，令牌不足时阻塞等待。
+
+        :param tokens: 需要的令牌数
+        :return: 等待的时间(秒)
+        """
+        waited = 0.
+        while True:
+            with self._lock:
+                self.__refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return waited
+                wait = (tokens - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+    def penalize(self, seconds: float) -> None:
+        """
+        服务端返回限流响应(429)时清空令牌，并在指定时间内不再发放。
+        """
+        with self._lock:
+            self.__refill()
+            self._tokens = min(self._tokens, 0) - seconds * self.rate
+        logger.warning(f'rate limited, pause for {seconds}s')
+
+
+_BUCKETS: dict[str, TokenBucket] = {}
+_BUCKETS_LOCK = threading.Lock()
+
+
+def get_bucket(name: str, rate: float, capacity: float = None) -> TokenBucket:
+    """
+    获取共享的令牌桶，同一配额(例如同一个API key)的所有调用方共用一个桶。
+
+    :param name: 配额名称
+    :param rate: 每秒请求数
+    :param capacity: 桶容量
+    :return: 令牌桶
+    """
+    with _BUCKETS_LOCK:
+        bucket = _BUCKETS.get(name)
+        if bucket is None or bucket.rate != rate:
+            bucket = TokenBucket(rate, capacity)
+            _BUCKETS[name] = bucket
+
+        return bucket
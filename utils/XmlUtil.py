@@ -0,0 +1,25 @@
+from lxml import etree
+
+_X_STRING = etree.XPath('string()')
+
+
+def first_node(node: etree._Element | None, xpath: etree.XPath) -> etree._Element | None:
+    """
+    返回XPath在节点上的第一个匹配结果。
+
+    :param node: 查找的起点
+    :param xpath: 预编译的XPath
+    :return: 第一个匹配的节点，没有匹配时返回None
+    """
+    result = xpath(node)
+    return result[0] if result else None
+
+
+def node_text(node: etree._Element) -> str:
+    """
+    与BeautifulSoup的 Tag.text 相同，拼接所有后代文本节点，不包含注释。
+
+    :param node: 节点
+    :return: 节点文本
+    """
+    return str(_X_STRING(node))
@@ -0,0 +1,28 @@
+import json
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any
+
+
+class IngestStatus(IntEnum):
+    PENDING = 0
+    WRITING = 1
+    DONE = 2
+    FAILED = 3
+
+
+@dataclass
+class IngestRecord:
+    source: str
+    path: str
+    content_hash: str
+    mtime: float
+    size: int
+    status: int = IngestStatus.PENDING
+    parent_ids: list[str] = field(default_factory=list)
+    update_time: float = 0.
+
+    @classmethod
+    def from_list(cls, data: list[Any]):
+        source, path, content_hash, mtime, size, status, parent_ids, update_time = data
+        return cls(source, path, content_hash, mtime, size, IngestStatus(status), json.loads(parent_ids), update_time)
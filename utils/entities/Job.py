@@ -0,0 +1,25 @@
+import json
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any
+
+
+class JobStatus(IntEnum):
+    PENDING = 0
+    DONE = 1
+    SKIP = 2
+    FAILED = 3
+
+
+@dataclass
+class JobRecord:
+    key: str
+    status: int = JobStatus.PENDING
+    data: dict[str, Any] = field(default_factory=dict)
+    error: str = ''
+    update_time: float = 0.
+
+    @classmethod
+    def from_list(cls, data: list[Any]):
+        key, status, values, error, update_time = data
+        return cls(key, JobStatus(status), json.loads(values), error or '', update_time)